@@ -5,6 +5,114 @@ import rpy
 _chk_asarray = stats.stats._chk_asarray
 
 
+def _sorted_runs(a):
+    '''sort all columns of a 2d array and find the runs of equal values
+
+    Returns
+    -------
+    idx : ndarray, int (nvars*nobs,)
+        indices into a.T.ravel() that sort each variable, the variables
+        follow each other
+    new : ndarray, bool (nvars*nobs,)
+        true at the start of a run of equal values in the sorted array,
+        the first observation of each variable starts a run
+    '''
+    n, k = a.shape
+    at = np.ascontiguousarray(a.T).ravel()
+    idx = np.argsort(at.reshape(k, n), axis=1)
+    idx += n * np.arange(k)[:,np.newaxis]
+    idx = idx.ravel()
+    sa = at[idx]
+    new = np.empty(n * k, bool)
+    new[0] = True
+    np.not_equal(sa[1:], sa[:-1], new[1:])
+    new[::n] = True
+    return idx, new
+
+
+def rankdata2d(a):
+    '''average ranks of all columns of a 2d array
+
+    Parameters
+    ----------
+    a : array_like, 1d or 2d
+        observations in rows, variables in columns
+
+    Returns
+    -------
+    ranks : ndarray, float, same shape as a
+        ranks starting at 1, tied values get the average of their ranks as
+        in stats.rankdata
+    tiesum : ndarray (nvars,)
+        sum of t**3 - t over the groups of tied values of each column,
+        zero if there are no ties
+
+    Notes
+    -----
+    All columns are sorted with one argsort. The runs of equal values are
+    found in the sorted array with all columns concatenated, so the ranks
+    of tied values are averaged without a loop over columns.
+    '''
+    a = np.asarray(a)
+    is1d = (a.ndim == 1)
+    if is1d:
+        a = a[:,np.newaxis]
+    n, k = a.shape
+    idx, new = _sorted_runs(a)
+    ranks = np.empty(n * k)
+    if new.all():
+        # no ties, the ranks are the positions in the sorted columns
+        ranks[idx] = np.tile(np.arange(1., n + 1), k)
+        tiesum = np.zeros(k)
+    else:
+        starts = np.flatnonzero(new)
+        lengths = np.diff(np.r_[starts, n * k])
+        avgrank = (starts % n) + (lengths + 1) / 2.
+        ranks[idx] = np.repeat(avgrank, lengths)
+        lengths = lengths.astype(float)
+        tiesum = np.bincount(starts // n, weights=lengths**3 - lengths,
+                             minlength=k)
+    ranks = ranks.reshape(k, n).T
+    if is1d:
+        ranks = ranks[:,0]
+    return ranks, tiesum
+
+
+def _rankcorr(ranks, tiesum):
+    '''correlation matrix of the columns of a rank array
+
+    The mean of the ranks is (n+1)/2 and the sum of squared deviations is
+    (n**3 - n - tiesum)/12 for each column, so only one matrix product of
+    the centered ranks is needed.
+    '''
+    n = ranks.shape[0]
+    rc = ranks - (n + 1) / 2.
+    ss = (n**3 - n - tiesum) / 12.
+    return np.dot(rc.T, rc) / np.sqrt(np.outer(ss, ss))
+
+
+def _columns(x, axis):
+    '''2d array with the variables of x in columns'''
+    x, axisout = _chk_asarray(x, axis)
+    if x.ndim == 1:
+        x = x[:,np.newaxis]
+    elif axisout == 1:
+        x = x.T
+    return x
+
+
+def _ranked_columns(a, b, axis):
+    '''ranks and tie sums of a and b with variables in columns'''
+    ranks, tiesum = [], []
+    for x in (a, b):
+        if x is None:
+            continue
+        r, ts = rankdata2d(_columns(x, axis))
+        ranks.append(r)
+        tiesum.append(ts)
+    return np.hstack(ranks), np.hstack(tiesum)
+
+
 def spearmanr(a, b=None, axis=0):
     '''new version
 
@@ -45,6 +153,9 @@ def spearmanr(a, b=None, axis=0):
 
     main changes to existing stats.spearmanr
     * correct tie handling
+    * all variables are ranked at once with rankdata2d, and the correlation
+      matrix is one matrix product of the centered ranks, the variance of
+      the ranks is known from the number of observations and the ties
     * calculates correlation matrix instead of only single correlation
       coeffiecient,
       similar to np.corrcoef but using keyword argument axis=0 (default)
@@ -133,15 +244,9 @@ def spearmanr(a, b=None, axis=0):
     (0.064461446144614465, 0.52401200405558157)    
     '''
     
-    a, axisout = _chk_asarray(a, axis)
-    ar = np.apply_along_axis(stats.rankdata,axisout,a)
-    
-    br = None
-    if not b is None:
-        b, axisout = _chk_asarray(b, axis)
-        br = np.apply_along_axis(stats.rankdata,axisout,b)
-    n = a.shape[axisout]
-    rs = np.corrcoef(ar,br,rowvar=axisout)
+    ranks, tiesum = _ranked_columns(a, b, axis)
+    n = ranks.shape[0]
+    rs = _rankcorr(ranks, tiesum)
 
     t = rs * np.sqrt((n-2) / ((rs+1.0)*(1.0-rs)))
     prob = stats.t.sf(np.abs(t),n-2)*2
@@ -157,18 +262,9 @@ def spearmanr2(x,y=None,rowvar=0):
     '''using rowvar as keyword as in np.corrcoef, but opposite default
     not fully tested for all dimensionality cases
     '''
-    if rowvar:
-        axis = 1
-        n = x.shape[1]
-    else:
-        axis = 0
-        n = x.shape[0]
-    xr = np.apply_along_axis(stats.rankdata,axis,x)
-    yr = None
-    if not y is None:
-        yr = np.apply_along_axis(stats.rankdata,axis,y)
-    
-    rs = np.corrcoef(xr,yr,rowvar=rowvar)
+    ranks, tiesum = _ranked_columns(x, y, rowvar and 1 or 0)
+    n = ranks.shape[0]
+    rs = _rankcorr(ranks, tiesum)
 
     t = rs * np.sqrt((n-2) / ((rs+1.0)*(1.0-rs)))
     prob = stats.t.sf(np.abs(t),n-2)*2
@@ -178,6 +274,320 @@ def spearmanr2(x,y=None,rowvar=0):
     else:
         return rs, t, prob    
 
+def _column_codes(x):
+    '''integer codes of the values and tie counts of the columns of x
+
+    Returns
+    -------
+    codes : ndarray, int (nvars, nobs)
+        codes[i] are the values of variable i replaced by 0, 1, ... in
+        increasing order, tied values have the same code
+    order : ndarray, int (nvars, nobs)
+        order[i] sorts variable i
+    ties : ndarray (nvars, 3)
+        sums of t*(t-1), t*(t-1)*(t-2) and t*(t-1)*(2*t+5) over the groups
+        of t tied values of each variable
+    '''
+    n, k = x.shape
+    idx, new = _sorted_runs(x)
+    runid = np.cumsum(new) - 1
+    codes = np.empty(n * k, int)
+    codes[idx] = runid - np.repeat(runid[::n], n)
+    order = idx.reshape(k, n) - n * np.arange(k)[:,np.newaxis]
+    starts = np.flatnonzero(new)
+    t = np.diff(np.r_[starts, n * k]).astype(float)
+    col = starts // n
+    ties = np.column_stack([np.bincount(col, weights=w, minlength=k)
+                            for w in (t * (t - 1), t * (t - 1) * (t - 2),
+                                      t * (t - 1) * (2 * t + 5))])
+    return codes.reshape(k, n), order, ties
+
+
+def _count_discordant(y):
+    '''number of pairs i < j with y[i] > y[j] for nonnegative integers y
+
+    Bottom-up merge sort, in each pass all pairs of neighboring sorted
+    blocks are merged at once. Adding block number times (max(y) + 1) to
+    the values keeps the blocks apart, so one searchsorted finds for each
+    element of a right block the number of larger elements in the left
+    block.
+    '''
+    n = len(y)
+    m = y.max() + 1
+    pos = np.arange(n)
+    y = y.astype(np.int64)
+    ndisc = 0
+    width = 1
+    while width < n:
+        pair = pos // (2 * width)
+        right = (pos // width) % 2 == 1
+        offset = pair * m
+        keys = y + offset
+        rpair = pair[right]
+        # a left block that has a right neighbor has width elements
+        nle = np.searchsorted(keys[~right], keys[right], 'right') - rpair * width
+        ndisc += (width - nle).sum()
+        keys.sort(kind='mergesort')
+        y = keys - offset
+        width *= 2
+    return ndisc
+
+
+def _kendall_pairs(args):
+    '''discordant pairs and joint ties for a list of pairs of variables
+
+    Sorting the observations by x and y, ties in x ordered by y, is a
+    stable sort by the codes of x of the observations already sorted by y.
+    The discordant pairs are then the inversions of y, Knight's algorithm.
+    '''
+    codes, order, pairs = args
+    n = codes.shape[1]
+    res = np.empty((len(pairs), 2))
+    for ii, (i, j) in enumerate(pairs):
+        xc, yc = codes[i], codes[j]
+        oy = order[j]
+        oxy = oy[np.argsort(xc[oy], kind='mergesort')]
+        xs, ys = xc[oxy], yc[oxy]
+        same = (xs[1:] == xs[:-1]) & (ys[1:] == ys[:-1])
+        starts = np.flatnonzero(np.r_[True, ~same])
+        t = np.diff(np.r_[starts, n]).astype(float)
+        res[ii] = _count_discordant(ys), (t * (t - 1)).sum() / 2.
+    return res
+
+
+def kendalltau(a, b=None, axis=0, nprocs=None):
+    '''Kendall's tau-b for all pairs of variables
+
+    Parameters
+    ----------
+    a, b : 1D or 2D array_like, b is optional
+        variables as in spearmanr
+    axis : int or None, optional
+        If axis=0 (default), then each column represents a variable, with
+        observations in the rows. If axis=1, each row represents a
+        variable. If axis=None, then both arrays will be raveled.
+    nprocs : None or int
+        If larger than one, the pairs of variables are split into chunks
+        that are calculated by a multiprocessing.Pool with nprocs
+        processes.
+
+    Returns
+    -------
+    tau : float or array (2D square)
+        Kendall's tau-b, correlation matrix of all variables in a and b
+        combined, or coefficient if there are only 2 variables
+    p-value : float or array (2D square)
+        p-value for the two-sided test of no association, normal
+        approximation with the variance corrected for ties, same as R
+        cor.test with exact=False
+
+    Notes
+    -----
+    Each variable is sorted once and replaced by integer codes. For each
+    pair the observations are sorted by both variables and the discordant
+    pairs are counted with a merge sort, Knight's algorithm. The time is
+    O(n log n) per pair instead of O(n**2) for the comparison of all pairs
+    of observations.
+    '''
+    x = np.hstack([_columns(z, axis) for z in (a, b) if z is not None])
+    n, k = x.shape
+    codes, order, ties = _column_codes(x)
+    pairs = [(i, j) for i in range(k) for j in range(i + 1, k)]
+    if nprocs is None or nprocs < 2 or len(pairs) < 2:
+        res = _kendall_pairs((codes, order, pairs))
+    else:
+        import multiprocessing
+        chunks = [c for c in np.array_split(np.arange(len(pairs)), 4 * nprocs)
+                  if c.size > 0]
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            res = pool.map(_kendall_pairs,
+                           [(codes, order, [pairs[c] for c in chunk])
+                            for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+        res = np.vstack(res)
+    ii, jj = np.array(pairs, int).reshape(-1, 2).T
+    ndisc, nxy = res.T
+    tx, ty = ties[ii], ties[jj]
+    n = float(n)
+    n0 = n * (n - 1) / 2.
+    nx, ny = n0 - tx[:,0] / 2., n0 - ty[:,0] / 2.
+    # concordant minus discordant pairs
+    s = nx + ny - n0 + nxy - 2 * ndisc
+    var = ((n * (n - 1) * (2 * n + 5) - tx[:,2] - ty[:,2]) / 18.
+           + tx[:,0] * ty[:,0] / (2 * n * (n - 1))
+           + tx[:,1] * ty[:,1] / (9 * n * (n - 1) * (n - 2)))
+    tau = np.eye(k)
+    prob = np.zeros((k, k))
+    tau[ii,jj] = tau[jj,ii] = s / np.sqrt(nx * ny)
+    prob[ii,jj] = prob[jj,ii] = 2 * stats.norm.sf(np.abs(s) / np.sqrt(var))
+    if k == 2:
+        return tau[1,0], prob[1,0]
+    else:
+        return tau, prob
+
+
+def spearmanr_blocked(a, axis=0, blocksize=1000, threshold=None, topk=None,
+                      filename=None, tempdir=None):
+    '''Spearman correlation matrix of many variables computed in tiles
+
+    The ranks are standardized and stored as float32 in a memory-mapped
+    temporary file, and the correlations are calculated for one pair of
+    blocks of variables at a time. Only two blocks of ranks and one tile
+    of correlations are in memory.
+
+    Parameters
+    ----------
+    a : 2D array_like
+        observations and variables, a can be a memmap, e.g. from np.load
+        with mmap_mode='r'
+    axis : 0 or 1
+        If axis=0 (default), then each column represents a variable, with
+        observations in the rows. If axis=1, each row represents a variable.
+    blocksize : int
+        number of variables in a block, a tile of the correlation matrix
+        is blocksize by blocksize
+    threshold : None or float
+        If given, only correlations with absolute value of at least
+        threshold are returned
+    topk : None or int
+        If given, the topk correlations with the largest absolute value
+        are returned for each variable
+    filename : None or string
+        file for the results, a temporary file in tempdir if None and
+        neither threshold nor topk are given
+    tempdir : None or string
+        directory for the temporary files, default of tempfile.mkstemp
+
+    Returns
+    -------
+    The result depends on threshold and topk:
+
+    rho : memmap (nvars, nvars), float32
+        the full correlation matrix in the .npy file filename, if
+        threshold and topk are None
+    pairs : ndarray, structured with fields 'i', 'j', 'rho'
+        pairs i < j with abs(rho) >= threshold, if only threshold is
+        given. The records are appended to filename, if given, while the
+        tiles are calculated, and the array is then a memmap of this file.
+    index, rho : ndarray (nvars, topk)
+        indices of the topk variables and the correlations, sorted by
+        decreasing absolute value, if topk is given. index is -1 if there
+        are fewer than topk other variables, or fewer above threshold. If
+        filename is given, both are saved with np.savez. rho is nan if
+        index is -1.
+
+    Notes
+    -----
+    The correlations of the float32 ranks are accumulated in double
+    precision, their error is of the order of the float32 precision.
+    '''
+    import os
+    import tempfile
+    if axis == 1:
+        a = a.T
+    if np.ndim(a) != 2:
+        raise ValueError, 'a has to be 2 dimensional'
+    n, k = a.shape
+    blocks = [slice(start, min(start + blocksize, k))
+              for start in range(0, k, blocksize)]
+    fd, rankfile = tempfile.mkstemp(suffix='.dat', dir=tempdir)
+    os.close(fd)
+    z = np.memmap(rankfile, dtype=np.float32, mode='w+', shape=(n, k))
+    try:
+        for bl in blocks:
+            ranks, tiesum = rankdata2d(np.asarray(a[:,bl]))
+            ss = (n**3 - n - tiesum) / 12.
+            z[:,bl] = (ranks - (n + 1) / 2.) / np.sqrt(ss)
+        z.flush()
+
+        if topk is not None:
+            bestabs = -np.inf * np.ones((k, topk))
+            bestrho = np.zeros((k, topk))
+            bestidx = -np.ones((k, topk), int)
+
+            def update(rows, cols, rho):
+                absrho = np.abs(rho)
+                if threshold is not None:
+                    absrho[absrho < threshold] = -np.inf
+                # a variable is not a candidate for itself
+                vi, vj = np.arange(k)[rows], np.arange(k)[cols]
+                absrho[vi[:,np.newaxis] == vj] = -np.inf
+                cabs = np.hstack((bestabs[rows], absrho))
+                crho = np.hstack((bestrho[rows], rho))
+                cidx = np.hstack((bestidx[rows],
+                                  np.repeat([vj], len(rho), 0)))
+                sel = np.argsort(-cabs, axis=1)[:,:topk]
+                r = np.arange(len(rho))[:,np.newaxis]
+                valid = np.isfinite(cabs[r, sel])
+                bestabs[rows] = cabs[r, sel]
+                bestrho[rows] = np.where(valid, crho[r, sel], np.nan)
+                bestidx[rows] = np.where(valid, cidx[r, sel], -1)
+        elif threshold is not None:
+            pairdt = np.dtype([('i', np.int32), ('j', np.int32),
+                               ('rho', np.float32)])
+            if filename is None:
+                fh = None
+                found = []
+            else:
+                fh = open(filename, 'wb')
+        else:
+            if filename is None:
+                fd, filename = tempfile.mkstemp(suffix='.npy', dir=tempdir)
+                os.close(fd)
+            out = np.lib.format.open_memmap(filename, mode='w+',
+                                            dtype=np.float32, shape=(k, k))
+
+        for ib, bi in enumerate(blocks):
+            zi = np.asarray(z[:,bi], float)
+            for bj in blocks[ib:]:
+                if bj == bi:
+                    zj = zi
+                else:
+                    zj = np.asarray(z[:,bj], float)
+                rho = np.dot(zi.T, zj)
+                if topk is not None:
+                    update(bi, bj, rho)
+                    if bj != bi:
+                        update(bj, bi, rho.T)
+                elif threshold is not None:
+                    keep = np.abs(rho) >= threshold
+                    if bj == bi:
+                        keep = np.triu(keep, 1)
+                    r, c = np.nonzero(keep)
+                    rec = np.empty(len(r), pairdt)
+                    rec['i'] = r + bi.start
+                    rec['j'] = c + bj.start
+                    rec['rho'] = rho[r, c]
+                    if fh is None:
+                        found.append(rec)
+                    else:
+                        fh.write(rec.tostring())
+                else:
+                    out[bi,bj] = rho
+                    out[bj,bi] = rho.T
+    finally:
+        del z
+        os.remove(rankfile)
+
+    if topk is not None:
+        if filename is not None:
+            np.savez(filename, index=bestidx, rho=bestrho)
+        return bestidx, bestrho
+    elif threshold is not None:
+        if fh is None:
+            return np.concatenate(found)
+        fh.close()
+        if os.path.getsize(filename) == 0:
+            return np.empty(0, pairdt)
+        return np.memmap(filename, dtype=pairdt, mode='r')
+    else:
+        out.flush()
+        return out
+
+
 def example_from():
     '''example that shows current stats.spearmanr does not handle ties
     taken from ???'''
@@ -203,6 +613,78 @@ def example_from():
 
 
 
+def check_rankdata():
+    '''compare rankdata2d and spearmanr with stats.rankdata and np.corrcoef'''
+    from numpy.testing import assert_array_almost_equal, assert_equal
+    x = np.column_stack((np.random.randint(5, size=50),
+                         np.random.randn(50),
+                         np.random.randint(2, size=50),
+                         np.ones(50)))
+    ranks, tiesum = rankdata2d(x)
+    for i in range(x.shape[1]):
+        assert_equal(ranks[:,i], stats.rankdata(x[:,i]))
+        t = np.bincount(np.unique1d(x[:,i], return_inverse=True)[1])
+        assert_array_almost_equal(tiesum[i], (t**3 - t).sum(), 10)
+    xr = np.apply_along_axis(stats.rankdata, 0, x[:,:3])
+    yr = stats.rankdata(x[:,1]**2)
+    rs = spearmanr(x[:,:3], x[:,1]**2)[0]
+    assert_array_almost_equal(rs, np.corrcoef(xr, yr, rowvar=0), 12)
+    rs2 = spearmanr2(x[:,:3].T, rowvar=1)[0]
+    assert_array_almost_equal(rs2, rs[:3,:3], 12)
+    assert_array_almost_equal(spearmanr(x[:,0], x[:,2])[0], rs[0,2], 12)
+    assert_array_almost_equal(spearmanr(x[:,:2], axis=None)[0],
+                              spearmanr(x[:,:2].ravel(), x[:,:2].ravel())[0])
+
+
+def check_kendalltau():
+    '''compare kendalltau with tau-b from all pairs of observations'''
+    from numpy.testing import assert_array_almost_equal
+    x = np.column_stack((np.random.randint(4, size=60),
+                         np.random.randn(60),
+                         np.random.randint(10, size=60)))
+    x[:,1] += x[:,0]
+    tau, prob = kendalltau(x)
+    for i in range(3):
+        for j in range(3):
+            si = np.sign(x[:,i][:,np.newaxis] - x[:,i])
+            sj = np.sign(x[:,j][:,np.newaxis] - x[:,j])
+            taub = (si * sj).sum() / np.sqrt((si**2).sum() * (sj**2).sum())
+            assert_array_almost_equal(tau[i,j], taub, 12)
+    assert_array_almost_equal(kendalltau(x[:,0], x[:,2]),
+                              [tau[0,2], prob[0,2]], 12)
+    assert_array_almost_equal(kendalltau(x.T, axis=1)[1], prob, 12)
+
+
+def check_spearmanr_blocked():
+    '''compare the tiled results with the full spearmanr matrix'''
+    import os
+    import tempfile
+    from numpy.testing import assert_array_almost_equal, assert_equal
+    x = np.random.randint(20, size=(200, 23)) + np.random.randint(5, size=(200, 1))
+    rs = spearmanr(x)[0]
+    rho = spearmanr_blocked(x, blocksize=5)
+    assert_array_almost_equal(rho, rs, 6)
+    fname = rho.filename
+    del rho
+    os.remove(fname)
+    assert_array_almost_equal(spearmanr_blocked(x.T, axis=1, blocksize=30),
+                              rs, 6)
+    pairs = spearmanr_blocked(x, blocksize=5, threshold=0.3)
+    i, j = np.nonzero(np.triu(np.abs(rs) >= 0.3, 1))
+    assert_equal(np.sort(pairs['i'] * 23 + pairs['j']), i * 23 + j)
+    assert_array_almost_equal(pairs['rho'], rs[pairs['i'], pairs['j']], 6)
+    fd, fname = tempfile.mkstemp(suffix='.dat')
+    os.close(fd)
+    pairs2 = spearmanr_blocked(x, blocksize=7, threshold=0.3, filename=fname)
+    assert_equal(len(pairs2), len(pairs))
+    del pairs2
+    os.remove(fname)
+    index, rho = spearmanr_blocked(x, blocksize=4, topk=3)
+    rs0 = np.abs(rs) - 2 * np.eye(23)
+    assert_array_almost_equal(np.abs(rho), -np.sort(-rs0, 1)[:,:3], 6)
+    assert_array_almost_equal(rho, rs[np.arange(23)[:,np.newaxis], index], 6)
+
+
 def check_against_r():
     print 'comparing current stats.spearmanr, mstats.spearmanr and mine with R'
     print '-------------------------------------------------------------------'
@@ -296,5 +778,26 @@ def check_shape():
 
 
 if __name__ == '__main__':
+    check_rankdata()
+    check_kendalltau()
+    check_spearmanr_blocked()
+
+    import time
+    x = np.random.randint(1000, size=(100000, 50))
+    t0 = time.time()
+    xr = np.apply_along_axis(stats.rankdata, 0, x)
+    rs0 = np.corrcoef(xr, rowvar=0)
+    t1 = time.time()
+    rs = spearmanr(x)[0]
+    t2 = time.time()
+    print 'apply_along_axis and corrcoef: %6.3f seconds' % (t1 - t0)
+    print 'rankdata2d and one dot product: %6.3f seconds' % (t2 - t1)
+    print 'max abs difference', np.max(np.abs(rs - rs0))
+
+    t0 = time.time()
+    tau, prob = kendalltau(x[:,:10])
+    print 'kendalltau, 45 pairs of 100000 observations: %6.3f seconds' % \
+          (time.time() - t0)
+
     check_against_r()
     check_shape()
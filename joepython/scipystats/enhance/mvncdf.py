@@ -76,9 +76,12 @@ a wrapper for scipy.stats.kde.mvndst
 >>> scipy.stats.kde.mvn.mvndst([0.0,0.0],[0.0,0.0],[0,0],[0.99])
 (2e-016, 0.47747329317779391, 0)
 '''
+import time
 import numpy as np
 import scipy
+import scipy.special
 import scipy.stats
+from numpy.testing import assert_almost_equal
 #from scipy.stats import kde
 
 informcode = {0: 'normal completion with ERROR < EPS',
@@ -86,6 +89,432 @@ informcode = {0: 'normal completion with ERROR < EPS',
                     increase MAXPTS to decrease ERROR;''',
               2: 'N > 500 or N < 1'}
 
+def _corrpacked(corrcoef, n):
+    '''pack correlation coefficients in the format required by mvndst
+
+    The correlation coefficient in row I column J is stored in
+    CORREL( J + ((I-2)*(I-1))/2 ), for J < I, (1-based Fortran indices)
+    i.e. the lower triangle stacked by rows, as returned by np.tril_indices.
+    See mvstdnormcdf for the three ways to specify corrcoef.
+    '''
+    corrcoef = np.array(corrcoef)
+    if n==2 and corrcoef.size==1:
+        correl = corrcoef
+        #print 'case scalar rho', n
+    elif corrcoef.ndim == 1 and len(corrcoef) == n*(n-1)/2.0:
+        #print 'case flat corr', corrcoeff.shape
+        correl = corrcoef
+    elif corrcoef.shape == (n,n):
+        #print 'case square corr',  correl.shape
+        ii, jj = np.tril_indices(n, -1)
+        correl = corrcoef[ii,jj]
+    else:
+        raise ValueError, 'corrcoef has incorrect dimension'
+    return correl
+
+def _infinflags(lower, upper):
+    '''integration limits flags INFIN for mvndst, bounds can be nd
+    '''
+    lowinf = np.isneginf(lower)
+    uppinf = np.isposinf(upper)
+    infin = 2.0*np.ones(np.shape(lower))
+
+    np.putmask(infin,lowinf,0)# infin.putmask(0,lowinf)
+    np.putmask(infin,uppinf,1) #infin.putmask(1,uppinf)
+    #this has to be last
+    np.putmask(infin,lowinf*uppinf,-1)
+    return infin
+
+def _mvndst_rows(args):
+    '''call mvndst for each row of the bounds, used by mvstdnormcdf_batch
+
+    args is the tuple (lower, upper, infin, correl, kwds), with 2d
+    lower, upper and infin. It is a single argument to work with Pool.map.
+    '''
+    lower, upper, infin, correl, kwds = args
+    m = lower.shape[0]
+    error = np.zeros(m)
+    cdfvalue = np.zeros(m)
+    inform = np.zeros(m, int)
+    mvndst = scipy.stats.kde.mvn.mvndst
+    for ii in range(m):
+        error[ii], cdfvalue[ii], inform[ii] = \
+                   mvndst(lower[ii],upper[ii],infin[ii],correl,**kwds)
+    return error, cdfvalue, inform
+
+def _corrmatrix(corrcoef, n):
+    '''full correlation matrix from one of the three ways to specify corrcoef
+
+    inverse of _corrpacked, see mvstdnormcdf for the formats
+    '''
+    corrcoef = np.array(corrcoef, float)
+    if corrcoef.shape == (n,n):
+        return corrcoef
+    if n==2 and corrcoef.size==1:
+        corrcoef = corrcoef.ravel()
+    elif not (corrcoef.ndim == 1 and len(corrcoef) == n*(n-1)/2.0):
+        raise ValueError, 'corrcoef has incorrect dimension'
+    corr = np.eye(n)
+    ii, jj = np.tril_indices(n, -1)
+    corr[ii,jj] = corrcoef
+    corr[jj,ii] = corrcoef
+    return corr
+
+def _owens_t_quad(h, a):
+    '''Owen's T function by Gauss-Legendre quadrature, vectorized
+
+    T(h, a) = 1/(2*pi) * int_0^a exp(-h**2*(1+x**2)/2)/(1+x**2) dx
+
+    fallback for scipy versions without scipy.special.owens_t. The
+    quadrature is only used for abs(a) <= 1, larger a are reduced with
+    T(h, a) = (Phi(h) + Phi(a*h))/2 - Phi(h)*Phi(a*h) - T(a*h, 1/a),
+    for h, a >= 0, Owen (1956).
+    '''
+    ndtr = scipy.special.ndtr
+    h, a = np.broadcast_arrays(np.asarray(h, float), np.asarray(a, float))
+    sign = np.sign(a)
+    h, a = np.abs(h), np.abs(a)
+
+    def tquad(h, a):
+        x = a[..., np.newaxis] * _glnodes
+        fx = np.exp(-0.5*h[..., np.newaxis]**2*(1 + x*x))/(1 + x*x)
+        return a * np.dot(fx, _glweights) / (2*np.pi)
+
+    small = a <= 1
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        ainv = np.where(small, 1., 1./a)
+        ah = np.where(small | (h == 0), 0., a*h)
+        large = (0.5*(ndtr(h) + ndtr(ah)) - ndtr(h)*ndtr(ah)
+                 - tquad(ah, ainv))
+        # T(0, inf) = 1/4
+        large = np.where(np.isinf(a) & (h == 0), 0.25, large)
+    finally:
+        np.seterr(**olderr)
+    t = np.where(small, tquad(h, np.where(small, a, 0.)), large)
+    return sign * t
+
+# scipy.special.owens_t is only available in newer scipy versions
+_owens_t = getattr(scipy.special, 'owens_t', _owens_t_quad)
+
+def _bvnorm_orthant(h, k, rho):
+    '''P(X1 < h, X2 < k) for standard bivariate normal, vectorized
+
+    uses Owen's T function, Owen (1956)
+
+    Phi2(h,k;rho) = (Phi(h) + Phi(k))/2 - T(h, a_h) - T(k, a_k) - beta
+
+    with a_h = (k - rho*h)/(h*sqrt(1-rho**2)), a_k correspondingly, and
+    beta = 1/2 if h*k < 0 or (h*k == 0 and h+k < 0), else 0.
+    '''
+    ndtr, owens_t = scipy.special.ndtr, _owens_t
+    h, k, rho = np.broadcast_arrays(np.asarray(h, float), np.asarray(k, float),
+                                    np.asarray(rho, float))
+    sq = np.sqrt(np.maximum((1 - rho)*(1 + rho), 0))
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        ah = np.where(h == 0, np.sign(k)*np.inf, (k - rho*h)/(h*sq))
+        ak = np.where(k == 0, np.sign(h)*np.inf, (h - rho*k)/(k*sq))
+    finally:
+        np.seterr(**olderr)
+    beta = 0.5*((h*k < 0) | ((h*k == 0) & (h + k < 0)))
+    prob = 0.5*(ndtr(h) + ndtr(k)) - owens_t(h, ah) - owens_t(k, ak) - beta
+    # special cases
+    bothzero = (h == 0) & (k == 0)
+    prob = np.where(bothzero, 0.25 + np.arcsin(rho)/(2*np.pi), prob)
+    prob = np.where(rho >= 1, ndtr(np.minimum(h, k)), prob)
+    prob = np.where(rho <= -1, np.maximum(ndtr(h) - ndtr(-k), 0), prob)
+    return np.clip(prob, 0, 1)
+
+# Gauss-Legendre nodes and weights on [0, 1] for _owens_t_quad and
+# _tvnorm_orthant, the 12 point rule is used for the error estimate
+_glnodes, _glweights = np.polynomial.legendre.leggauss(24)
+_glnodes = (_glnodes + 1) / 2.
+_glweights = _glweights / 2.
+_glnodes12, _glweights12 = np.polynomial.legendre.leggauss(12)
+_glnodes12 = (_glnodes12 + 1) / 2.
+_glweights12 = _glweights12 / 2.
+
+def _plackett_term(ba, bb, bc, ra, rb, r, rr):
+    '''term of the Plackett integrand for the correlation r of (X1, X2)
+
+    2*pi*sqrt(1-r**2) * phi2(ba, bb; r) * Phi(u) where u is the
+    standardized upper limit bc of X3 given X1 = ba, X2 = bb, ra and rb
+    are the correlations of X3 with X1 and X2, rr = 1 - r**2. The term is
+    zero where the conditional distribution is degenerate, Genz (2004).
+    '''
+    ndtr = scipy.special.ndtr
+    det = rr * (rr - (ra - rb)**2 - 2*ra*rb*(1 - r))
+    valid = (det > 0) & (rr > 0)
+    det = np.where(valid, det, 1)
+    rr = np.where(valid, rr, 1)
+    u = (bc*rr + ba*(r*rb - ra) + bb*(r*ra - rb)) / np.sqrt(det)
+    q = (ba - r*bb)**2 / rr + bb*bb
+    return np.where(valid, np.exp(-q/2) * ndtr(u), 0)
+
+def _tvnorm_orthant(b, corr):
+    '''P(X < b) for standard trivariate normal, b is (m, 3)
+
+    Integration of Plackett's identity, Genz (2004): the correlations
+    r12, r13 are moved from 0 to their values along
+    r1j(x) = sin(x * arcsin(r1j)), x from 0 to 1. At x = 0 the probability
+    factors into Phi(b1) * Phi2(b2, b3; r23), and the derivative with
+    respect to x is
+
+        sum_j arcsin(r1j) / (2*pi) * exp(-q1j(x) / 2) * Phi(uk(x))
+
+    where q1j is the quadratic form of phi2(b1, bj; r1j) and uk is the
+    standardized conditional upper limit of the third variable, the
+    substitution removes the 1/sqrt(1 - r1j**2) of phi2. The variables are
+    permuted so that the pair with the largest absolute correlation is
+    (2, 3).
+
+    The integrand changes quickly close to x = 1 if the correlation matrix
+    is close to singular, Gauss-Legendre rules are used on intervals that
+    are halved towards x = 1 until the last interval is shorter than ten
+    times the smallest of det(corr), 1 - r12**2 and 1 - r13**2.
+
+    Returns
+    -------
+    prob : ndarray (m,)
+        orthant probabilities
+    err : ndarray (m,)
+        error estimate, difference between the 24 and the 12 point rule
+        summed over the intervals, 1 if corr is singular in double
+        precision
+    '''
+    ndtr = scipy.special.ndtr
+    corr = np.asarray(corr, float)
+    pairs = [(1, 2), (0, 2), (0, 1)]   # pair (i,j), remaining variable first
+    ip = np.argmax([abs(corr[i, j]) for i, j in pairs])
+    perm = [ip] + list(pairs[ip])
+    corr = corr[perm][:, perm]
+    b = np.asarray(b, float)[:, perm]
+    r12, r13, r23 = corr[0, 1], corr[0, 2], corr[1, 2]
+    b1, b2, b3 = [b[:, i:i+1] for i in range(3)]
+
+    prob = ndtr(b1[:, 0]) * _bvnorm_orthant(b2[:, 0], b3[:, 0], r23)
+    err = np.zeros(b.shape[0])
+    if r12 == 0 and r13 == 0:
+        return prob, err
+    a12, a13 = np.arcsin(r12), np.arcsin(r13)
+
+    def dprob(x):
+        s12, s13 = np.sin(a12*x), np.sin(a13*x)
+        c12, c13 = np.cos(a12*x)**2, np.cos(a13*x)**2
+        return (a12 * _plackett_term(b1, b2, b3, s13, r23, s12, c12) +
+                a13 * _plackett_term(b1, b3, b2, s12, r23, s13, c13)) / \
+               (2*np.pi)
+
+    det = 1 - r12**2 - r13**2 - r23**2 + 2*r12*r13*r23
+    tiny = min(det, (1 - r12)*(1 + r12), (1 - r13)*(1 + r13))
+    if tiny < 1e-14:
+        # no reliable estimate, the callers use mvndst instead
+        err[:] = 1.
+    nhalf = int(np.clip(np.ceil(-np.log2(10*max(tiny, 1e-14))), 0, 50))
+    edges = np.r_[0, 1 - 0.5**np.arange(1, nhalf+1), 1]
+    olderr = np.seterr(divide='ignore', invalid='ignore', under='ignore',
+                       over='ignore')
+    try:
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            q24 = np.dot(dprob(lo + (hi - lo)*_glnodes), _glweights)
+            q12 = np.dot(dprob(lo + (hi - lo)*_glnodes12), _glweights12)
+            prob = prob + (hi - lo)*q24
+            err = err + (hi - lo)*np.abs(q24 - q12)
+    finally:
+        np.seterr(**olderr)
+    return np.clip(prob, 0, 1), err
+
+def _rectangle(orthantcdf, lower, upper):
+    '''rectangle probability from orthant cdf by inclusion-exclusion
+
+    orthantcdf returns the orthant probabilities and their error estimate,
+    the errors of the corners are added up. Infinite limits are replaced
+    by +-40, where the normal cdf is 0 or 1 in double precision.
+    '''
+    lower = np.clip(lower, -40, 40)
+    upper = np.clip(upper, -40, 40)
+    m, n = lower.shape
+    prob = np.zeros(m)
+    err = np.zeros(m)
+    for corner in range(2**n):
+        islower = np.array([(corner >> i) & 1 for i in range(n)], bool)
+        b = np.where(islower, lower, upper)
+        # corners with a lower limit of -inf do not contribute
+        active = ~(islower & (lower <= -40)).any(1)
+        if active.any():
+            sign = (-1)**islower.sum()
+            cornerprob, cornererr = orthantcdf(b[active])
+            prob[active] += sign * cornerprob
+            err[active] += cornererr
+    return np.clip(prob, 0, 1), err
+
+def bvnormcdf(lower, upper, rho):
+    '''standardized bivariate normal rectangle probabilities, vectorized
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, 2) or 1d (2,)
+       lower and upper integration limits, can contain -np.inf or np.inf
+    rho : float
+       correlation coefficient
+
+    Returns
+    -------
+    cdfvalue : ndarray (m,)
+
+    Notes
+    -----
+    uses Owen's T function, accurate to about 1e-15
+
+    Examples
+    --------
+    >>> print bvnormcdf([-np.inf,-np.inf],[0.0,0.0],0.5)
+    [ 0.33333333]
+    '''
+    lower = np.atleast_2d(np.asarray(lower, float))
+    upper = np.atleast_2d(np.asarray(upper, float))
+    lower, upper = np.broadcast_arrays(lower, upper)
+    orthant = lambda b: (_bvnorm_orthant(b[:, 0], b[:, 1], rho), 0)
+    return _rectangle(orthant, lower, upper)[0]
+
+def tvnormcdf(lower, upper, corrcoef):
+    '''standardized trivariate normal rectangle probabilities, vectorized
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, 3) or 1d (3,)
+       lower and upper integration limits, can contain -np.inf or np.inf
+    corrcoef : array_like
+       correlation matrix, square or packed, see mvstdnormcdf
+
+    Returns
+    -------
+    cdfvalue : ndarray (m,)
+
+    Notes
+    -----
+    uses Plackett's identity and Gauss-Legendre integration on intervals
+    that are refined towards the singularity, see _tvnorm_orthant. The
+    error is about 1e-14 and stays below 1e-10 for correlations close to
+    one in absolute value. If the correlation matrix is singular in double
+    precision, det(corr) or 1 - r**2 below 1e-14, the result is not
+    reliable, mvstdnormcdf and mvstdnormcdf_batch use mvndst in this case.
+
+    Examples
+    --------
+    >>> corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]
+    >>> print tvnormcdf([-np.inf,-np.inf,-100.0], [0.0,0.0,0.0], corr)
+    [ 0.16666667]
+    '''
+    lower = np.atleast_2d(np.asarray(lower, float))
+    upper = np.atleast_2d(np.asarray(upper, float))
+    lower, upper = np.broadcast_arrays(lower, upper)
+    corr = _corrmatrix(corrcoef, 3)
+    orthant = lambda b: _tvnorm_orthant(b, corr)
+    return _rectangle(orthant, lower, upper)[0]
+
+def _cdf_lowdim(lower, upper, corr):
+    '''rectangle probabilities for n <= 3 without mvndst, bounds (m, n)
+
+    returns the probabilities and an estimate of their absolute error
+    '''
+    m, n = lower.shape
+    if n == 0:
+        return np.ones(m), np.zeros(m)
+    elif n == 1:
+        ndtr = scipy.special.ndtr
+        return ndtr(upper[:, 0]) - ndtr(lower[:, 0]), np.ones(m) * 1e-16
+    elif n == 2:
+        return bvnormcdf(lower, upper, corr[1, 0]), np.ones(m) * 1e-15
+    elif n == 3:
+        orthant = lambda b: _tvnorm_orthant(b, corr)
+        return _rectangle(orthant, lower, upper)
+    raise ValueError, 'only for dimension <= 3'
+
+def _tolerance(cdfvalue, abseps=1e-6, releps=1e-6, **kwds):
+    '''error tolerance max(abseps, releps * cdfvalue) as in mvndst
+
+    other keywords for mvndst are ignored
+    '''
+    return np.maximum(abseps, releps * np.abs(cdfvalue))
+
+def _unique_rows(a):
+    '''unique rows of a 2d array and the inverse index, like np.unique with
+    axis=0 which is not available in older numpy versions
+    '''
+    a = np.asarray(a)
+    if a.shape[0] == 0:
+        return a, np.zeros(0, int)
+    order = np.lexsort(a.T[::-1])
+    sa = a[order]
+    new = np.ones(len(sa), bool)
+    new[1:] = np.any(sa[1:] != sa[:-1], 1)
+    inverse = np.empty(len(sa), int)
+    inverse[order] = np.cumsum(new) - 1
+    return sa[new], inverse
+
+def _finite_groups(lower, upper):
+    '''group rows of the bounds by the dimensions that are not (-inf, inf)
+
+    dimensions with infinite lower and upper bound integrate to one and are
+    dropped, returns a list of (keep, rows) with index arrays.
+    '''
+    keep = ~(np.isneginf(lower) & np.isposinf(upper))
+    patterns, inverse = _unique_rows(keep)
+    return [(np.nonzero(pattern)[0], np.nonzero(inverse == ii)[0])
+            for ii, pattern in enumerate(patterns)]
+
+def _genz_bretz_order(lower, upper, corr):
+    '''variable ordering for one rectangle by Genz and Bretz prioritization
+
+    At each step the variable with the smallest conditional probability of
+    its interval is put next, conditional on the expected values of the
+    already selected variables truncated to their intervals. Integrating
+    the most restrictive variables first reduces the variance of the
+    separation of variables integrand.
+
+    Returns
+    -------
+    perm : ndarray of int
+        permutation of the variables
+    '''
+    ndtr = scipy.special.ndtr
+    n = len(lower)
+    perm = np.arange(n)
+    a = np.array(lower, float)
+    b = np.array(upper, float)
+    c = np.array(corr, float)
+    chol = np.zeros((n, n))
+    y = np.zeros(n)
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        for i in range(n):
+            sd = np.sqrt(np.maximum(np.diag(c)[i:] -
+                                    (chol[i:, :i]**2).sum(1), 1e-300))
+            mu = np.dot(chol[i:, :i], y[:i])
+            prob = ndtr((b[i:] - mu)/sd) - ndtr((a[i:] - mu)/sd)
+            j = i + np.argmin(prob)
+            if j != i:
+                for arr in (perm, a, b):
+                    arr[[i, j]] = arr[[j, i]]
+                c[[i, j]] = c[[j, i]]
+                c[:, [i, j]] = c[:, [j, i]]
+                chol[[i, j]] = chol[[j, i]]
+            sdi = sd[j - i]
+            chol[i, i] = sdi
+            chol[i+1:, i] = (c[i+1:, i] -
+                             np.dot(chol[i+1:, :i], chol[i, :i])) / sdi
+            # expected value of the truncated standard normal
+            mui = np.dot(chol[i, :i], y[:i])
+            ai, bi = (a[i] - mui)/sdi, (b[i] - mui)/sdi
+            pi = ndtr(bi) - ndtr(ai)
+            pdf = lambda x: np.exp(-0.5*x*x)/np.sqrt(2*np.pi)
+            y[i] = (pdf(ai) - pdf(bi))/pi if pi > 0 else 0.
+    finally:
+        np.seterr(**olderr)
+    return perm
+
 def mvstdnormcdf(lower, upper, corrcoef, **kwds):
     '''standardized multivariate normal cumulative distribution function
 
@@ -120,6 +549,11 @@ def mvstdnormcdf(lower, upper, corrcoef, **kwds):
 
     Notes
     -----
+    Dimensions where both bounds are infinite are dropped. If at most three
+    dimensions remain, the probability is calculated without mvndst with
+    bvnormcdf or tvnormcdf, unless the error estimate of tvnormcdf does
+    not meet the tolerance max(abseps, releps * cdfvalue).
+
     The correlation matrix corrcoef can be given in 3 different ways
     If the multivariate normal is two-dimensional than only the
     correlation coefficient needs to be provided.
@@ -131,6 +565,7 @@ def mvstdnormcdf(lower, upper, corrcoef, **kwds):
     --------
     mvnormcdf : cdf of multivariate normal distribution without
         standardization
+    mvnormcdf_adaptive : increases maxpts until the error tolerance is met
 
     Examples
     --------
@@ -138,15 +573,12 @@ def mvstdnormcdf(lower, upper, corrcoef, **kwds):
     >>> print mvstdnormcdf([-np.inf,-np.inf], [0.0,np.inf], 0.5)
     0.5
     >>> corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]    
-    >>> print mvstdnormcdf([-np.inf,-np.inf,-100.0], [0.0,0.0,0.0], corr, abseps=1e-6)
-    0.166666399198
-    >>> print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, abseps=1e-8)
-    something wrong completion with ERROR > EPS and MAXPTS function values used;
-                        increase MAXPTS to decrease ERROR; 1.048330348e-006
-    0.166666546218
-    >>> print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0], corr,
-                            maxpts=100000, abseps=1e-8)
-    0.166666588293
+    >>> print mvstdnormcdf([-np.inf,-np.inf,-100.0], [0.0,0.0,0.0], corr)
+    0.166666666667
+    >>> corr4 = 0.5 * np.eye(4) + 0.5
+    >>> print round(mvstdnormcdf([-np.inf]*4, [0.0]*4, corr4, abseps=1e-6,
+    ...                          maxpts=1000000), 5)
+    0.2
     
     '''
     n = len(lower)
@@ -154,40 +586,28 @@ def mvstdnormcdf(lower, upper, corrcoef, **kwds):
     #but it makes ndim check possible
     lower = np.array(lower)
     upper = np.array(upper)
-    corrcoef = np.array(corrcoef)
-    
-    correl = np.zeros(n*(n-1)/2.0)  #dtype necessary?
-    
+
     if (lower.ndim != 1) or (upper.ndim != 1):
         raise ValueError, 'can handle only 1D bounds'
     if len(upper) != n:
         raise ValueError, 'bounds have different lengths'
-    if n==2 and corrcoef.size==1:
-        correl = corrcoef
-        #print 'case scalar rho', n
-    elif corrcoef.ndim == 1 and len(corrcoef) == n*(n-1)/2.0:
-        #print 'case flat corr', corrcoeff.shape
-        correl = corrcoef
-    elif corrcoef.shape == (n,n):
-        #print 'case square corr',  correl.shape
-        for ii in range(n):
-            for jj in range(ii):
-                correl[ jj + ((ii-2)*(ii-1))/2] = corrcoef[ii,jj]
-    else:
-        raise ValueError, 'corrcoef has incorrect dimension'
+    correl = _corrpacked(corrcoef, n)
+
+    # drop dimensions with infinite bounds, closed form for n <= 3 if the
+    # error tolerance is met
+    keep = ~(np.isneginf(lower) & np.isposinf(upper))
+    if keep.sum() <= 3:
+        corr = _corrmatrix(corrcoef, n)[keep][:, keep]
+        cdfvalue, error = _cdf_lowdim(lower[keep][np.newaxis, :],
+                                      upper[keep][np.newaxis, :], corr)
+        if error[0] <= _tolerance(cdfvalue[0], **kwds):
+            return cdfvalue[0]
 
     if not 'maxpts' in kwds:
         if n >2:
             kwds['maxpts'] = 10000*n
 
-    lowinf = np.isneginf(lower)
-    uppinf = np.isposinf(upper)
-    infin = 2.0*np.ones(n)
-    
-    np.putmask(infin,lowinf,0)# infin.putmask(0,lowinf)
-    np.putmask(infin,uppinf,1) #infin.putmask(1,uppinf)
-    #this has to be last
-    np.putmask(infin,lowinf*uppinf,-1)
+    infin = _infinflags(lower, upper)
 
 ##    #remove infs
 ##    np.putmask(lower,lowinf,-100)# infin.putmask(0,lowinf)
@@ -257,33 +677,702 @@ def mvnormcdf(lower, upper, mu, cov, **kwds):
     return mvstdnormcdf(lower, upper, corr, **kwds)
 
 
+def mvstdnormcdf_batch(lower, upper, corrcoef, nprocs=None, **kwds):
+    '''standardized multivariate normal cdf for many rectangles
+
+    Calculates the rectangular integrals over a standardized multivariate
+    normal distribution for each row of `lower` and `upper`. The
+    correlation matrix is checked and packed only once. Dimensions where
+    both bounds are infinite are dropped. If at most three dimensions
+    remain, the probabilities are calculated vectorized with bvnormcdf or
+    tvnormcdf, if the error estimate meets the tolerance. Otherwise the
+    integration is done by
+    scipy.stats.kde.mvn.mvndst for each rectangle, which factorizes and
+    reorders the correlation matrix internally.
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, n) or 1d (n,)
+       lower and upper integration limits, each row is one rectangle and
+       the number of columns is equal to the number of dimensions of the
+       multivariate normal distribution. 1d limits are broadcast against
+       the 2d limits. It can contain -np.inf or np.inf for open
+       integration intervals.
+    corrcoef : float or array_like
+       specifies correlation matrix in one of three ways, see mvstdnormcdf
+    nprocs : None or int
+       If nprocs is larger than 1, then the rectangles are split into chunks
+       that are evaluated with a multiprocessing.Pool with nprocs processes.
+    optional keyword parameters to influence integration
+        * maxpts : int, maximum number of function values allowed.
+        * abseps : float absolute error tolerance.
+        * releps : float relative error tolerance.
+
+    Returns
+    -------
+    cdfvalue : ndarray (m,)
+        value of the integral for each rectangle
+    error : ndarray (m,)
+        estimated absolute error, with 99% confidence level
+    inform : ndarray (m,) of int
+        termination status of mvndst, see informcode
+
+    See Also
+    --------
+    mvstdnormcdf : standardized multivariate normal cdf for one rectangle
+    mvnormcdf_batch : cdf of multivariate normal distribution without
+        standardization for many rectangles
+
+    Examples
+    --------
+    >>> corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]
+    >>> upper = np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+    >>> cdfvalue, error, inform = mvstdnormcdf_batch(-np.inf, upper, corr)
+    >>> cdfvalue
+    array([ 0.16666667,  0.62697312])
+    '''
+    lower = np.atleast_2d(np.asarray(lower, float))
+    upper = np.atleast_2d(np.asarray(upper, float))
+    lower, upper = np.broadcast_arrays(lower, upper)
+    if lower.ndim != 2:
+        raise ValueError, 'can handle only 1D or 2D bounds'
+    m, n = lower.shape
+    corr = _corrmatrix(corrcoef, n)
+
+    if not 'maxpts' in kwds:
+        if n >2:
+            kwds['maxpts'] = 10000*n
+
+    cdfvalue = np.zeros(m)
+    error = np.zeros(m)
+    inform = np.zeros(m, int)
+    for keep, rows in _finite_groups(lower, upper):
+        k = len(keep)
+        lowerk = lower[rows][:, keep]
+        upperk = upper[rows][:, keep]
+        corrk = corr[keep][:, keep]
+        if k <= 3:
+            # closed form and fast paths, vectorized over rectangles,
+            # mvndst for the rectangles that miss the error tolerance
+            cdfvalue[rows], error[rows] = _cdf_lowdim(lowerk, upperk, corrk)
+            notmet = error[rows] > _tolerance(cdfvalue[rows], **kwds)
+            if not notmet.any():
+                continue
+            rows, lowerk, upperk = rows[notmet], lowerk[notmet], upperk[notmet]
+        correl = _corrpacked(corrk, k)
+        infin = _infinflags(lowerk, upperk)
+        if nprocs is None or nprocs < 2 or len(rows) < 2:
+            res = [_mvndst_rows((lowerk, upperk, infin, correl, kwds))]
+        else:
+            import multiprocessing
+            chunks = [idx for idx in
+                      np.array_split(np.arange(len(rows)), 4*nprocs)
+                      if idx.size > 0]
+            pool = multiprocessing.Pool(nprocs)
+            try:
+                res = pool.map(_mvndst_rows, [(lowerk[idx], upperk[idx],
+                                infin[idx], correl, kwds) for idx in chunks])
+            finally:
+                pool.close()
+                pool.join()
+        error[rows], cdfvalue[rows], inform[rows] = \
+                     map(np.concatenate, zip(*res))
+    return cdfvalue, error, inform
+
+
+def mvnormcdf_batch(lower, upper, mu, cov, nprocs=None, **kwds):
+    '''multivariate normal cumulative distribution function for many rectangles
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, n) or 1d (n,)
+       lower and upper integration limits, each row is one rectangle
+    mu : array_lik, 1d
+       list or array of means
+    cov : array_like, 2d
+       specifies covariance matrix
+    nprocs : None or int
+       number of processes, see mvstdnormcdf_batch
+    optional keyword parameters to influence integration, see mvnormcdf
+
+    Returns
+    -------
+    cdfvalue, error, inform : ndarrays (m,)
+        see mvstdnormcdf_batch
+
+    Notes
+    -----
+    The covariance matrix is standardized to a correlation matrix only once
+    for all rectangles.
+
+    See Also
+    --------
+    mvstdnormcdf_batch : location and scale standardized multivariate
+        normal cdf for many rectangles
+    '''
+    lower = np.asarray(lower, float)
+    upper = np.asarray(upper, float)
+    cov = np.array(cov, float)
+    stdev = np.sqrt(np.diag(cov)) # standard deviation vector
+    lower = (lower - mu)/stdev
+    upper = (upper - mu)/stdev
+    divrow = np.atleast_2d(stdev)
+    corr = cov/divrow/divrow.T
+    return mvstdnormcdf_batch(lower, upper, corr, nprocs=nprocs, **kwds)
+
+
+class MVNormAdaptive(object):
+    '''multivariate normal rectangle probabilities to a target accuracy
+
+    Adaptive driver for mvndst. Each rectangle is integrated with an
+    initial number of function values `maxpts`, all rectangles that do not
+    reach the error tolerance are integrated again with `maxpts`
+    multiplied by `growth`, until all rectangles are finished, `maxptsmax`
+    is reached or the wall clock `timeout` of the call to cdf is used up.
+    The first round is always completed, later rounds are interrupted
+    when the time is used up, and the unfinished rectangles keep the
+    result of the previous round.
+    Because mvndst starts from scratch in each call, the geometric increase
+    limits the total work to growth/(growth-1) times the work of the last
+    round.
+
+    The standardization of the covariance matrix and the packing of the
+    correlation coefficients are done once in the constructor, rectangles
+    with at most three dimensions that are not (-inf, inf) are calculated
+    in closed form, see mvstdnormcdf_batch.
+
+    Parameters
+    ----------
+    mu : array_like, 1d
+       list or array of means
+    cov : array_like, 2d
+       specifies covariance matrix
+    abseps : float
+       absolute error tolerance
+    releps : float
+       relative error tolerance, a rectangle is finished if
+       error <= max(abseps, releps * abs(cdfvalue))
+    maxpts : None or int
+       number of function values in the first round, default 1000*n
+    maxptsmax : None or int
+       maximum number of function values in one round, default 1000 times
+       the initial maxpts but at least 10**7
+    growth : float
+       factor by which maxpts is increased in each round
+    timeout : None or float
+       wall clock budget in seconds for one call to cdf. If the budget is
+       used up, no further round is started and the current round is
+       interrupted.
+
+    Attributes
+    ----------
+    after a call to cdf
+    error : ndarray
+       estimated absolute error, with 99% confidence level
+    inform : ndarray
+       0 if the error tolerance is met, 1 if not, see informcode
+    nfev : ndarray
+       number of function values spent on each rectangle in all rounds,
+       maxpts is used as the count for each call to mvndst
+    nrounds : ndarray
+       number of calls to mvndst for each rectangle
+    elapsed : float
+       wall clock time of the call in seconds
+
+    Examples
+    --------
+    >>> corr4 = 0.5 * np.eye(4) + 0.5
+    >>> mvn = MVNormAdaptive(np.zeros(4), corr4, abseps=1e-6)
+    >>> cdfvalue = mvn.cdf(-np.inf, np.zeros((3, 4)))
+    >>> print np.round(cdfvalue, 6), mvn.inform
+    [ 0.2  0.2  0.2] [0 0 0]
+    >>> mvn.nfev   # doctest: +SKIP
+    array([ 340000, 1364000, 1364000])
+    '''
+
+    def __init__(self, mu, cov, abseps=1e-6, releps=1e-6, maxpts=None,
+                 maxptsmax=None, growth=4, timeout=None):
+        cov = np.array(cov, float)
+        self.n = n = cov.shape[0]
+        self.mu = np.asarray(mu, float)
+        self.stdev = stdev = np.sqrt(np.diag(cov))
+        self.corr = cov / np.outer(stdev, stdev)
+        self.abseps = abseps
+        self.releps = releps
+        self.maxpts = maxpts or 1000*n
+        self.maxptsmax = maxptsmax or max(1000*self.maxpts, 10**7)
+        if growth <= 1:
+            raise ValueError, 'growth has to be larger than one'
+        self.growth = growth
+        self.timeout = timeout
+        # packed correlations of the subsets of dimensions
+        self._correl = {}
+
+    def _packed(self, keep):
+        key = tuple(keep)
+        if not key in self._correl:
+            self._correl[key] = _corrpacked(self.corr[keep][:, keep],
+                                            len(keep))
+        return self._correl[key]
+
+    def cdf(self, lower, upper):
+        '''probabilities of the rectangles given by the rows of the bounds
+
+        Parameters
+        ----------
+        lower, upper : array_like, 2d (m, n) or 1d (n,)
+           lower and upper integration limits, 1d limits are broadcast
+           against 2d limits
+
+        Returns
+        -------
+        cdfvalue : ndarray (m,)
+           value of the integral for each rectangle, error, inform, nfev
+           and nrounds are stored as attributes
+        '''
+        start = time.time()
+        if self.timeout is None:
+            deadline = np.inf
+        else:
+            deadline = start + self.timeout
+        lower = (np.atleast_2d(np.asarray(lower, float)) - self.mu) / self.stdev
+        upper = (np.atleast_2d(np.asarray(upper, float)) - self.mu) / self.stdev
+        lower, upper = np.broadcast_arrays(lower, upper)
+        m = lower.shape[0]
+        cdfvalue = np.zeros(m)
+        self.error = np.zeros(m)
+        self.inform = np.zeros(m, int)
+        self.nfev = np.zeros(m, int)
+        self.nrounds = np.zeros(m, int)
+
+        mvndst = scipy.stats.kde.mvn.mvndst
+        for keep, rows in _finite_groups(lower, upper):
+            k = len(keep)
+            lowerk = lower[rows][:, keep]
+            upperk = upper[rows][:, keep]
+            if k <= 3:
+                cdfvalue[rows], self.error[rows] = _cdf_lowdim(lowerk, upperk,
+                                                 self.corr[keep][:, keep])
+                notmet = self.error[rows] > _tolerance(cdfvalue[rows],
+                                            self.abseps, self.releps)
+                if not notmet.any():
+                    continue
+                rows = rows[notmet]
+                lowerk, upperk = lowerk[notmet], upperk[notmet]
+            correl = self._packed(keep)
+            infin = _infinflags(lowerk, upperk)
+            todo = np.arange(len(rows))
+            maxpts = self.maxpts
+            firstround = True
+            while True:
+                done = []
+                for ii in todo:
+                    if not firstround and time.time() >= deadline:
+                        # keep the result of the previous round
+                        break
+                    jj = rows[ii]
+                    self.error[jj], cdfvalue[jj], self.inform[jj] = \
+                         mvndst(lowerk[ii], upperk[ii], infin[ii], correl,
+                                maxpts=maxpts, abseps=self.abseps,
+                                releps=self.releps)
+                    self.nfev[jj] += maxpts
+                    self.nrounds[jj] += 1
+                    done.append(ii)
+                todo = np.array(done, int)
+                todo = todo[self.inform[rows[todo]] == 1]
+                if (todo.size == 0 or maxpts >= self.maxptsmax or
+                    time.time() >= deadline):
+                    break
+                maxpts = min(int(maxpts * self.growth), self.maxptsmax)
+                firstround = False
+        self.elapsed = time.time() - start
+        return cdfvalue
+
+# setup of MVNormAdaptive for recently used covariance matrices
+_ADAPTIVE_CACHE = {}
+_ADAPTIVE_CACHE_SIZE = 16
+
+def mvnormcdf_adaptive(lower, upper, mu, cov, abseps=1e-6, releps=1e-6,
+                       timeout=None, **kwds):
+    '''multivariate normal cdf that increases maxpts until abseps is met
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, n) or 1d (n,)
+       lower and upper integration limits, each row is one rectangle
+    mu : array_like, 1d
+       list or array of means
+    cov : array_like, 2d
+       specifies covariance matrix
+    abseps, releps : float
+       absolute and relative error tolerance
+    timeout : None or float
+       wall clock budget in seconds
+    optional keywords maxpts, maxptsmax and growth, see MVNormAdaptive
+
+    Returns
+    -------
+    cdfvalue, error, inform, nfev : ndarrays (m,)
+       value of the integral, estimated absolute error, termination status
+       and number of function values spent for each rectangle
+
+    Notes
+    -----
+    The standardized setup is cached for the most recently used covariance
+    matrices, so that repeated calls with the same covariance matrix do not
+    repeat it.
+
+    See Also
+    --------
+    MVNormAdaptive
+
+    Examples
+    --------
+    >>> corr4 = 0.5 * np.eye(4) + 0.5
+    >>> cdfvalue, error, inform, nfev = mvnormcdf_adaptive(-np.inf,
+    ...                           np.zeros(4), np.zeros(4), corr4, abseps=1e-6)
+    >>> print round(cdfvalue[0], 6), inform[0]
+    0.2 0
+    '''
+    cov = np.array(cov, float)
+    mu = np.asarray(mu, float)
+    key = (cov.shape, cov.tostring(), mu.tostring(), abseps, releps,
+           tuple(sorted(kwds.items())))
+    mvn = _ADAPTIVE_CACHE.get(key)
+    if mvn is None:
+        if len(_ADAPTIVE_CACHE) >= _ADAPTIVE_CACHE_SIZE:
+            _ADAPTIVE_CACHE.clear()
+        mvn = _ADAPTIVE_CACHE[key] = MVNormAdaptive(mu, cov, abseps=abseps,
+                                                    releps=releps, **kwds)
+    mvn.timeout = timeout
+    cdfvalue = mvn.cdf(lower, upper)
+    return cdfvalue, mvn.error, mvn.inform, mvn.nfev
+
+
+def _primes(k):
+    '''first k prime numbers'''
+    nmax = 10
+    while True:
+        sieve = np.ones(nmax+1, bool)
+        sieve[:2] = False
+        for p in range(2, int(np.sqrt(nmax))+1):
+            if sieve[p]:
+                sieve[p*p::p] = False
+        primes = np.nonzero(sieve)[0]
+        if len(primes) >= k:
+            return primes[:k]
+        nmax *= 2
+
+def richtmyer_lattice(npts, ndim):
+    '''Richtmyer lattice points frac(k*sqrt(p_j)), k = 1,...,npts
+
+    Parameters
+    ----------
+    npts : int
+        number of points
+    ndim : int
+        dimension, p_j is the jth prime number
+
+    Returns
+    -------
+    points : ndarray (npts, ndim)
+        quasi random points in the unit hypercube
+    '''
+    q = np.sqrt(_primes(ndim))
+    k = np.arange(1, npts+1)[:,np.newaxis]
+    return np.remainder(k*q, 1.0)
+
+
+class MVStdNormQMC(object):
+    '''randomized quasi Monte Carlo integration of standardized multivariate
+    normal rectangle probabilities
+
+    Pure numpy implementation of the separation of variables method of Genz
+    with a randomly shifted Richtmyer lattice and the baker's (tent)
+    transformation of the points. The Cholesky factor and the lattice points
+    are computed once and shared by all rectangles, the integrand is
+    evaluated vectorized over points and rectangles. There is no limit on
+    the dimension (mvndst is limited to n <= 500).
+
+    Dimensions where both bounds are infinite are dropped. If `reorder` is
+    true, then the variables are reordered for each rectangle by the
+    prioritization of Genz and Bretz, see _genz_bretz_order, and rectangles
+    with the same ordering share the Cholesky factor. Reordering reduces the
+    variance for a single rectangle, but for many rectangles the orderings
+    differ and the shared evaluation of the integrand is lost, so it is off
+    by default.
+
+    Parameters
+    ----------
+    corrcoef : float or array_like
+       specifies correlation matrix in one of three ways, see mvstdnormcdf.
+       The correlation matrix has to be positive definite.
+    n : int
+       number of dimensions, only needed if corrcoef is not a square matrix
+    npts : int
+       number of lattice points per random shift
+    nrep : int
+       number of random shifts, used for the standard error estimate
+    seed : None or int
+       seed for the random shifts, with the same seed the results are
+       reproducible
+    reorder : bool
+       If True, reorder the variables for each rectangle, default is False
+
+    Examples
+    --------
+    >>> corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]
+    >>> mvqmc = MVStdNormQMC(corr, npts=2000, seed=1234)
+    >>> cdfvalue, stderr = mvqmc.cdf(-np.inf, [[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+    >>> cdfvalue   # doctest: +SKIP
+    array([ 0.16666667,  0.62697309])
+
+    References
+    ----------
+    Genz, A. (1992), Numerical Computation of Multivariate Normal
+    Probabilities, J. of Computational and Graphical Stat., 1, pp. 141-149
+    Genz, A. and Bretz, F. (2009), Computation of Multivariate Normal and t
+    Probabilities, Lecture Notes in Statistics 195, Springer
+    '''
+    # max number of elements in the work arrays of one chunk of rectangles
+    maxchunk = 2**22
+
+    def __init__(self, corrcoef, n=None, npts=1000, nrep=10, seed=None,
+                 reorder=False):
+        if n is None:
+            n = np.shape(corrcoef)[0] if np.ndim(corrcoef) == 2 else 2
+        self.n = n
+        self.corr = _corrmatrix(corrcoef, n)
+        self.chol = np.linalg.cholesky(self.corr)
+        self.npts = npts
+        self.nrep = nrep
+        self.seed = seed
+        self.reorder = reorder
+        self.lattice = richtmyer_lattice(npts, max(n-1, 1))
+
+    def _integrand(self, lower, upper, w, chol):
+        '''SOV integrand for rectangles (m, n) at points w (npts, n-1)
+
+        returns array (m, npts)
+        '''
+        ndtr, ndtri = scipy.special.ndtr, scipy.special.ndtri
+        n = lower.shape[1]
+        c, cdiag = chol, np.diag(chol)
+        m = lower.shape[0]
+        npts = w.shape[0]
+        tiny = np.finfo(float).tiny
+        y = np.zeros((n, m, npts))
+        d = ndtr(lower[:,0]/cdiag[0])[:,np.newaxis] * np.ones((1,npts))
+        e = ndtr(upper[:,0]/cdiag[0])[:,np.newaxis] * np.ones((1,npts))
+        f = e - d
+        for i in range(1, n):
+            u = d + w[:,i-1]*(e - d)
+            y[i-1] = ndtri(np.clip(u, tiny, 1-np.finfo(float).epsneg))
+            s = np.dot(c[i,:i], y[:i].reshape(i,-1)).reshape(m, npts)
+            d = ndtr((lower[:,i:i+1] - s)/cdiag[i])
+            e = ndtr((upper[:,i:i+1] - s)/cdiag[i])
+            f = f * (e - d)
+        return f
+
+    def cdf(self, lower, upper):
+        '''rectangle probabilities for each row of lower and upper
+
+        Parameters
+        ----------
+        lower, upper : array_like, 2d (m, n) or 1d (n,)
+           lower and upper integration limits, each row is one rectangle,
+           1d limits are broadcast against the 2d limits
+
+        Returns
+        -------
+        cdfvalue : ndarray (m,)
+            value of the integral for each rectangle
+        stderr : ndarray (m,)
+            standard error of cdfvalue estimated from the variation across
+            the nrep random shifts
+        '''
+        lower = np.atleast_2d(np.asarray(lower, float))
+        upper = np.atleast_2d(np.asarray(upper, float))
+        lower, upper = np.broadcast_arrays(lower, upper)
+        if lower.ndim != 2 or lower.shape[1] != self.n:
+            raise ValueError, 'bounds need %d columns' % self.n
+        m = lower.shape[0]
+        rvs = np.random.RandomState(self.seed)
+        shifts = rvs.uniform(size=(self.nrep, self.lattice.shape[1]))
+        est = np.ones((self.nrep, m))
+        for keep, rows in _finite_groups(lower, upper):
+            k = len(keep)
+            if k == 0:
+                continue
+            lowerk = lower[rows][:, keep]
+            upperk = upper[rows][:, keep]
+            corrk = self.corr[keep][:, keep]
+            if self.reorder and k > 1:
+                perms = np.array([_genz_bretz_order(lowerk[ii], upperk[ii],
+                                                    corrk)
+                                  for ii in range(len(rows))])
+                uperms, iperm = _unique_rows(perms)
+            else:
+                uperms, iperm = np.arange(k)[np.newaxis, :], np.zeros(len(rows), int)
+            for ii, perm in enumerate(uperms):
+                prows = np.nonzero(iperm == ii)[0]
+                if k == self.n and np.all(perm == np.arange(k)):
+                    chol = self.chol
+                else:
+                    chol = np.linalg.cholesky(corrk[perm][:, perm])
+                est[:, rows[prows]] = self._estimate(lowerk[prows][:, perm],
+                                                     upperk[prows][:, perm],
+                                                     chol, shifts)
+        cdfvalue = est.mean(0)
+        stderr = est.std(0) / np.sqrt(max(self.nrep - 1, 1))
+        return cdfvalue, stderr
+
+    def _estimate(self, lower, upper, chol, shifts):
+        '''lattice rule estimates for each random shift, returns (nrep, m)
+        '''
+        m, k = lower.shape
+        lattice = self.lattice[:, :max(k-1, 1)]
+        mchunk = max(1, self.maxchunk // (self.npts * k))
+        est = np.zeros((self.nrep, m))
+        for r in range(self.nrep):
+            # randomly shifted lattice with baker's transformation
+            w = np.abs(2*np.remainder(lattice + shifts[r, :lattice.shape[1]],
+                                      1.0) - 1)
+            for start in range(0, m, mchunk):
+                sl = slice(start, start+mchunk)
+                est[r,sl] = self._integrand(lower[sl], upper[sl], w,
+                                            chol).mean(1)
+        return est
+
+
+def mvstdnormcdf_qmc(lower, upper, corrcoef, npts=1000, nrep=10, seed=None,
+                     reorder=False):
+    '''standardized multivariate normal cdf with randomized quasi Monte Carlo
+
+    Pure numpy alternative to mvstdnormcdf_batch that does not use mvndst,
+    see MVStdNormQMC. The lattice points and the Cholesky factor of the
+    correlation matrix are shared by all rectangles.
+
+    Parameters
+    ----------
+    lower, upper : array_like, 2d (m, n) or 1d (n,)
+       lower and upper integration limits, each row is one rectangle
+    corrcoef : float or array_like
+       specifies correlation matrix in one of three ways, see mvstdnormcdf
+    npts : int
+       number of lattice points per random shift
+    nrep : int
+       number of random shifts
+    seed : None or int
+       seed for the random shifts
+    reorder : bool
+       If True, reorder the variables for each rectangle, default is False
+
+    Returns
+    -------
+    cdfvalue : ndarray (m,)
+        value of the integral for each rectangle
+    stderr : ndarray (m,)
+        standard error estimate of cdfvalue
+
+    Examples
+    --------
+    >>> corr = 0.5 * np.eye(600) + 0.5     # dimension > 500
+    >>> cdfvalue, stderr = mvstdnormcdf_qmc(-np.inf, np.ones(600), corr)
+    '''
+    n = np.shape(np.atleast_2d(upper))[1]
+    mvqmc = MVStdNormQMC(corrcoef, n=n, npts=npts, nrep=nrep, seed=seed,
+                         reorder=reorder)
+    return mvqmc.cdf(lower, upper)
+
+def check_tvnormcdf():
+    '''compare tvnormcdf with the closed form at zero and with mvndst for
+    correlations close to one
+    '''
+    mvndst = scipy.stats.kde.mvn.mvndst
+    # orthant probability at zero is 1/8 + sum(arcsin(rij)) / (4*pi)
+    for r in [[0.5, 0.3, 0.2], [0.999, 0.998, 0.9995], [0.99, -0.995, -0.999],
+              [0.9999, 0.99995, 0.99999], [0.999999, 0.3, 0.3]]:
+        exact = 1/8. + np.arcsin(r).sum() / (4*np.pi)
+        assert_almost_equal(tvnormcdf(-np.inf, [0, 0, 0], r)[0], exact, 14)
+        assert_almost_equal(mvstdnormcdf([-np.inf]*3, [0.]*3, r), exact, 14)
+
+    rvs = np.random.RandomState(9876)
+    lower = rvs.randn(20, 3) - 1
+    lower[:10, 0] = -np.inf
+    upper = lower + rvs.uniform(0.1, 3, size=(20, 3))
+    infin = _infinflags(lower, upper)
+    for r in [[0.999, 0.998, 0.9995], [0.99, -0.995, -0.999],
+              [0.995, 0.99, 0.999]]:
+        cdfvalue, error = _cdf_lowdim(lower, upper, _corrmatrix(r, 3))
+        assert error.max() < 1e-10
+        for ii in range(20):
+            # mvndst is the less precise one here, it is off by about 1e-6
+            # for some rectangles
+            err, val, inform = mvndst(lower[ii], upper[ii], infin[ii],
+                                      np.array(r), maxpts=10**6,
+                                      abseps=1e-10, releps=0)
+            assert_almost_equal(cdfvalue[ii], val, 5)
+
+    # singular correlation matrix, X3 = (X1 + X2) / sqrt(2), uses mvndst
+    r = [0, np.sqrt(0.5), np.sqrt(0.5)]
+    assert (_cdf_lowdim(lower, upper, _corrmatrix(r, 3))[1] >= 1).all()
+    err, val, inform = mvndst(lower[0], upper[0], infin[0], np.array(r),
+                              maxpts=10**6, abseps=1e-8)
+    assert_almost_equal(mvstdnormcdf(lower[0], upper[0], r), val, 5)
+    cdfvalue, error, inform = mvstdnormcdf_batch(lower, upper, r)
+    assert_almost_equal(cdfvalue[0], val, 5)
+    assert 0 < error.max() < 1e-5
+
+
+if __name__ == '__main__':
+    check_tvnormcdf()
+
+    lower,upper,corrcoef = [0.0,0.0],[1.0,1.0],[0.99]        
+    print mvstdnormcdf(lower,upper,corrcoef)
+    lower,upper,corrcoef = [-np.inf,0.0],[0.0,1.0],[0.0]        
+    print mvstdnormcdf(lower,upper,corrcoef) 
+    lower,upper,corrcoef = [-np.inf,0.0],[np.inf,1.0],[0.0]        
+    print mvstdnormcdf(lower,upper,corrcoef) 
+    print mvstdnormcdf([-np.inf,-np.inf],[np.inf,0.0],[0.0] )
+    print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.0] )
+    print mvstdnormcdf([-10.0,-10.0],[0.0,10.0],[0.0] ) 
+    print mvstdnormcdf([-np.inf,-np.inf],[np.inf,np.inf],[0.0] )
+    print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.5] )
+    print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.9999] )
+    corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]           
+    print mvstdnormcdf([-np.inf,-np.inf,-np.inf],[0.0,0.0,0.0],corr )
+    print mvstdnormcdf([-np.inf,-np.inf,-1.0],[0.0,0.0,0.0],corr )
+    # using optional keywords for integration
+    print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, releps=1e-4)
+    print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, abseps=1e-8)
+    print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, maxpts=100000, abseps=1e-8)
+    corr = [[1.0, 0, 0.9],[0,1,0.5],[0.9,0.5,1]]
+    print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr ) 
+    corr = np.diag(np.ones(3))
+    print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr )
+
+    lower, upper, mu, cov = [-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],[0.0,0.0,0.0],corr
+    print mvnormcdf(lower, upper, mu, cov, maxpts=3000)
+    #conditional distribution doesn't work directly:
+    print mvstdnormcdf([-np.inf,-np.inf,0.0],[0.0,0.0,0.0],corr )
+
+    # many rectangles with the same correlation in one call
+    corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]
+    upper = np.random.randn(1000, 3)
+    cdfvalue, error, inform = mvstdnormcdf_batch(-np.inf, upper, corr)
+    print cdfvalue[:5], error.max(), inform.max()
+    cdfvalue2, error2, inform2 = mvstdnormcdf_batch(-np.inf, upper, corr,
+                                                    nprocs=2)
+    print np.max(np.abs(cdfvalue2 - cdfvalue))
 
+    # pure numpy randomized quasi Monte Carlo, also for dimension > 500
+    cdfqmc, stderrqmc = mvstdnormcdf_qmc(-np.inf, upper, corr, seed=1234)
+    print np.max(np.abs(cdfqmc - cdfvalue)), stderrqmc.max()
+    corr = 0.5 * np.eye(600) + 0.5
+    print mvstdnormcdf_qmc(-np.inf, np.ones(600), corr, seed=1234)
 
-lower,upper,corrcoef = [0.0,0.0],[1.0,1.0],[0.99]        
-print mvstdnormcdf(lower,upper,corrcoef)
-lower,upper,corrcoef = [-np.inf,0.0],[0.0,1.0],[0.0]        
-print mvstdnormcdf(lower,upper,corrcoef) 
-lower,upper,corrcoef = [-np.inf,0.0],[np.inf,1.0],[0.0]        
-print mvstdnormcdf(lower,upper,corrcoef) 
-print mvstdnormcdf([-np.inf,-np.inf],[np.inf,0.0],[0.0] )
-print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.0] )
-print mvstdnormcdf([-10.0,-10.0],[0.0,10.0],[0.0] ) 
-print mvstdnormcdf([-np.inf,-np.inf],[np.inf,np.inf],[0.0] )
-print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.5] )
-print mvstdnormcdf([-np.inf,-np.inf],[0.0,0.0],[0.9999] )
-corr = [[1.0, 0, 0.5],[0,1,0],[0.5,0,1]]           
-print mvstdnormcdf([-np.inf,-np.inf,-np.inf],[0.0,0.0,0.0],corr )
-print mvstdnormcdf([-np.inf,-np.inf,-1.0],[0.0,0.0,0.0],corr )
-# using optional keywords for integration
-print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, releps=1e-4)
-print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, abseps=1e-8)
-print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr, maxpts=100000, abseps=1e-8)
-corr = [[1.0, 0, 0.9],[0,1,0.5],[0.9,0.5,1]]
-print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr ) 
-corr = np.diag(np.ones(3))
-print mvstdnormcdf([-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],corr )
-
-lower, upper, mu, cov = [-np.inf,-np.inf,-100.0],[0.0,0.0,0.0],[0.0,0.0,0.0],corr
-print mvnormcdf(lower, upper, mu, cov, maxpts=3000)
-#conditional distribution doesn't work directly:
-print mvstdnormcdf([-np.inf,-np.inf,0.0],[0.0,0.0,0.0],corr )
+    # increase maxpts until the error tolerance is met
+    corr4 = 0.5 * np.eye(4) + 0.5
+    mvn = MVNormAdaptive(np.zeros(4), corr4, abseps=1e-6, timeout=10)
+    print mvn.cdf(-np.inf, np.random.randn(5, 4)), mvn.inform, mvn.nfev
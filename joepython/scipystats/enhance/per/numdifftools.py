@@ -45,11 +45,21 @@ NUMDIFFTOOLS
  Computes the Jacobian matrix of a vector (or array) valued function of
  one or more variables.
 
+ SparseJacobian
+ --------------
+ Computes a sparse Jacobian matrix by perturbing groups of structurally
+ orthogonal columns simultaneously.
+
  Hessian
  -------
  Computes the Hessian matrix of all 2nd partial derivatives of a scalar
  function of one or more variables.
 
+ HessianVectorProduct
+ --------------------
+ Computes the product of the Hessian matrix with a vector from directional
+ differences of the gradient, without forming the Hessian matrix.
+
  Hessdiag
  --------
  The diagonal elements of the Hessian matrix are the pure second order
@@ -64,11 +74,20 @@ np = numpy
 
 import scipy.linalg as linalg
 import scipy.misc as misc
+import scipy.sparse as sparse
 
 __all__ = [
-    'dea3','Derivative','Jacobian','Gradient','Hessian','Hessdiag'
+    'dea3','Derivative','Jacobian','SparseJacobian','Gradient','Hessian',
+    'HessianVectorProduct','Hessdiag','color_columns'
     ]
 
+# Finite difference rules, Romberg exponents, Romberg QR factorizations and
+# step tables only depend on the derivative parameters and not on fun or x0.
+# They are computed once per parameter combination and shared between all
+# derivative objects, see Common_diff_par._set_all_der_par.
+# key: (derOrder, metOrder, method[0], numTerms, stepRatio)
+_RULE_CACHE = {}
+
 def dea3(E00,E11,E22):
     ''' DEA3 Extrapolate a slowly convergent sequence
 
@@ -264,12 +283,50 @@ class Common_diff_par(object):
 
     def _set_all_der_par(self):
         '''Set derivative parameters: stepsize, differention rule and romberg extrapolation
+
+        The rules are looked up in the module level _RULE_CACHE and only
+        computed if this combination of parameters has not been seen before.
         '''
-        self._set_delta()
-        self._set_fdarule()
-        self._set_rombexpon()
+        rules = self._get_rules()
+        self.fdarule = rules['fdarule']
+        self.rombexpon = rules['rombexpon']
+        deltakey = (self.stepFix, self.stepMax)
+        delta = rules['delta'].get(deltakey)
+        if delta is None:
+            self._set_delta()
+            self.delta.setflags(write=False)
+            rules['delta'][deltakey] = self.delta
+        else:
+            self.delta = delta
         self._set_fdiff()
 
+    def _rule_key(self):
+        ''' Return key of the current derivative parameters in _RULE_CACHE
+        '''
+        return (int(self.derOrder), int(self.metOrder), self.method[0],
+                int(self.numTerms), float(self.stepRatio))
+
+    def _get_rules(self):
+        ''' Return cached rules for the current derivative parameters
+
+        Returns a dict with the finite differencing rule, 'fdarule', the
+        romberg exponents, 'rombexpon', the romberg matrix and its qr
+        factorization, 'romb', and the step tables, 'delta', keyed by
+        (stepFix, stepMax).
+        '''
+        key = self._rule_key()
+        rules = _RULE_CACHE.get(key)
+        if rules is None:
+            self._set_fdarule()
+            self._set_rombexpon()
+            fdarule = numpy.matrix(self.fdarule, dtype=float)
+            fdarule.setflags(write=False)
+            self.rombexpon.setflags(write=False)
+            rules = dict(fdarule=fdarule, rombexpon=self.rombexpon,
+                         romb=self._rombmat(), delta={})
+            _RULE_CACHE[key] = rules
+        return rules
+
 
 
 
@@ -519,15 +576,13 @@ class Common_diff_par(object):
 
 
 
-    def _rombextrap(self,der_init):
-        ''' Return Romberg extrapolated derivatives and error estimates based on the initial derivative estimates
-
-         Input:
-          der_init - initial derivative estimates
+    def _rombmat(self):
+        ''' Return romberg matrix, its qr factorization and pinv of rromb
 
          Output:
-          der_romb - derivative estimates returned
-          errest - error estimates
+          rmat - romberg extrapolation matrix
+          qromb, rromb - economic qr factorization of rmat
+          rinv - pseudo inverse of rromb
 
           Member variables used
             stepRatio - Ratio decrease in step
@@ -555,6 +610,31 @@ class Common_diff_par(object):
         # amp - noise amplification factor due to the romberg step
         # the noise amplification is further amplified by the Romberg step.
         #% amp = cond(rromb);
+        rinv = numpy.asarray(linalg.pinv2(rromb))
+        for arr in (rmat, qromb, rromb, rinv):
+            arr.setflags(write=False)
+        return rmat, qromb, rromb, rinv
+
+    def _rombextrap(self,der_init):
+        ''' Return Romberg extrapolated derivatives and error estimates based on the initial derivative estimates
+
+         Input:
+          der_init - initial derivative estimates
+
+         Output:
+          der_romb - derivative estimates returned
+          errest - error estimates
+
+          Member variables used
+            stepRatio - Ratio decrease in step
+            rombexpon - higher order terms to cancel using the romberg step
+        '''
+        rules = _RULE_CACHE.get(self._rule_key())
+        if rules is None:
+            rmat, qromb, rromb, rinv = self._rombmat()
+        else:
+            rmat, qromb, rromb, rinv = rules['romb']
+        nexpon = len(self.rombexpon)
 
         isnonfinite = 1-numpy.isfinite(der_init)
         i_nonfinite, = isnonfinite.ravel().nonzero()
@@ -577,7 +657,6 @@ class Common_diff_par(object):
         asarray = numpy.asarray
         #% uncertainty estimate of derivative prediction
         s = sqrt(sum(asarray(rhs - rmat*rombcoefs[0])**2,axis=0))
-        rinv = asarray(linalg.pinv2(rromb))
         cov1 = sum(rinv**2,axis=1) # 1 spare dof
         eps = np.finfo(float).eps
         errest = np.maximum(s*12.7062047361747*sqrt(cov1[0]),eps*10.)
@@ -1050,6 +1129,227 @@ class Jacobian(Common_diff_par):
         return jac
 
 
+def color_columns(pattern):
+    ''' Return column groups of a sparsity pattern by greedy CPR coloring
+
+    Two columns are structurally orthogonal if they do not have a nonzero
+    in the same row. Columns with the same color are structurally orthogonal
+    and can be perturbed simultaneously (Curtis, Powell and Reid, 1974).
+    Columns are colored in the order of decreasing number of nonzeros
+    (largest first).
+
+    Parameters
+    ----------
+    pattern : array_like or sparse matrix, shape (n, nx)
+        nonzero elements define the sparsity structure of the Jacobian
+
+    Returns
+    -------
+    colors : ndarray of int, shape (nx,)
+        group index for each column, 0,1,...,ngroups-1
+
+    Examples
+    --------
+    >>> pattern = np.eye(4) + np.eye(4, k=1) + np.eye(4, k=-1)
+    >>> color_columns(pattern)
+    array([2, 0, 1, 2])
+    '''
+    pat = sparse.csc_matrix(pattern, dtype=bool)
+    pat.eliminate_zeros()
+    nx = pat.shape[1]
+    # column intersection graph, columns are adjacent if they share a row
+    adj = sparse.csr_matrix(pat.T.astype(int) * pat.astype(int))
+    colors = -numpy.ones(nx, dtype=int)
+    order = numpy.argsort(-numpy.diff(pat.indptr), kind='mergesort')
+    for j in order:
+        neighbors = adj.indices[adj.indptr[j]:adj.indptr[j+1]]
+        used = colors[neighbors]
+        used = used[used >= 0]
+        free = numpy.ones(used.size + 1, dtype=bool)
+        free[used[used < free.size]] = False
+        colors[j] = free.argmax()
+    return colors
+
+class SparseJacobian(Jacobian):
+    _jacob_txt = Jacobian._jacob_txt
+    __doc__ = '''Estimate sparse Jacobian matrix, with error estimate
+    ''' +  _jacob_txt.replace('''
+     **kwds
+     -------''', '''
+     **kwds
+     -------
+      sparsity : array_like or sparse matrix, shape (n, nx), or None
+                 Nonzero elements define the structure of the Jacobian.
+                 If None, it is detected from a probe with nx+1 function
+                 evaluations at the first call and stored. (Default None)''') + '''
+
+    The Jacobian matrix is the matrix of all first-order partial derivatives
+    of a vector-valued function. If each element of fun depends only on a few
+    variables, the columns of the Jacobian can be grouped into sets of
+    structurally orthogonal columns, which are perturbed simultaneously.
+    The number of function evaluations is proportional to the number of
+    groups instead of the number of variables. The grouping is done with
+    the Curtis-Powell-Reid (CPR) greedy coloring, see color_columns.
+
+    Assumptions
+    -----------
+          fun - (vector valued) analytical function to differentiate.
+                fun must be a function of the vector or array x0.
+
+          x0  - vector location at which to differentiate fun
+                If x0 is an N x M array, then fun is assumed to be
+                a function of N*M variables.
+
+          The sparsity pattern detected from a probe only contains the
+          elements that are nonzero at the probe point. Supply the
+          sparsity pattern if elements can be zero by coincidence.
+
+    Examples
+    --------
+
+      #(tridiagonal Jacobian)
+      >>> fun = lambda x: x**2 + np.r_[0, x[:-1]] - np.r_[x[1:], 0]
+      >>> Jfun = SparseJacobian(fun)
+      >>> jac = Jfun(np.arange(1., 6.))
+      >>> Jfun.ngroups   # 3 groups instead of 5 columns
+      3
+      >>> jac.toarray()
+      array([[  2.,  -1.,   0.,   0.,   0.],
+             [  1.,   4.,  -1.,   0.,   0.],
+             [  0.,   1.,   6.,  -1.,   0.],
+             [  0.,   0.,   1.,   8.,  -1.],
+             [  0.,   0.,   0.,   1.,  10.]])
+
+     See also
+     --------
+     Jacobian, color_columns
+    '''
+    def __init__(self,fun,**kwds):
+        self.sparsity = None
+        super(SparseJacobian,self).__init__(fun,**kwds)
+        self.colors = None
+        self.ngroups = None
+
+    def _probe_sparsity(self,x0,f0,stepNom):
+        ''' Return sparsity pattern detected by perturbing each variable
+        '''
+        fun = self.fun
+        nx = x0.size
+        rows = []
+        cols = []
+        # steps are scaled by an irregular factor to make it unlikely that
+        # a structural nonzero vanishes by coincidence
+        h = 0.01*stepNom*(1.0 + numpy.sqrt(2.)*numpy.arange(1, nx+1) % 1)
+        for i in range(nx):
+            xp = x0.copy()
+            xp[i] = x0[i] + h[i]
+            nz, = (numpy.asarray(fun(xp)).ravel() != f0).nonzero()
+            rows.append(nz)
+            cols.append(i*numpy.ones(nz.size, dtype=int))
+        rows = numpy.concatenate(rows)
+        cols = numpy.concatenate(cols)
+        return sparse.csc_matrix((numpy.ones(rows.size, dtype=bool),
+                                  (rows, cols)), shape=(f0.size, nx))
+
+    def jacobian(self,x00):
+        '''
+         Sparse Jacobian matrix of a vector valued function of n variables
+
+         CALL: jac = fun.jacobian(x0)
+
+         arguments: (input)
+          x0  - vector location at which to differentiate fun
+                If x0 is an nxm array, then fun is assumed to be
+                a function of n*m variables.
+
+         arguments: (output)
+          jac - sparse csr matrix of first partial derivatives of fun.
+                Assuming that x0 is a vector of length p
+                and fun returns a vector of length n, then
+                jac will be a sparse matrix of size (n,p)
+
+         Member variables set
+          error_estimate - sparse matrix of error estimates corresponding
+                to each partial derivative in jac.
+          finaldelta - sparse matrix of the final step sizes
+          colors, ngroups - column groups used for the estimation
+
+         See also: Jacobian.jacobian, color_columns
+        '''
+        self.derOrder = 1
+        fun = self.fun
+        self._set_all_der_par()
+
+        zeros = numpy.zeros
+        x0 = numpy.atleast_1d(numpy.asarray(x00, dtype=float)).ravel()
+        nx = x0.size
+
+        #% get fun at the center point
+        f0 = numpy.asarray(fun(x0)).ravel()
+        n = f0.size
+
+        if self.stepNom==None:
+            stepNom = numpy.maximum(numpy.abs(x0),0.02)
+        else:
+            stepNom = self.stepNom*numpy.ones(nx)
+
+        if self.sparsity is None:
+            self.sparsity = self._probe_sparsity(x0,f0,stepNom)
+        pattern = sparse.csc_matrix(self.sparsity, dtype=bool)
+        pattern.eliminate_zeros()
+        if pattern.shape != (n,nx):
+            raise ValueError('sparsity must have shape (%d, %d)' % (n,nx))
+
+        self.colors = color_columns(pattern)
+        self.ngroups = self.colors.max() + 1 if nx>0 else 0
+
+        # row and column index of each structural nonzero
+        pattern = pattern.tocoo()
+        irow, icol = pattern.row, pattern.col
+        nnz = irow.size
+        jac = zeros(nnz)
+        err = zeros(nnz)
+        finaldelta = zeros(nnz)
+
+        delta = self.delta
+        nsteps = delta.size
+        for g in range(self.ngroups):
+            ingroup = (self.colors == g)
+            h = numpy.where(ingroup, stepNom, 0.0)
+
+            #% evaluate at each step, perturbing all columns of the
+            #% group simultaneously, centered around x0
+            fdel = zeros((n,nsteps))
+            for j in range(nsteps):
+                fdif = numpy.asarray(fun(x0 + h*delta[j])) - \
+                       numpy.asarray(fun(x0 - h*delta[j]))
+                fdel[:,j] = fdif.ravel()
+
+            # each row has at most one nonzero in the columns of this group
+            for k in (ingroup[icol]).nonzero()[0]:
+                hk = stepNom[icol[k]]*delta
+                derest = fdel[irow[k],:]*0.5 / hk
+                [der_romb,errest] = self._rombextrap(derest)
+
+                #% trim off 3 estimates at each end of the scale
+                tags = der_romb.argsort()
+                tags = tags[3:-3]
+                der_romb = der_romb[tags]
+                errest = errest[tags]
+                trimdelta = hk[tags]
+
+                #% now pick the estimate with the lowest predicted error
+                ind = errest.argmin()
+                err[k] = errest[ind]
+                finaldelta[k] = trimdelta[ind]
+                jac[k] = der_romb[ind]
+
+        shape = (n,nx)
+        self.finaldelta = sparse.csr_matrix((finaldelta,(irow,icol)),shape=shape)
+        self.error_estimate = sparse.csr_matrix((err,(irow,icol)),shape=shape)
+        return sparse.csr_matrix((jac,(irow,icol)),shape=shape)
+
+
 class Gradient(Derivative):
     _grad_txt = Common_diff_par.__doc__.partition('\n')[2].replace(
         'Integer from 1 to 4 defining derivative order. (Default 1)','Derivative order is always 1')
@@ -1194,6 +1494,190 @@ class Hessian(Derivative):
         '''
 
         return self._hessian(x00)
+class HessianVectorProduct(Common_diff_par):
+    _hvp_txt = Common_diff_par.__doc__.partition('\n')[2].replace(
+        'Integer from 1 to 4 defining derivative order. (Default 1)',
+        'Derivative order is always 1 (of the gradient)').replace(
+        '''
+     **kwds
+     -------''', '''
+     **kwds
+     -------
+      gradfun  : function returning the gradient of fun. If None, the
+                 gradient is estimated with Gradient using the same
+                 parameters except numTerms. (Default None)
+      complexStep : If True, use complex step differentiation of gradfun,
+                 i.e. imag(gradfun(x0 + i*h*v))/h. gradfun must accept
+                 complex arguments. (Default False)''')
+    __doc__ = '''Estimate Hessian matrix times vector, with error estimate
+    ''' +  _hvp_txt + '''
+
+     HessianVectorProduct estimates H(x0)*v, the product of the matrix of 2nd
+     order partial derivatives of FUN at X0 with a vector V, as the
+     directional derivative of the gradient
+
+          H(x0)*v = d/dt gradient(x0 + t*v)  at t = 0
+
+     The full Hessian is never formed. By default, numTerms = 0, a single
+     central difference of the gradient is used, which costs 2 gradient
+     evaluations (1 with complexStep) for any number of parameters. The
+     error estimate is then only the bound of the rounding error.
+
+     With numTerms > 0 the central differences are evaluated for
+     numTerms+2 steps, h, h/stepRatio, ..., and combined by Romberg
+     extrapolation which also yields the error estimate. This uses
+     2*(numTerms+2) gradient evaluations, or numTerms+2 with complexStep.
+
+     The first step h is stepFix, or by default eps**(1/(2*numTerms+3))
+     (eps for the complex step) times the nominal step of x0.
+     Supplying gradfun is recommended, the numerical Gradient is much more
+     expensive and the differences of it are less accurate.
+     method is always 'central'.
+
+     Assumptions
+     ------------
+      fun - SCALAR analytical function to differentiate.
+            fun must be a function of the vector or array x0,
+            but it needs not to be vectorized.
+
+      x0  - vector location at which to differentiate fun
+            If x0 is an N x M array, then fun is assumed to be
+            a function of N*M variables.
+
+      v   - vector of the same size as x0
+
+    Examples
+    --------
+
+     #Rosenbrock function, minimized at [1,1]
+      >>> rosen = lambda x : (1.-x[0])**2 + 105*(x[1]-x[0]**2)**2
+      >>> rosen_grad = lambda x : np.array([-2*(1.-x[0]) - 420*x[0]*(x[1]-x[0]**2),
+      ...                                   210*(x[1]-x[0]**2)])
+      >>> Hv = HessianVectorProduct(rosen, gradfun=rosen_grad)
+      >>> hv = Hv([1, 1], [1, 0]) # hv = [842, -420]
+      >>> np.allclose(hv, [842, -420])
+      True
+
+      >>> Hvc = HessianVectorProduct(rosen, gradfun=rosen_grad, complexStep=True)
+      >>> hvc = Hvc([1, 1], [0, 1]) # hvc = [-420, 210]
+      >>> np.allclose(hvc, [-420, 210])
+      True
+
+     See also
+     --------
+     Hessian, Gradient, Jacobian
+    '''
+    def __init__(self,fun,**kwds):
+        self.gradfun = None
+        self.complexStep = False
+        # no romberg extrapolation by default, see the docstring
+        kwds.setdefault('numTerms', 0)
+        super(HessianVectorProduct,self).__init__(fun,**kwds)
+
+    def __call__(self,x00,v):
+        return self.hessian_vector_product(x00,v)
+
+    def _get_gradfun(self):
+        ''' Return gradient function, numerical Gradient if gradfun is None
+        '''
+        if self.gradfun is not None:
+            return self.gradfun
+        if self.complexStep:
+            raise ValueError('complexStep requires an analytical gradfun')
+        # the gradient keeps its own romberg steps, a numerical gradient
+        # without them is too noisy to be differenced again
+        kwds = dict((k, getattr(self,k)) for k in ('metOrder',
+                             'stepFix','stepMax','stepRatio','stepNom'))
+        return Gradient(self.fun,**kwds)
+
+    def hessian_vector_product(self,x00,v):
+        '''Hessian matrix times vector v
+
+         CALL: hv = fun.hessian_vector_product(x0,v)
+
+          hv  = H(x0)*v, the hessian matrix of fun at x0 times v. Size N
+          x0  = vector location at which to differentiate fun
+          v   = vector of size N
+
+         Member variables set
+          error_estimate - error estimates corresponding to each value in hv
+          finaldelta - final step size in the direction of v
+
+         See also hessian, gradient
+        '''
+        self.derOrder = 1
+        self.method = 'central'
+        self._set_all_der_par()
+
+        x0 = numpy.asarray(x00, dtype=float).ravel()
+        v = numpy.asarray(v, dtype=float).ravel()
+        if v.size != x0.size:
+            raise ValueError('v must have the same size as x0')
+        vnorm = numpy.sqrt(numpy.dot(v,v))
+        if vnorm==0:
+            self.error_estimate = numpy.zeros(x0.size)
+            self.finaldelta = 0.0
+            return numpy.zeros(x0.size)
+        u = v/vnorm
+
+        if self.stepNom==None:
+            stepNom = numpy.maximum(numpy.abs(x0).max(),0.02)
+        else:
+            stepNom = numpy.max(self.stepNom)
+
+        if self.numTerms == 0:
+            # a single difference, no romberg extrapolation
+            ndel = 1
+        else:
+            # numTerms+2 steps are the minimum for the romberg extrapolation
+            ndel = len(self.rombexpon) + 2
+        eps = numpy.finfo(float).eps
+        if self.stepFix is not None:
+            step1 = (self.stepFix+2.0)-2.0
+        elif self.complexStep:
+            step1 = eps*stepNom
+        else:
+            # balance truncation error, O(h**(2*numTerms+2)) after the
+            # romberg step, against the roundoff error, O(eps/h)
+            step1 = eps**(1./(2*self.numTerms+3))*stepNom
+        h = step1*(1.0*self.stepRatio)**(-numpy.arange(ndel))
+
+        gradfun = self._get_gradfun()
+        nx = x0.size
+        derest = numpy.zeros((nx,ndel))
+        for k in range(ndel):
+            if self.complexStep:
+                gdel = numpy.imag(gradfun(x0 + 1j*h[k]*u))
+                gabs = numpy.abs(gdel)
+            else:
+                gplus = numpy.asarray(gradfun(x0 + h[k]*u))
+                gminus = numpy.asarray(gradfun(x0 - h[k]*u))
+                gdel = (gplus - gminus)*0.5
+                gabs = (numpy.abs(gplus) + numpy.abs(gminus))*0.5
+            derest[:,k] = numpy.asarray(gdel).ravel()/h[k]
+
+        if ndel == 1:
+            hv = derest[:,0]
+            # rounding error of the gradient values divided by the step
+            self.error_estimate = eps*numpy.asarray(gabs).ravel()/h[0]*vnorm
+            self.finaldelta = h[0]
+            return hv*vnorm
+
+        #% Romberg extrapolation step, for each element of hv
+        hv = numpy.zeros(nx)
+        err = hv.copy()
+        finaldelta = hv.copy()
+        for i in range(nx):
+            [der_romb,errors] = self._rombextrap(derest[i,:])
+            ind = errors.argmin()
+            hv[i] = der_romb[ind]
+            err[i] = errors[ind]
+            finaldelta[i] = h[ind]
+
+        self.error_estimate = err*vnorm
+        self.finaldelta = finaldelta.max()
+        return hv*vnorm
+
 
 class Hessdiag(Derivative):
     _hessdiag_txt = Common_diff_par.__doc__.partition('\n')[2].replace(
@@ -161,6 +161,40 @@ class TestJacobian(unittest.TestCase):
     def testjacobian(self):
         pass
 
+class TestSparseJacobian(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testsparsejacobian(self):
+        # tridiagonal Jacobian needs only 3 groups of columns
+        fun = lambda x: np.exp(x)*np.r_[x[1:],0] + np.sin(x) + np.r_[0,x[:-1]]**2
+        x0 = np.linspace(0.1, 1, 10)
+        Jfun = nd.SparseJacobian(fun)
+        jac = Jfun(x0)
+        self.assertEqual(Jfun.ngroups, 3)
+        self.assertEqual(jac.nnz, 3*10-2)
+        jac_dense = nd.Jacobian(fun)(x0)
+        self.assertTrue(np.allclose(jac.toarray(), jac_dense, atol=1e-12))
+
+        # user supplied sparsity pattern
+        pattern = np.eye(10) + np.eye(10, k=1) + np.eye(10, k=-1)
+        Jfun2 = nd.SparseJacobian(fun, sparsity=pattern)
+        self.assertTrue(np.allclose(Jfun2(x0).toarray(), jac_dense, atol=1e-12))
+
+    def testcolorcolumns(self):
+        pattern = np.array([[1,0,0,1],
+                            [0,1,0,0],
+                            [0,1,1,0]])
+        colors = nd.color_columns(pattern)
+        # columns in the same group do not share a row
+        for g in range(colors.max()+1):
+            self.assertTrue(np.all(pattern[:,colors==g].sum(1) <= 1))
+        self.assertEqual(colors.max()+1, 2)
+
 class TestGradient(unittest.TestCase):
 
     def setUp(self):
@@ -183,6 +217,51 @@ class TestHessian(unittest.TestCase):
     def testhessian(self):
         pass
 
+class TestHessianVectorProduct(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testhessianvectorproduct(self):
+        A = np.array([[4., 1., 0.], [1., 3., 1.], [0., 1., 2.]])
+        fun = lambda x: 0.5*np.dot(x, np.dot(A, x)) + np.sum(np.cos(x))
+        gradfun = lambda x: np.dot(A, x) - np.sin(x)
+        x0 = np.array([0.5, 1.0, 1.5])
+        v = np.array([1.0, -2.0, 0.5])
+        hv_true = np.dot(A - np.diag(np.cos(x0)), v)
+
+        Hv = nd.HessianVectorProduct(fun, gradfun=gradfun)
+        hv = Hv(x0, v)
+        self.assertTrue(np.all(np.abs(hv-hv_true) < Hv.error_estimate*10))
+
+        Hvc = nd.HessianVectorProduct(fun, gradfun=gradfun, complexStep=True)
+        self.assertTrue(np.allclose(Hvc(x0, v), hv_true, rtol=1e-12))
+
+        # one central difference of the gradient by default
+        calls = []
+        def countgrad(x):
+            calls.append(1)
+            return gradfun(x)
+        nd.HessianVectorProduct(fun, gradfun=countgrad)(x0, v)
+        self.assertEqual(len(calls), 2)
+        del calls[:]
+        nd.HessianVectorProduct(fun, gradfun=countgrad, complexStep=True)(x0, v)
+        self.assertEqual(len(calls), 1)
+
+        # romberg extrapolation is optional
+        Hvr = nd.HessianVectorProduct(fun, gradfun=gradfun, numTerms=2)
+        hvr = Hvr(x0, v)
+        self.assertTrue(np.all(np.abs(hvr-hv_true) < Hvr.error_estimate*10))
+
+        # numerical gradient
+        Hvn = nd.HessianVectorProduct(fun)
+        self.assertTrue(np.allclose(Hvn(x0, v), hv_true, rtol=1e-5))
+        self.assertRaises(ValueError, nd.HessianVectorProduct(fun,
+                          complexStep=True), x0, v)
+
 class TestHessdiag(unittest.TestCase):
 
     def setUp(self):
@@ -205,5 +284,31 @@ class TestGlobalFunctions(unittest.TestCase):
     def testvec2mat(self):
         pass
 
+class TestRuleCache(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testrulecache(self):
+        # rules are shared between derivative objects with equal parameters
+        dsin = nd.Derivative(np.sin, derOrder=2, method='forward')
+        y = dsin(1.0)
+        key = (2, 2, 'f', 2, 2.0)
+        self.assertTrue(key in nd._RULE_CACHE)
+        dcos = nd.Derivative(np.cos, derOrder=2, method='forward')
+        dcos(1.0)
+        self.assertTrue(dcos.fdarule is dsin.fdarule)
+        self.assertTrue(dcos.delta is dsin.delta)
+
+        # changing the parameters picks up the corresponding rule
+        dsin.derOrder = 1
+        y1 = dsin(1.0)
+        self.assertTrue(np.abs(y1-np.cos(1.0)) < dsin.error_estimate*10)
+        dsin.derOrder = 2
+        self.assertTrue(np.all(dsin(1.0) == y))
+
 if __name__ == '__main__':
     unittest.main()
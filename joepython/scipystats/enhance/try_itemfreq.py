@@ -1,48 +1,120 @@
+import numpy as np
+import scipy.stats
+from scipy import stats
 
 
-
-def itemfreq(a):
-    # fixme: I'm not sure I understand what this does. The docstring is
-    # internally inconsistent.
-    # comment: fortunately, this function doesn't appear to be used elsewhere
+def itemfreq(a, maxbins=None):
     """Returns a 2D array of item frequencies.
 
-    Column 1 contains item values, column 2 contains their respective counts.
-    Assumes a 1D array is passed.
-
-    This version: lexigraphically sort rows,
-        return row frequency in last column
+    For a 1D array, column 0 contains the item values and column 1 their
+    respective counts. For a 2D array the items are the rows, the unique
+    rows are in lexicographic order in columns [0:n-1] and their counts
+    in the last column.
 
     Parameters
     ----------
-    a : array
+    a : array, 1D or 2D
+    maxbins : None or int
+        Integer data is counted with np.bincount if the number of possible
+        values, or of combinations of values for rows, is at most maxbins.
+        The default is max(nobs, 256), so that the time and memory of
+        bincount are linear in the number of observations.
 
     Returns
     -------
     A 2D frequency table (col [0:n-1]=scores, col n=frequencies)
+
+    Notes
+    -----
+    Without bincount, a 1D array is sorted and the items are the runs of
+    equal values. Rows are sorted with lexsort and a run starts where any
+    column differs from the previous row.
     """
-    scores = _support.unique(a)
-    freq = zeros(len(scores))
-    if a.ndim == 1:
-        scores = np.sort(scores)
-        for i in range(len(scores)):
-            freq[i] = np.sum(a==scores[i])
-    elif a.ndim == 2:
-        scores = scores[np.lexsort(np.fliplr(scores).T)]
-        for i in range(len(scores)):
-            freq[i] = np.sum(np.all(a==scores[i],1))
-    else:
+    a = np.asarray(a)
+    if a.ndim not in (1, 2):
         raise ValueError, "Input must be <= 2-d."
+    is1d = (a.ndim == 1)
+    if is1d:
+        a = a[:,np.newaxis]
+    n, ncols = a.shape
+    if maxbins is None:
+        maxbins = max(n, 256)
+
+    if n > 0 and a.dtype.kind in 'iu':
+        amin, amax = a.min(0), a.max(0)
+        spans = [int(hi) - int(lo) + 1 for lo, hi in zip(amin, amax)]
+        nbins = 1
+        for s in spans:
+            nbins *= s
+        # large uint64 values do not fit in intp
+        if nbins <= maxbins and int(amax.max()) <= np.iinfo(np.intp).max:
+            # mixed radix code, the first column is the most significant
+            radix = np.cumprod([1] + spans[:0:-1])[::-1]
+            amin = amin.astype(np.intp)
+            codes = np.dot(a.astype(np.intp) - amin, radix)
+            counts = np.bincount(codes)
+            codes = np.flatnonzero(counts)
+            freq = counts[codes]
+            scores = np.empty((len(codes), ncols), a.dtype)
+            for j in range(ncols):
+                scores[:,j] = codes // radix[j] + amin[j]
+                codes = codes % radix[j]
+            if is1d:
+                scores = scores[:,0]
+            return np.column_stack((scores, freq.astype(float)))
+
+    if is1d:
+        sa = np.sort(a[:,0])
+        new = np.empty(n, bool)
+        new[:1] = True
+        np.not_equal(sa[1:], sa[:-1], new[1:])
+    else:
+        sa = a[np.lexsort(a.T[::-1])]
+        new = np.empty(n, bool)
+        new[:1] = True
+        new[1:] = np.any(sa[1:] != sa[:-1], 1)
+    starts = np.flatnonzero(new)
+    freq = np.diff(np.r_[starts, n])
+    return np.column_stack((sa[starts], freq.astype(float)))
+
+
+def check_itemfreq():
+    '''compare with counts of the items in a dictionary'''
+    from numpy.testing import assert_equal
+    def dictfreq(a):
+        d = {}
+        for item in a:
+            item = tuple(np.atleast_1d(item))
+            d[item] = d.get(item, 0) + 1
+        return np.array([k + (v,) for k, v in sorted(d.items())])
+
+    ints = np.random.randint(-3, 4, size=(500, 3))
+    for a in [ints[:,0], ints, ints * 1000, ints * 0.5, ints[:,0] * 1000,
+              ints.astype(np.uint8)[:,:2], ints[:,:1],
+              (ints + 3).astype(np.uint64),
+              np.array([3, 5, 3, 2**64 - 1], np.uint64),
+              np.array([-128, 127, 0, 127], np.int8)]:
+        assert_equal(itemfreq(a), dictfreq(a))
+        assert_equal(itemfreq(a, maxbins=0), dictfreq(a))
+
 
-    return array(_support.abut(scores, freq))
+if __name__ == '__main__':
+    check_itemfreq()
 
+    a=stats.randint.rvs(0,3, size=(100,2))
+    #print a
+    print scipy.stats._support.unique(a)
+    print itemfreq(a)
 
-a=stats.randint.rvs(0,3, size=(100,2))
-#print a
-print scipy.stats._support.unique(a)
-print itemfreq(a)
+    a=stats.randint.rvs(0,4, size=100)
+    print a
+    print scipy.stats._support.unique(a)
+    print itemfreq(a)
 
-a=stats.randint.rvs(0,4, size=100)
-print a
-print scipy.stats._support.unique(a)
-print itemfreq(a)
+    import time
+    a = np.random.randint(1000, size=10**7)
+    for maxbins in [None, 0]:
+        t0 = time.time()
+        itemfreq(a, maxbins=maxbins)
+        print 'itemfreq 10**7 integers, maxbins=%s: %6.3f seconds' % \
+              (maxbins, time.time() - t0)
@@ -42,10 +42,14 @@ origin = 1)[0]==ndimage.filters.correlate(x,[1,1,1],origin = 1))
 '''
 
 
+import bisect
+from collections import deque
 import numpy as np
-from scipy import signal
+from scipy import signal, stats, linalg
+from scipy.special import comb
 import matplotlib.pylab as plt
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal, \
+     assert_equal
 
 
 
@@ -54,32 +58,152 @@ def expandarr(x,k):
     #make it work for 2D or nD with axis
     return np.r_[np.ones(k)*x[0],x,np.ones(k)*x[-1]]
 
-def mov_order(x, order = 'med', windsize=3, lag='lagged'):
+def _windowindex(n, windsize, lag):
+    '''index of the observations in the moving windows, padded at the ends
 
-    #if windsize is even raise ValueError
+    Window j of a series of length n consists of the observations
+    idx[j:j+windsize], observations outside of the series are replaced by
+    the first, resp. last observation, as in expandarr.
+    '''
+    if windsize % 2 == 0:
+        raise ValueError, 'windsize has to be odd'
     if lag == 'lagged':
-        lead = windsize//2
+        offset = -(windsize - 1)
     elif lag == 'centered':
-        lead = 0
+        offset = -(windsize//2)
     elif lag == 'leading':
-        lead = -windsize//2 +1
-    else:
-        raise ValueError
-    if np.isfinite(order) == True: #if np.isnumber(order):
-        ord = order   # note: ord is a builtin function
-    elif order == 'med':
-        ord = (windsize - 1)/2
-    elif order == 'min':
-        ord = 0
-    elif order == 'max':
-        ord = windsize - 1
+        offset = 0
     else:
         raise ValueError
+    return np.clip(np.arange(offset, n+offset+windsize-1), 0, n-1)
 
-    #return signal.order_filter(x,np.ones(windsize),ord)[:-lead]
-    xext = expandarr(x, windsize)
-    #np.r_[np.ones(windsize)*x[0],x,np.ones(windsize)*x[-1]]
-    return signal.order_filter(xext,np.ones(windsize),ord)[windsize-lead:-(windsize+lead)]
+def _order_index(order, windsize):
+    '''position of the order statistic in the sorted window'''
+    if isinstance(order, str):
+        if order == 'med':
+            return (windsize - 1)//2
+        elif order == 'min':
+            return 0
+        elif order == 'max':
+            return windsize - 1
+    elif np.isfinite(order) and 0 <= order < windsize:
+        return int(order)
+    raise ValueError, 'order has to be med, min, max or an integer in range(windsize)'
+
+class RollingOrder(object):
+    '''order statistic of a moving window, updated one observation at a time
+
+    Parameters
+    ----------
+    windsize : int
+        number of observations in the window
+    order : 'med', 'min', 'max' or int
+        order statistic, an integer is the position in the sorted window,
+        e.g. int(q*(windsize-1)) for the q-quantile
+
+    Notes
+    -----
+    min and max keep a monotonic deque of the candidates, which costs O(1)
+    amortized per observation. The other order statistics keep the window
+    in a sorted list, the update is a binary search with bisect and a
+    memory move of at most windsize references, which is faster than a
+    skiplist in pure python for windows up to a few thousand.
+    nan is not supported.
+
+    Examples
+    --------
+    >>> rmed = RollingOrder(3, 'med')
+    >>> [rmed.update(xi) for xi in [3, 1, 2, 5, 4]]
+    [nan, nan, 2, 2, 4]
+    '''
+    def __init__(self, windsize, order='med'):
+        self.windsize = windsize
+        self.ord = _order_index(order, windsize)
+        if self.ord == 0:
+            self.kind = 'min'
+        elif self.ord == windsize - 1:
+            self.kind = 'max'
+        else:
+            self.kind = 'sorted'
+        self.nobs = 0
+        self.window = deque()   # observations in the window in time order
+        self.sortedwindow = []
+        self.mono = deque()     # (time index, value) of min or max candidates
+
+    def update(self, xnew):
+        '''add observation and return order statistic of the window
+
+        returns nan until windsize observations have been added
+        '''
+        windsize = self.windsize
+        if self.kind == 'sorted':
+            sortedwindow = self.sortedwindow
+            self.window.append(xnew)
+            bisect.insort(sortedwindow, xnew)
+            if len(self.window) > windsize:
+                xold = self.window.popleft()
+                del sortedwindow[bisect.bisect_left(sortedwindow, xold)]
+        else:
+            mono = self.mono
+            if self.kind == 'min':
+                while mono and mono[-1][1] >= xnew:
+                    mono.pop()
+            else:
+                while mono and mono[-1][1] <= xnew:
+                    mono.pop()
+            mono.append((self.nobs, xnew))
+            if mono[0][0] <= self.nobs - windsize:
+                mono.popleft()
+        self.nobs += 1
+        if self.nobs < windsize:
+            return np.nan
+        if self.kind == 'sorted':
+            return sortedwindow[self.ord]
+        return mono[0][1]
+
+def mov_order(x, order = 'med', windsize=3, lag='lagged', axis=0):
+    '''moving order statistic, median, min, max or other order
+
+    Parameters
+    ----------
+    x : array_like
+        time series data, 1d or nd
+    order : 'med', 'min', 'max' or int
+        order statistic, see RollingOrder
+    windsize : int
+        odd number of observations in the window
+    lag : 'lagged', 'centered' or 'leading'
+        the window at t is x[t-windsize+1:t+1] if lagged,
+        x[t-windsize//2:t+windsize//2+1] if centered and x[t:t+windsize] if
+        leading
+    axis : int
+        axis along which the moving statistic is calculated
+
+    Returns
+    -------
+    xo : ndarray, float
+        moving order statistic, same shape as x. Observations outside of
+        the array are replaced by the first, resp. last observation.
+
+    Notes
+    -----
+    Uses RollingOrder for each series, which is O(n) for min and max and
+    O(n log(windsize)) comparisons for other orders, instead of
+    signal.order_filter which sorts each window.
+    '''
+    _order_index(order, windsize)   # check order
+
+    def movorder1d(x1):
+        xs = x1[_windowindex(len(x1), windsize, lag)].tolist()
+        update = RollingOrder(windsize, order).update
+        for xi in xs[:windsize-1]:
+            update(xi)
+        return np.array([update(xi) for xi in xs[windsize-1:]])
+
+    x = np.asarray(x, float)
+    if x.ndim == 1:
+        return movorder1d(x)
+    return np.apply_along_axis(movorder1d, axis, x)
 
 def check_movorder():
     x = np.arange(1,10)
@@ -90,6 +214,16 @@ def check_movorder():
     assert_array_equal(xo, x)
     assert_array_equal(mov_order(x, order='min', lag='centered')[:-1], x[1:])
 
+    # compare with order_filter on the padded array
+    x = np.random.randn(200, 3)
+    for lag, lead in [('lagged', 5), ('centered', 0), ('leading', -5)]:
+        for order, ordi in [('med', 5), ('min', 0), ('max', 10), (2, 2)]:
+            xo = mov_order(x, order=order, windsize=11, lag=lag, axis=0)
+            for i in range(3):
+                xext = expandarr(x[:,i], 11)
+                xof = signal.order_filter(xext, np.ones(11), ordi)[11-lead:-(11+lead)]
+                assert_array_equal(xo[:,i], xof)
+
     tt = np.linspace(0,2*np.pi,15)
     x = np.sin(tt) + 1
     xo = mov_order(x, order='max')
@@ -115,44 +249,509 @@ def check_movorder():
 ##>>> x=np.linspace(0,3,100);plt.plot(x,np.sin(x),x,signal.medfilt(np.sin(x), kernel_size=3))
 
 
-def movmeanvar(x):
-    m = np.correlate(xm,np.array([1,1,1])/3.0,'full')
-    v = np.correlate(xm*xm,np.array([1,1,1])/3.0,'full') - m**2
-#>>> np.correlate(xm*xm,np.array([1,1,1])/3.0,'valid')-np.correlate(xm*xm,np.array([1,1,1])/3.0,'valid')**2
-    return m,v
+def _movpowersums(xs, windsize, kmax):
+    '''moving sums of powers of deviations from a local shift
+
+    xs has the observations of the moving windows xs[j:j+windsize] along
+    axis 0. The series is split into blocks of length windsize, each
+    window is the suffix of one block and the prefix of the next block,
+    whose sums are obtained from cumulative sums within the blocks.
+    Deviations are taken from the block means and the prefix sums are
+    converted to the shift of the first block with the binomial expansion.
+    The rounding error depends only on the observations in two blocks
+    and not on the length of the series as for a plain cumsum.
+
+    Returns
+    -------
+    shift : ndarray
+        shift for each window
+    sums : list of ndarrays
+        sums[p-1] is the sum of (xs - shift)**p over window, p=1..kmax
+    scale : ndarray
+        sum of squares of the terms that are added up in sums[1], the
+        rounding error in sums[p-1] is of the order eps * scale**(p/2)
+    '''
+    w = windsize
+    nt = xs.shape[0]
+    n = nt - w + 1
+    nb = -(-nt // w)
+    rest = xs.shape[1:]
+    xb = np.concatenate([xs, np.repeat(xs[-1:], nb*w - nt, 0)])
+    xb = xb.reshape((nb, w) + rest)
+    shiftb = xb.mean(1)
+    dev = xb - shiftb[:,np.newaxis]
+
+    start = np.arange(n)
+    end = start + w - 1
+    bstart, bend = start // w, end // w
+    ones = (1,)*len(rest)
+    # windows that start at a block boundary are one full block
+    twoblocks = (bstart != bend).reshape((n,) + ones)
+    count = (end % w + 1).reshape((n,) + ones) * twoblocks
+    d = shiftb[bend] - shiftb[bstart]
+
+    suffix, prefix = [], []
+    devp = np.ones(dev.shape)
+    for p in range(1, max(kmax, 2)+1):
+        devp = devp * dev
+        pre = np.cumsum(devp, 1).reshape((nb*w,) + rest)
+        suf = np.cumsum(devp[:,::-1], 1)[:,::-1].reshape((nb*w,) + rest)
+        suffix.append(suf[start])
+        prefix.append(pre[end] * twoblocks)
+    prefix = [count] + prefix    # zeroth power
+    scale = suffix[1] + prefix[2] + count * d**2
+    sums = []
+    for p in range(1, kmax+1):
+        # sum((y + d)**p) = sum_q binom(p,q) d**(p-q) sum(y**q)
+        conv = 0
+        for q in range(p+1):
+            conv = conv + comb(p, q, exact=1) * d**(p-q) * prefix[q]
+        sums.append(suffix[p-1] + conv)
+    return shiftb[bstart], sums, scale
+
+def _windowmoments(xs, windsize, select):
+    '''mean and central moments of selected windows in two passes
+
+    Parameters
+    ----------
+    xs : ndarray
+        padded series, window j is xs[j:j+windsize]
+    windsize : int
+        number of observations in the window
+    select : ndarray, bool
+        windows to calculate, shape of the moving statistics
+
+    Returns
+    -------
+    idx : tuple of ndarrays
+        index of the selected windows
+    mean, var, mu3, mu4 : ndarrays
+        mean and central moments of the selected windows
+    '''
+    idx = np.nonzero(select)
+    xw = xs[(idx[0][:,np.newaxis] + np.arange(windsize),) +
+            tuple(i[:,np.newaxis] for i in idx[1:])]
+    # deviations from the first observation are zero for constant windows
+    d = xw - xw[:,:1]
+    m1 = d.mean(1)
+    dev = d - m1[:,np.newaxis]
+    dev2 = dev * dev
+    return (idx, xw[:,0] + m1, dev2.mean(1), (dev2 * dev).mean(1),
+            (dev2 * dev2).mean(1))
+
+def mov_moments(x, windsize=3, lag='lagged', axis=0):
+    '''moving mean, variance, skew and kurtosis
+
+    Parameters
+    ----------
+    x : array_like
+        time series data, 1d or nd
+    windsize : int
+        odd number of observations in the window
+    lag : 'lagged', 'centered' or 'leading'
+        alignment of the window, see mov_order
+    axis : int
+        axis along which the moving statistics are calculated
+
+    Returns
+    -------
+    mean, var, skew, kurt : ndarrays
+        moving moments with the same shape as x, var with ddof=0, skew and
+        excess kurtosis are the biased estimates as in stats.skew and
+        stats.kurtosis. Observations outside of the array are replaced by
+        the first, resp. last observation.
+
+    Notes
+    -----
+    O(n) for any window size, see _movpowersums for the numerical
+    precision. Windows with a spread that is small compared to the shift,
+    e.g. constant windows, are recalculated directly. RollingMoments
+    calculates the same moments for streaming data.
+    '''
+    x = np.rollaxis(np.asarray(x, float), axis)
+    xs = x[_windowindex(x.shape[0], windsize, lag)]
+    shift, (s1, s2, s3, s4), scale = _movpowersums(xs, windsize, 4)
+    m1, m2, m3, m4 = s1/windsize, s2/windsize, s3/windsize, s4/windsize
+    mean = shift + m1
+    var = np.maximum(m2 - m1**2, 0)
+    mu3 = m3 - 3*m1*m2 + 2*m1**3
+    mu4 = m4 - 4*m1*m3 + 6*m1**2*m2 - 3*m1**4
+    # about log10(scale/var) digits are lost, twice as many for skew and
+    # kurt, windows with a small spread relative to the shifts are
+    # recalculated
+    illcond = scale > 100 * windsize * var
+    if illcond.any():
+        direct = _windowmoments(xs, windsize, illcond)
+        idx = direct[0]
+        mean[idx], var[idx], mu3[idx], mu4[idx] = direct[1:]
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        skew = mu3 / var**1.5
+        kurt = mu4 / var**2 - 3
+    finally:
+        np.seterr(**olderr)
+    # undefined for constant windows, e.g. the last window if leading
+    skew[var == 0] = np.nan
+    kurt[var == 0] = np.nan
+    return [np.rollaxis(arr, 0, axis+1) for arr in (mean, var, skew, kurt)]
+
+def movmeanvar(x, windsize=3, lag='lagged', axis=0):
+    '''moving mean and variance (ddof=0), see mov_moments'''
+    x = np.rollaxis(np.asarray(x, float), axis)
+    xs = x[_windowindex(x.shape[0], windsize, lag)]
+    shift, (s1, s2), scale = _movpowersums(xs, windsize, 2)
+    m1, m2 = s1/windsize, s2/windsize
+    m = shift + m1
+    v = np.maximum(m2 - m1**2, 0)
+    illcond = scale > 100 * windsize * v
+    if illcond.any():
+        direct = _windowmoments(xs, windsize, illcond)
+        idx = direct[0]
+        m[idx], v[idx] = direct[1:3]
+    return np.rollaxis(m, 0, axis+1), np.rollaxis(v, 0, axis+1)
+
+def movmoment(x, k, windsize=3, lag='lagged', axis=0):
+    '''non-central moment
+
+    moving mean of x**k, calculated from the moments around a local shift,
+    see mov_moments
+    '''
+    x = np.rollaxis(np.asarray(x, float), axis)
+    xs = x[_windowindex(x.shape[0], windsize, lag)]
+    shift, sums = _movpowersums(xs, windsize, k)[:2]
+    # E(x**k) = sum_q binom(k,q) shift**(k-q) E((x-shift)**q)
+    res = shift**k
+    for q in range(1, k+1):
+        res = res + comb(k, q, exact=1) * shift**(k-q) * sums[q-1]/windsize
+    return np.rollaxis(res, 0, axis+1)
+
+class RollingMoments(object):
+    '''moving mean, variance, skew and kurtosis for streaming data
+
+    The central moment sums of the window are updated when an observation
+    is added and when the oldest observation drops out of the window, with
+    the one pass updating formulas of Welford and Pebay and their
+    inverse. Each update is O(1) and is vectorized over the series.
+
+    Parameters
+    ----------
+    windsize : int
+        number of observations in the window
+
+    Notes
+    -----
+    Until windsize observations have been added, the moments of the
+    available observations are returned. The downdating formulas
+    accumulate rounding errors over a long stream, mov_moments recomputes
+    the moments from local sums.
+
+    Examples
+    --------
+    >>> rm = RollingMoments(20)
+    >>> for xt in np.random.randn(100, 3):
+    ...     mean, var, skew, kurt = rm.update(xt)
+
+    References
+    ----------
+    Pebay, P. (2008), Formulas for Robust, One-Pass Parallel Computation of
+    Covariances and Arbitrary-Order Statistical Moments, Sandia Report
+    SAND2008-6212
+    '''
+    def __init__(self, windsize):
+        self.windsize = windsize
+        self.window = deque()
+        self.nobs = 0
+        self.mean = self.M2 = self.M3 = self.M4 = 0.
+
+    def _add(self, x):
+        n1 = self.nobs + 1
+        delta = x - self.mean
+        delta_n = delta / n1
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * self.nobs
+        self.mean = self.mean + delta_n
+        self.M4 = self.M4 + term1 * delta_n2 * (n1*n1 - 3*n1 + 3) + \
+                  6 * delta_n2 * self.M2 - 4 * delta_n * self.M3
+        self.M3 = self.M3 + term1 * delta_n * (n1 - 2) - 3 * delta_n * self.M2
+        self.M2 = self.M2 + term1
+        self.nobs = n1
+
+    def _remove(self, x):
+        n = self.nobs
+        n0 = n - 1
+        mean0 = (n * self.mean - x) / n0
+        delta = x - mean0
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n0
+        M2 = self.M2 - term1
+        M3 = self.M3 - term1 * delta_n * (n - 2) + 3 * delta_n * M2
+        self.M4 = self.M4 - term1 * delta_n2 * (n*n - 3*n + 3) - \
+                  6 * delta_n2 * M2 + 4 * delta_n * M3
+        self.M2, self.M3, self.mean, self.nobs = M2, M3, mean0, n0
+
+    def update(self, xnew):
+        '''add observation, one for each series, and return moments
 
-def movmoment(x,k):
-    '''non-central moment'''
-    return np.correlate(xm**k,np.array([1,1,1])/3.0,'full')
+        Parameters
+        ----------
+        xnew : float or ndarray
+            new observation, an array has one observation for each series
 
+        Returns
+        -------
+        mean, var, skew, kurt : float or ndarrays
+            moments of the current window, see mov_moments
+        '''
+        xnew = np.asarray(xnew, float)
+        self.window.append(xnew)
+        self._add(xnew)
+        if len(self.window) > self.windsize:
+            self._remove(self.window.popleft())
+        n = self.nobs
+        var = np.maximum(self.M2 / n, 0)
+        olderr = np.seterr(divide='ignore', invalid='ignore')
+        try:
+            skew = self.M3 / n / var**1.5
+            kurt = self.M4 / n / var**2 - 3
+        finally:
+            np.seterr(**olderr)
+        return self.mean, var, skew, kurt
 
-#None of the acovf, ... are tested; starting index? orientation?
-def acovf(x):
-    ''' autocovariance for 1D
+def _movmoments_loop(x, windsize, lag):
+    '''moments of each window of a 1d series, reference for check_movmoments'''
+    xs = x[_windowindex(len(x), windsize, lag)]
+    res = np.zeros((4, len(x)))
+    for j in range(len(x)):
+        xw = xs[j:j+windsize]
+        res[:,j] = [np.mean(xw), np.var(xw), stats.skew(xw),
+                    stats.kurtosis(xw)]
+    return res
+
+def check_movmoments():
+    '''compare moving moments with a loop over the windows'''
+    x = np.random.randn(200, 3)
+    x[:,1] = 1e9 + x[:,1]
+    x[:,2] = np.exp(x[:,2])
+    w = 11
+    for lag in ['lagged', 'centered', 'leading']:
+        mom = mov_moments(x, windsize=w, lag=lag)
+        momt = mov_moments(x.T, windsize=w, lag=lag, axis=1)
+        mv = movmeanvar(x, windsize=w, lag=lag)
+        m2 = movmoment(x, 2, windsize=w, lag=lag)
+        m3 = movmoment(x[:,[0,2]], 3, windsize=w, lag=lag)
+        for i in range(3):
+            # the loop loses precision with the offset, subtracting the
+            # offset is exact and doesn't change the central moments
+            offset = (i == 1) * 1e9
+            decimal = 8 - 2*(i == 1)
+            res = _movmoments_loop(x[:,i] - offset, w, lag)
+            assert_array_almost_equal(mom[0][:,i] - offset, res[0], decimal)
+            for m in range(1, 4):
+                assert_array_almost_equal(mom[m][:,i], res[m], decimal)
+            for m in range(4):
+                assert_array_almost_equal(momt[m][i], mom[m][:,i], 14)
+            assert_array_almost_equal(mv[0][:,i], mom[0][:,i], 14)
+            assert_array_almost_equal(mv[1][:,i], mom[1][:,i], 14)
+        xs = x[_windowindex(len(x), w, lag)]
+        for i, col in enumerate([0, 2]):
+            xw = np.array([xs[j:j+w,col] for j in range(len(x))])
+            assert_array_almost_equal(m2[:,col], (xw**2).mean(1), 12)
+            assert_array_almost_equal(m3[:,i], (xw**3).mean(1), 10)
+
+    # streaming moments, moments of the available observations until the
+    # window is filled, then the lagged moving moments
+    x = x[:,[0,2]]
+    rm = RollingMoments(w)
+    rmom = np.array([rm.update(xt) for xt in x])
+    mom = mov_moments(x, windsize=w)
+    for t in range(w-1):
+        xw = x[:t+1]
+        assert_array_almost_equal(rmom[t,0], xw.mean(0), 12)
+        assert_array_almost_equal(rmom[t,1], xw.var(0), 12)
+        if t > 0:
+            assert_array_almost_equal(rmom[t,2], stats.skew(xw), 10)
+            assert_array_almost_equal(rmom[t,3], stats.kurtosis(xw), 10)
+    # the downdating accumulates rounding errors
+    for m in range(4):
+        assert_array_almost_equal(rmom[w-1:,m], mom[m][w-1:], 6)
+
+def _nextregular(target):
+    '''smallest 5-smooth number (2**a * 3**b * 5**c) >= target
+
+    fast length for the fft
     '''
-    n = len(x)
-    xo = x - x.mean();
-    xi = np.ones(n);
-    d = np.correlate(xi,xi,'full')
-    return ( np.correlate(xo,xo,'full')/d )[n-1:]
-
-def ccovf(x,y):
-    ''' crosscovariance for 1D
+    if target <= 6:
+        return target
+    best = 2**int(np.ceil(np.log2(target)))
+    p5 = 1
+    while p5 < target:
+        p35 = p5
+        while p35 < target:
+            # smallest power of 2 with p35 * 2**k >= target
+            quotient = -(-target // p35)
+            p2 = 2**int(np.ceil(np.log2(quotient)))
+            n = p2 * p35
+            # correct for rounding in log2
+            while n // 2 >= target and n % 2 == 0:
+                n //= 2
+            best = min(best, n)
+            p35 *= 3
+        best = min(best, p35)
+        p5 *= 5
+    return min(best, p5)
+
+def _covfft(x, y, unbiased, demean, nlags):
+    '''cross-products sum_t x[t+k]*y[t] for k=0..nlags along axis 0
+
+    x and y are 2d with series in columns, all columns are transformed in
+    one call to rfft, zero padded to a fast length of at least 2n-1 to
+    avoid the circular wrap around.
+    '''
+    n = x.shape[0]
+    if demean:
+        x = x - x.mean(0)
+        y = y - y.mean(0)
+    nfft = _nextregular(2*n - 1)
+    fx = np.fft.rfft(x, nfft, axis=0)
+    if y is x:
+        fxy = fx * fx.conj()
+    else:
+        fxy = fx * np.fft.rfft(y, nfft, axis=0).conj()
+    cov = np.fft.irfft(fxy, nfft, axis=0)[:nlags+1]
+    if unbiased:
+        cov /= (n - np.arange(nlags+1))[:,np.newaxis]
+    else:
+        cov /= n
+    return cov
+
+def _as2d(x, axis):
+    x = np.asarray(x, float)
+    if x.ndim == 1:
+        return x[:,np.newaxis], True
+    return np.rollaxis(x, axis), False
+
+def _nlagscheck(n, nlags):
+    if nlags is None:
+        return n - 1
+    if nlags < 0 or nlags > n - 1:
+        raise ValueError, 'nlags has to be in range(n)'
+    return nlags
+
+def acovf(x, unbiased=True, demean=True, nlags=None, axis=0):
+    '''autocovariance function, for 1D or for the columns of 2D x
+
+    Parameters
+    ----------
+    x : array_like, 1d or 2d
+        time series, in 2d the series are along axis
+    unbiased : bool
+        If True (default), the sum of cross-products at lag k is divided
+        by n-k, otherwise by n
+    demean : bool
+        If True (default), subtract the mean of each series
+    nlags : None or int
+        maximum lag, default n-1
+    axis : int
+        time axis of 2d x
+
+    Returns
+    -------
+    acov : ndarray
+        autocovariance for lags 0 to nlags, lags are along axis
+
+    Notes
+    -----
+    Uses the fft, zero padded to a fast length, which is O(n log n)
+    instead of O(n**2) for np.correlate. All series are transformed in a
+    single call.
+    '''
+    x2, is1d = _as2d(x, axis)
+    nlags = _nlagscheck(x2.shape[0], nlags)
+    acov = _covfft(x2, x2, unbiased, demean, nlags)
+    if is1d:
+        return acov[:,0]
+    return np.rollaxis(acov, 0, axis+1)
+
+def ccovf(x, y, unbiased=True, demean=True, nlags=None, axis=0):
+    '''crosscovariance function, for 1D or for the columns of 2D x and y
+
+    ccov[k] is the covariance of x[t+k] and y[t], see acovf for the
+    parameters. x and y need to have the same shape.
     '''
-    n = len(x)
-    xo = x - x.mean();
-    yo = y - y.mean();
-    xi = np.ones(10);
-    d = np.correlate(xi,xi,'full')
-    return ( np.correlate(xo,yo,'full')/d )[n-1:]
+    x2, is1d = _as2d(x, axis)
+    y2, _ = _as2d(y, axis)
+    if x2.shape != y2.shape:
+        raise ValueError, 'x and y need to have the same shape'
+    nlags = _nlagscheck(x2.shape[0], nlags)
+    ccov = _covfft(x2, y2, unbiased, demean, nlags)
+    if is1d:
+        return ccov[:,0]
+    return np.rollaxis(ccov, 0, axis+1)
 
-def acf(x):
-    avf = acovf(x)
-    return avf/avf[0]
+def acf(x, unbiased=True, nlags=None, axis=0):
+    '''autocorrelation function, see acovf'''
+    avf = acovf(x, unbiased=unbiased, nlags=nlags, axis=axis)
+    if avf.ndim == 1:
+        return avf/avf[0]
+    avf = np.rollaxis(avf, axis)
+    return np.rollaxis(avf/avf[0], 0, axis+1)
 
-def ccf(x,y):
-    cvf = ccovf(x,y)
-    return cvf/np.std(x)/np.std(y)
+def ccf(x, y, unbiased=True, nlags=None, axis=0):
+    '''crosscorrelation function, see ccovf'''
+    cvf = ccovf(x, y, unbiased=unbiased, nlags=nlags, axis=axis)
+    if cvf.ndim == 1:
+        return cvf/np.std(x)/np.std(y)
+    cvf = np.rollaxis(cvf, axis)
+    cvf = cvf/np.std(x, axis=axis)/np.std(y, axis=axis)
+    return np.rollaxis(cvf, 0, axis+1)
+
+def pacf(x, nlags=None, axis=0):
+    '''partial autocorrelation function, for 1D or for the columns of 2D x
+
+    Parameters
+    ----------
+    x : array_like, 1d or 2d
+        time series, in 2d the series are along axis
+    nlags : None or int
+        maximum lag, default min(n-1, 40)
+    axis : int
+        time axis of 2d x
+
+    Returns
+    -------
+    pacf : ndarray
+        partial autocorrelation for lags 0 to nlags, lags are along axis
+
+    Notes
+    -----
+    Yule-Walker estimates, solved recursively with the Levinson-Durbin
+    algorithm for all series at the same time. The biased autocovariance
+    (divided by n) is used, which keeps the Toeplitz matrix positive
+    definite.
+    '''
+    x2, is1d = _as2d(x, axis)
+    n, k = x2.shape
+    if nlags is None:
+        nlags = min(n - 1, 40)
+    nlags = _nlagscheck(n, nlags)
+    r = _covfft(x2, x2, False, True, nlags)
+    r = r / r[0]
+    pac = np.ones((nlags+1, k))
+    phi = np.zeros((nlags+1, k))     # AR coefficients of current order
+    sigma = np.ones(k)
+    for p in range(1, nlags+1):
+        # reflection coefficient
+        kappa = (r[p] - (phi[1:p] * r[p-1:0:-1]).sum(0)) / sigma
+        phinew = phi.copy()
+        phinew[1:p] = phi[1:p] - kappa * phi[p-1:0:-1]
+        phinew[p] = kappa
+        phi = phinew
+        sigma = sigma * (1 - kappa**2)
+        pac[p] = kappa
+    if is1d:
+        return pac[:,0]
+    return np.rollaxis(pac, 0, axis+1)
 
 
 #x=0.5**np.arange(10);xm=x-x.mean();a=np.correlate(xm,[1],'full')
@@ -204,6 +803,9 @@ def VAR(x,B, const=0):
     xhat does not include the forecasting observation, xhat(T+1),
     xhat is 1 row shorter than signal.correlate
 
+    The sum over lags is calculated as P matrix products of the lagged
+    (T-P)xK observations with B[p], without a loop over time periods.
+
     References
     ----------
     http://en.wikipedia.org/wiki/Vector_Autoregression
@@ -212,11 +814,20 @@ def VAR(x,B, const=0):
     p = B.shape[0]
     T = x.shape[0]
     xhat = np.zeros(x.shape)
-    for t in range(p,T): #[p+2]:#
-##        print p,T
-##        print x[t-p:t,:,np.newaxis].shape
-##        print B.shape
-        #print x[t-p:t,:,np.newaxis]
+    if T <= p:
+        return xhat
+    # one matrix product for each lag over all time periods
+    for i in range(p):
+        xhat[p:] += np.dot(x[i:T-p+i], B[i])
+    xhat[p:] += const
+    return xhat
+
+def _VAR_loop(x,B, const=0):
+    '''VAR with a loop over time periods, reference for check_var'''
+    p = B.shape[0]
+    T = x.shape[0]
+    xhat = np.zeros(x.shape)
+    for t in range(p,T):
         xhat[t,:] = const + (x[t-p:t,:,np.newaxis]*B).sum(axis=1).sum(axis=0)
     return xhat
 
@@ -238,27 +849,128 @@ def VARMA(x,B,C, const=0):
 
     x (TxK)
     B (PxKxK)
+    C (QxKxK)
 
     xhat(t,i) = sum{_p}sum{_k} { x(t-P:t,:) .* B(:,:,i) } +
                 sum{_q}sum{_k} { e(t-Q:t,:) .* C(:,:,i) }for all i = 0,K-1
 
+    Notes
+    -----
+    The autoregressive part and the constant are calculated for all time
+    periods with one matrix product per lag, as in VAR. The moving average
+    part is a recursion in the errors, e(t) = u(t) - sum{_q} e(t-Q+q) C(q)
+    with u = x - AR part. If all C(q) are diagonal, then the variables
+    are not linked by the errors and each error series is obtained by
+    signal.lfilter. Otherwise the recursion loops over time with the
+    stacked lagged errors as state, one (QK)xK matrix-vector product per
+    time period.
     '''
     P = B.shape[0]
     Q = C.shape[0]
+    T, K = x.shape
+    xhat = np.zeros(x.shape)
+    e = np.zeros(x.shape)
+    start = max(P,Q)
+    if T <= start:
+        return xhat, e
+    u = np.asarray(x, float) - const
+    for p in range(P):
+        u[start:] -= np.dot(x[start-P+p:T-P+p], B[p])
+    if not np.any(C):
+        e[start:] = u[start:]
+    elif np.all([np.all(C[q] == np.diag(np.diag(C[q]))) for q in range(Q)]):
+        for i in range(K):
+            # C[0] is the coefficient of the largest lag
+            e[start:,i] = signal.lfilter([1], np.r_[1, C[::-1,i,i]], u[start:,i])
+    else:
+        Cstack = C.reshape(Q*K, K)
+        for t in range(start,T):
+            e[t] = u[t] - np.dot(e[t-Q:t].ravel(), Cstack)
+    xhat[start:] = x[start:] - e[start:]
+    return xhat, e
+
+def _VARMA_loop(x,B,C, const=0):
+    '''VARMA with a loop over time periods, reference for check_var'''
+    P = B.shape[0]
+    Q = C.shape[0]
     T = x.shape[0]
     xhat = np.zeros(x.shape)
     e = np.zeros(x.shape)
     start = max(P,Q)
-    for t in range(start,T): #[p+2]:#
-##        print p,T
-##        print x[t-p:t,:,np.newaxis].shape
-##        print B.shape
-        #print x[t-p:t,:,np.newaxis]
+    for t in range(start,T):
         xhat[t,:] =  const + (x[t-P:t,:,np.newaxis]*B).sum(axis=1).sum(axis=0) + \
                      (e[t-Q:t,:,np.newaxis]*C).sum(axis=1).sum(axis=0)
         e[t,:] = x[t,:] - xhat[t,:]
     return xhat, e
 
+def check_var():
+    '''compare VAR and VARMA with the loops over time periods'''
+    T, K, P, Q = 200, 3, 3, 2
+    x = np.random.randn(T, K)
+    B = 0.1 * np.random.randn(P, K, K)
+    const = np.array([0.5, 0, -1.])
+    assert_array_almost_equal(VAR(x, B, const), _VAR_loop(x, B, const), 12)
+    for C in [np.zeros((Q, K, K)),
+              np.array([np.diag(0.3 * np.random.randn(K)) for q in range(Q)]),
+              0.2 * np.random.randn(Q, K, K)]:
+        xhat, e = VARMA(x, B, C, const)
+        xhat2, e2 = _VARMA_loop(x, B, C, const)
+        assert_array_almost_equal(xhat, xhat2, 12)
+        assert_array_almost_equal(e, e2, 12)
+    # more MA than AR lags
+    B = B[:1]
+    xhat, e = VARMA(x, B, C)
+    assert_array_almost_equal(xhat, _VARMA_loop(x, B, C)[0], 12)
+
+def check_acf():
+    '''compare acovf, ccovf, acf, ccf and pacf with direct calculations'''
+    # 2n-1 = 193 is not 5-smooth, the fft is zero padded
+    n = 97
+    x = np.random.randn(n, 2)
+    x[:,1] = np.convolve(np.random.randn(n+2), [1, 0.6, 0.3], 'valid')
+    y = 0.5 * x + np.random.randn(n, 2)
+    xm, ym = x - x.mean(0), y - y.mean(0)
+    lags = np.arange(n)
+    for i in range(2):
+        # sum_t x[t+k]*y[t] for k = 0..n-1
+        sxx = np.correlate(xm[:,i], xm[:,i], 'full')[n-1:]
+        sxy = np.correlate(xm[:,i], ym[:,i], 'full')[n-1:]
+        sraw = np.correlate(x[:,i], x[:,i], 'full')[n-1:]
+        for unbiased, denom in [(True, n - lags), (False, n)]:
+            acov = sxx / denom
+            ccov = sxy / denom
+            assert_array_almost_equal(acovf(x[:,i], unbiased), acov, 12)
+            assert_array_almost_equal(acovf(x[:,i], unbiased, demean=False),
+                                      sraw / denom, 12)
+            assert_array_almost_equal(acovf(x, unbiased)[:,i], acov, 12)
+            assert_array_almost_equal(acovf(x.T, unbiased, nlags=10,
+                                            axis=1)[i], acov[:11], 12)
+            assert_array_almost_equal(ccovf(x[:,i], y[:,i], unbiased),
+                                      ccov, 12)
+            assert_array_almost_equal(ccovf(x.T, y.T, unbiased, nlags=10,
+                                            axis=1)[i], ccov[:11], 12)
+            assert_array_almost_equal(acf(x[:,i], unbiased), acov/acov[0], 12)
+            assert_array_almost_equal(acf(x.T, unbiased, nlags=10,
+                                          axis=1)[i], acov[:11]/acov[0], 12)
+            cc = ccov / x[:,i].std() / y[:,i].std()
+            assert_array_almost_equal(ccf(x[:,i], y[:,i], unbiased), cc, 12)
+            assert_array_almost_equal(ccf(x, y, unbiased, nlags=10)[:,i],
+                                      cc[:11], 12)
+            assert_array_almost_equal(ccf(x.T, y.T, unbiased, nlags=10,
+                                          axis=1)[i], cc[:11], 12)
+
+        # Yule-Walker regression, the last coefficient at each lag
+        r = sxx / n
+        nlags = 20
+        pac = np.ones(nlags+1)
+        for p in range(1, nlags+1):
+            pac[p] = np.linalg.solve(linalg.toeplitz(r[:p]), r[1:p+1])[-1]
+        assert_array_almost_equal(pacf(x[:,i], nlags), pac, 12)
+        assert_array_almost_equal(pacf(x, nlags)[:,i], pac, 12)
+        assert_array_almost_equal(pacf(x.T, nlags, axis=1)[i], pac, 12)
+    assert_array_almost_equal(pacf(x[:,0])[:2], pacf(x[:,0], 1), 14)
+    assert_equal(len(pacf(x[:,0])), 41)
+
 T = 20
 K = 2
 Q = 2
@@ -307,5 +1019,12 @@ print np.all(signal.correlate(x0,B[:,:,0],'valid')[:-1,0]==xhat0[P:,0])
 print np.all(signal.correlate(x0,B[:,:,1],'valid')[:-1,0]==xhat0[P:,1])
 
 aav = acovf(x[:,0])
-print aav[0] == np.var(x[:,0])
+print np.allclose(aav[0], np.var(x[:,0]))
 aac = acf(x[:,0])
+
+
+if __name__ == '__main__':
+    check_movorder()
+    check_movmoments()
+    check_var()
+    check_acf()
@@ -4,6 +4,7 @@
 
 import numpy as np
 from numpy.testing import assert_array_equal, assert_equal
+from regression.groupby import GroupBy
 
 
 def ptable(data, dv, keep, outformat='flat'):
@@ -34,35 +35,35 @@ def ptable(data, dv, keep, outformat='flat'):
     statarr: 2D array  if outformat = 'flat'
     {uns, mmean, mstd, mcount} if outformat = 'table'
     
+    Notes
+    -----
+    The combinations of the explanatory variables are factorized with
+    regression.groupby.GroupBy, the columns are combined into a single
+    integer key in mixed radix, and the statistics are computed with
+    sparse group sums. The 'table' output is filled directly from the
+    codes of each combination, which gives the same result as flat2nd on
+    the flat table.
 
     '''
-    # build dictionary with unique combination as keys
-    #   and corresponding row indices as values
-    catdata = {}
-    for index, row in enumerate(data):
-        catdata.setdefault(tuple(row[keep]),[]).append(index)
-
-    # calculate statistics for each combination (key)
-    stat = []
-    for k,v in sorted(catdata.iteritems()):
-        m = data[v,dv].mean()
-        s = data[v,dv].std()
-        stat.append(list(k) + [m, s, len(v)])
-
-    # convert result statistic to numpy arrays
-    statarr = np.array(stat)
-    
+    keep = np.atleast_1d(keep)
+    # factorize the combinations of the explanatory variables once
+    g = GroupBy(data[:,keep])
+    y = data[:,dv]
+    mean = g.mean(y)
+    std = g.std(y)
+    count = g.count()
+
     if outformat == 'flat':
-        return statarr
+        return np.column_stack((g.uniques, mean, std, count))
     elif outformat == 'table':
-        # convert flat table to multidimensional
-        K = len(keep)
-#        mmean, uns = flat2multi(statarr[:,range(K)+[K]])
-#        mstd, uns = flat2multi(statarr[:,range(K)+[K+1]])
-#        mcount, uns = flat2multi(statarr[:,range(K)+[K+2]])
-        mmean, uns = flat2nd(statarr[:,range(K)+[K]])
-        mstd, uns = flat2nd(statarr[:,range(K)+[K+1]])
-        mcount, uns = flat2nd(statarr[:,range(K)+[K+2]])
+        # fill the multidimensional table directly from the group codes
+        uns = g.levels
+        dims = [len(un) for un in uns]
+        index = tuple(g.groupcodes.T)
+        mmean, mstd, mcount = [np.nan * np.ones(dims) for i in range(3)]
+        mmean[index] = mean
+        mstd[index] = std
+        mcount[index] = count
         return uns, mmean, mstd, mcount
     else:
         raise ValueError, "outformat can only be 'flat' or 'table'"
@@ -147,16 +148,14 @@ def test_flat2multi():
 
 def table2flat(res,uns):
     '''flatten a table
-    works only for 2D because of meshgrid
+    the rows of the combinations are in the order of np.ravel(res)
     '''
-    F = np.column_stack(map(lambda(x):np.ravel(x,order='F'),np.meshgrid(*uns)))
-    return np.c_[F,res[ii2]]
+    return np.column_stack((cartesian(uns), np.ravel(res)))
 
 def ndtable2flat(uns,*res):
-    '''flatten a table
-    works only for 2D because of meshgrid
+    '''flatten one or several tables with the same axes uns
     '''
-    return np.column_stack([np.array(veccombo(uns))]+map(np.ravel,res)).copy()
+    return np.column_stack([cartesian(uns)]+map(np.ravel,res))
     #return np.c_[np.array(veccombo(uns)),res.ravel()]  #[ii2]]
 
 def veccombo(seq,y=None):
@@ -220,55 +219,140 @@ def veccombo(seq,y=None):
            [2, 1],
            [2, 3]])
     
+    The last array can be 2D, then each of its rows is one element and is
+    appended to the combination (used by veccombo_withversions)
+    >>> veccombo([[1,2], np.array([[1,10],[2,20]])])
+    [[1, 1, 10], [1, 2, 20], [2, 1, 10], [2, 2, 20]]
+
+    Notes
+    -----
+    The combinations of the row indices of the arrays are created by
+    cartesian, and the rows of each array are gathered with the indices.
+    The elements keep the type of their array, e.g. integers and strings
+    in different arrays are not converted to strings. Lists that do not
+    convert to a numeric array, and 2D arrays before the last position
+    are combined by the list based recursion _veccombo_lists.
+    Use cartesian or iter_cartesian directly for large grids.
+    '''
+    if y is not None:
+        return _veccombo_lists(seq, y)
+    arrays = []
+    for ii, a in enumerate(seq):
+        try:
+            arr = np.asarray(a)
+        except ValueError:
+            return _veccombo_lists(seq)
+        # lists are converted only if they are numeric, a list with mixed
+        # types would become an array of strings
+        typed = isinstance(a, np.ndarray) or arr.dtype.kind in 'biufc'
+        if (not typed or arr.dtype == object or arr.ndim == 0 or arr.ndim > 2
+            or (arr.ndim == 2 and ii < len(seq) - 1)):
+            return _veccombo_lists(seq)
+        arrays.append(arr)
+    index = cartesian([np.arange(len(a)) for a in arrays])
+    # known number of columns, index is empty if one of the arrays is empty
+    parts = [a[index[:,j]].reshape(len(index), (a.shape[1] if a.ndim == 2 else 1))
+             for j, a in enumerate(arrays)]
+    if len(set([part.dtype for part in parts])) == 1:
+        res = np.column_stack(parts)
+    else:
+        # object array keeps the type of each array in tolist
+        res = np.empty((len(index), sum([part.shape[1] for part in parts])),
+                       object)
+        col = 0
+        for part in parts:
+            res[:,col:col+part.shape[1]] = part
+            col += part.shape[1]
+    return res.tolist()
+
+def _veccombo_lists(seq,y=None):
+    '''list based recursion of veccombo for general sequences
     '''
     res = []
     n = len(seq)
     if y is None:
         #initialize last list to list of lists
         yn = [(hasattr(ii,'__iter__') and list(ii)) or [ii] for ii in seq[-1]]
-        return veccombo(seq[:-1],y=yn)
+        return _veccombo_lists(seq[:-1],y=yn)
     # prepend current list
     for ii in seq[-1]:
         for jj in y:
             res.append([ii] + jj)
 
     if n > 2:
-        return veccombo(seq[:-1],y=res[:])
+        return _veccombo_lists(seq[:-1],y=res[:])
     elif n == 2:
         # args needs to be an iterable of iterable(s)
-        return veccombo([seq[0]],y=res[:])
+        return _veccombo_lists([seq[0]],y=res[:])
     else:
         return res
 
+def cartesian(seq, dtype=None):
+    '''all combinations of the elements of several 1D arrays as a 2D array
+
+    Given [a1, a2, a3], returns an array with rows (a1_i, a2_j, a3_k) for
+    all i, j, k, in lexicographic order with the last column changing
+    fastest. This is the same order as the elements of a table with axes
+    a1, a2, a3 in np.ravel.
+
+    Parameters
+    ----------
+    seq : sequence of array_like
+        list of 1D arrays or lists
+    dtype : None or dtype
+        dtype of the result, the common dtype of the arrays by default
+
+    Returns
+    -------
+    res : ndarray (N, K)
+        contiguous array with N = product of the lengths and K = len(seq)
+
+    Example
+    -------
+    >>> cartesian([[11,12,13], [21,22]])
+    array([[11, 21],
+           [11, 22],
+           [12, 21],
+           [12, 22],
+           [13, 21],
+           [13, 22]])
+    '''
+    arrays = [np.asarray(a).ravel() for a in seq]
+    if dtype is None:
+        dtype = np.result_type(*arrays)
+    dims = [len(a) for a in arrays]
+    K = len(arrays)
+    res = np.empty((np.prod(dims, dtype=int), K), dtype)
+    # assign each column by broadcasting into the K-dimensional view
+    resnd = res.reshape(dims + [K])
+    for j, a in enumerate(arrays):
+        shape = [1] * K
+        shape[j] = dims[j]
+        resnd[...,j] = a.reshape(shape)
+    return res
+
+def iter_cartesian(seq, chunksize=1000000, dtype=None):
+    '''iterate over the rows of cartesian(seq) in chunks
+
+    yields 2D arrays with at most chunksize rows, the concatenation is
+    equal to cartesian(seq). Only one chunk is in memory.
+    '''
+    arrays = [np.asarray(a).ravel() for a in seq]
+    if dtype is None:
+        dtype = np.result_type(*arrays)
+    dims = [len(a) for a in arrays]
+    nrows = np.prod(dims, dtype=int)
+    for start in xrange(0, nrows, chunksize):
+        index = np.unravel_index(np.arange(start, min(start + chunksize, nrows)),
+                                 dims)
+        yield np.column_stack([a[ii] for a, ii in zip(arrays, index)]).astype(dtype)
+
+
 def veccombo_withversions(args,y=None):
-    #print args
-    res = []
-    n = len(args)
-##    if args == []:
-##        return y
-    if y is None:
-        #this requires last of args to be 1D np.array
-        yn = [(hasattr(ii,'__iter__') and list(ii)) or [ii] for ii in args[-1]]
-        #print 'yn init', yn
-        return veccombo(args[:-1],y=yn) #args[-1][:,np.newaxis].tolist())
-    for ii in args[-1]:
-        for jj in y:
-            #print [ii],jj
-            res.append([ii] + jj)
-##            jj.insert(0,ii)
-##            print 'jjnew', jj
-##            res.append(jj)
-    if n > 2:
-        return veccombo(args[:-1],y=res[:])
-    elif n == 2:
-        #print 'in n==2'
-        return veccombo([args[0]],y=res[:])
-    else:
-        return res
-    
-    
-            
-    
+    '''veccombo where the last of args can be 2D, each row is one version
+    '''
+    return veccombo(args, y)
+
 
 if __name__ == '__main__':
     test_flat2multi()
@@ -328,4 +412,28 @@ if __name__ == '__main__':
     mexi3r = mexi3[~np.isnan(mexi3).any(1),:]
     assert_array_equal(mex,mexi3r)
 
-
+    # array version and chunks of the combinations
+    grid = [np.arange(3), [1.5, 2.5], np.arange(10, 14)]
+    resarr = cartesian(grid)
+    assert_array_equal(resarr[[0, 1, 7, 23]], [[0, 1.5, 10], [0, 1.5, 11],
+                                               [0, 2.5, 13], [2, 2.5, 13]])
+    assert_equal(veccombo([np.arange(2), [1.5, 2.5], [10, 11]]),
+                 [[0, 1.5, 10], [0, 1.5, 11], [0, 2.5, 10], [0, 2.5, 11],
+                  [1, 1.5, 10], [1, 1.5, 11], [1, 2.5, 10], [1, 2.5, 11]])
+    # 2D versions and mixed types give the same lists as the recursion
+    res = veccombo_withversions([np.arange(3), np.array([[1, 10], [2, 20]])])
+    assert_equal(res, [[0, 1, 10], [0, 2, 20], [1, 1, 10], [1, 2, 20],
+                       [2, 1, 10], [2, 2, 20]])
+    res = veccombo([[1, 2], ['a', 'b']])
+    assert_equal(res, [[1, 'a'], [1, 'b'], [2, 'a'], [2, 'b']])
+    assert_equal([type(v) for v in res[0]], [int, str])
+    res = veccombo([[1, 2], np.array(['a', 'b'])])
+    assert_equal(res, [[1, 'a'], [1, 'b'], [2, 'a'], [2, 'b']])
+    assert_equal(type(res[0][0]), int)
+    assert_equal(veccombo([[], [1]]), [])
+    assert_equal(veccombo([[1, 2], []]), [])
+    assert_equal(veccombo([[1, 2], np.zeros((0, 2))]), [])
+    assert_equal(veccombo([[1, 2], [[0.5, 'x'], [1.5, 'y']]]),
+                 [[1, 0.5, 'x'], [1, 1.5, 'y'], [2, 0.5, 'x'], [2, 1.5, 'y']])
+    assert_array_equal(resarr, np.vstack(list(iter_cartesian(grid, 5))))
+    assert_equal(resarr.flags.c_contiguous, True)
@@ -0,0 +1,267 @@
+'''analysis of variance without dummy variables
+
+The sums of squares are computed from group statistics of groupby.GroupBy,
+the labels are factorized once and no (nobs, ncat) dummy matrix is
+created. All functions accept 2d responses with variables in columns and
+return results for each column.
+
+anova_oneway : one-way anova, between and within sums of squares
+anova_nway : sequential (type I) anova for several factors and their
+    interactions, balanced or unbalanced
+
+Precision
+---------
+The responses are shifted by their first observation before any sums are
+calculated, and the within sum of squares is calculated from the
+deviations from the group means. This avoids the cancellation of large
+uncentered sums, the results are the same as after subtracting the mean.
+For data like the NIST test cases SmLs07 to SmLs09, 1000000000000.4 and
+similar values, the precision is limited by the float64 representation
+of the input, the log relative errors of the certified values are about
+4, see the example in __main__.
+
+'''
+
+import numpy as np
+from scipy import stats
+from groupby import GroupBy, factorize_rows
+
+
+def _shifted(x):
+    '''responses as 2d float array shifted by the first observation'''
+    x = np.asarray(x, float)
+    is1d = (x.ndim == 1)
+    if is1d:
+        x = x[:,np.newaxis]
+    return x - x[0], is1d
+
+
+def anova_oneway(labels, x, precise=False):
+    '''one-way analysis of variance
+
+    Parameters
+    ----------
+    labels : array_like, 1d
+        group labels, integers or strings
+    x : array_like, 1d or 2d
+        responses, each column is analysed separately
+    precise : bool
+        If true, the group means and variances use compensated
+        summation, see GroupBy.var
+
+    Returns
+    -------
+    f : ndarray
+        F statistic, between mean square over within mean square
+    prob : ndarray
+        p-value of the F test
+    R2 : ndarray
+        R-squared, between sum of squares over total sum of squares
+    resstd : ndarray
+        residual standard deviation, sqrt of the within mean square
+    ssbn, sswn : ndarray
+        between and within sums of squares
+    dfbn, dfwn : int
+        degrees of freedom
+
+    The arrays are scalars for 1d x, and have one element per column for
+    2d x.
+    '''
+    xs, is1d = _shifted(x)
+    g = GroupBy(labels)
+    nobs = g.nobs
+    ncat = g.ngroups
+    counts = g.count()
+    meang = g.mean(xs, precise=precise)
+    mean = np.dot(counts, meang) / float(nobs)
+    ssbn = np.dot(counts, (meang - mean)**2)
+    sswn = g.var(xs, precise=precise).T.dot(counts)
+    dfbn = ncat - 1
+    dfwn = nobs - ncat
+    msb = ssbn / float(dfbn)
+    msw = sswn / float(dfwn)
+    f = msb / msw
+    prob = stats.f.sf(f, dfbn, dfwn)
+    R2 = ssbn / (ssbn + sswn)
+    resstd = np.sqrt(msw)
+    res = [f, prob, R2, resstd, ssbn, sswn]
+    if is1d:
+        res = [r[0] for r in res]
+    return tuple(res) + (dfbn, dfwn)
+
+
+def _crosstab(ci, ki, cj, kj):
+    '''counts of the combinations of two factors, (ki, kj) array'''
+    return np.bincount(ci * kj + cj, minlength=ki * kj).reshape(ki, kj)
+
+
+def _rank(xtx, tol=1e-10):
+    '''rank of a symmetric positive semidefinite matrix'''
+    if xtx.shape[0] == 0:
+        return 0
+    ev = np.linalg.eigvalsh(xtx)
+    return int(np.sum(ev > tol * ev.max()))
+
+
+def anova_nway(factors, x, terms=None):
+    '''sequential (type I) analysis of variance for several factors
+
+    Parameters
+    ----------
+    factors : array_like, 2d (nobs, K)
+        labels of K factors in columns
+    x : array_like, 1d or 2d
+        responses, each column is analysed separately
+    terms : None or list of tuples of int
+        terms of the model in the order in which they are added, a term
+        is a tuple of factor columns, (0,) is a main effect and (0, 1)
+        the interaction of the first two factors. The default is all
+        main effects, then all two-way interactions and so on up to the
+        K-way interaction.
+
+    Returns
+    -------
+    terms : list of tuples
+        the model terms, the residual is the last row in the other results
+    df : ndarray (nterms+1,)
+        degrees of freedom, the increase in the rank of the design
+    ss : ndarray (nterms+1,) or (nterms+1, nvars)
+        sequential sums of squares of the terms, residual sum of squares
+    f : ndarray
+        F statistics of the terms, nan for the residual
+    prob : ndarray
+        p-values of the F tests, nan for the residual
+
+    Notes
+    -----
+    The design matrix X with the indicator columns of all terms is not
+    created. Each term is factorized with GroupBy, X'X consists of the
+    group counts and of the cross tabulations of pairs of terms, and X'x
+    of the group sums. The explained sum of squares of the model with the
+    first j terms is b'X'x with b from the pseudo-inverse of the leading
+    block of X'X, so the unbalanced case is handled as in a regression
+    with dummy variables, each term adjusted for the previous terms. In
+    balanced designs the sequential sums of squares do not depend on the
+    order of the terms.
+
+    The size of the linear system is the total number of groups of all
+    terms, which is small compared to the number of observations.
+
+    If the last term includes all factors, then the residual sum of
+    squares is the within sum of squares of the cells and is calculated
+    from the deviations from the cell means.
+    '''
+    factors = np.asarray(factors)
+    if factors.ndim == 1:
+        factors = factors[:,np.newaxis]
+    nobs, K = factors.shape
+    if terms is None:
+        import itertools
+        terms = [t for k in range(1, K + 1)
+                 for t in itertools.combinations(range(K), k)]
+    terms = [tuple(np.atleast_1d(t)) for t in terms]
+    xs, is1d = _shifted(x)
+    xc = xs - xs.mean(0)
+    # factorize each term, interactions are combinations of labels
+    groups = [GroupBy(factors[:,list(t)]) for t in terms]
+    codes = [g.codes for g in groups]
+    sizes = [g.ngroups for g in groups]
+    # X'X and X'x, the first row and column is the constant
+    offsets = np.cumsum([0, 1] + sizes)
+    xtx = np.empty((offsets[-1], offsets[-1]))
+    xtx[0,0] = nobs
+    xty = np.empty((offsets[-1], xs.shape[1]))
+    xty[0] = xc.sum(0)
+    for i, gi in enumerate(groups):
+        si = slice(offsets[i+1], offsets[i+2])
+        xtx[0,si] = xtx[si,0] = gi.count()
+        xty[si] = gi.sum(xc)
+        for j in range(i + 1):
+            sj = slice(offsets[j+1], offsets[j+2])
+            ct = _crosstab(codes[i], sizes[i], codes[j], sizes[j])
+            xtx[si,sj] = ct
+            xtx[sj,si] = ct.T
+    # sequential explained sums of squares and ranks
+    ssmodel = [(xty[0]**2) / nobs]
+    ranks = [1]
+    for i in range(len(terms)):
+        end = offsets[i+2]
+        b = np.dot(np.linalg.pinv(xtx[:end,:end]), xty[:end])
+        ssmodel.append((b * xty[:end]).sum(0))
+        ranks.append(_rank(xtx[:end,:end]))
+    ssmodel = np.array(ssmodel)
+    ss = np.diff(ssmodel, axis=0)
+    df = np.diff(ranks)
+    sstot = (xc * xc).sum(0)
+    if set(terms[-1]) == set(range(K)):
+        ssres = groups[-1].var(xs).T.dot(groups[-1].count())
+    else:
+        ssres = sstot - ssmodel[-1]
+    dfres = nobs - ranks[-1]
+    ms = ss / np.maximum(df, 1)[:,np.newaxis]
+    msres = ssres / float(dfres)
+    f = ms / msres
+    f[df == 0] = np.nan
+    prob = stats.f.sf(f, df[:,np.newaxis], dfres)
+    nan = np.nan * np.ones((1, xs.shape[1]))
+    ss = np.vstack((ss, ssres))
+    f = np.vstack((f, nan))
+    prob = np.vstack((prob, nan))
+    df = np.r_[df, dfres]
+    if is1d:
+        ss, f, prob = ss[:,0], f[:,0], prob[:,0]
+    return terms, df, ss, f, prob
+
+
+def check_anova():
+    '''compare with stats.f_oneway and with least squares on dummies'''
+    from numpy.testing import assert_array_almost_equal, assert_equal
+    nobs = 300
+    factors = np.column_stack((np.random.randint(3, size=nobs),
+                               np.random.randint(4, size=nobs)))
+    x = np.random.randn(nobs, 2) + factors[:,:1]
+    f, prob, R2, resstd = anova_oneway(factors[:,0], x)[:4]
+    for i in range(2):
+        fs, ps = stats.f_oneway(*[x[factors[:,0]==k, i] for k in range(3)])
+        assert_array_almost_equal([f[i], prob[i]], [fs, ps], 10)
+    # one-way table of anova_nway is the same
+    terms, df, ss, fn, pn = anova_nway(factors[:,:1], x)
+    assert_array_almost_equal(fn[0], f, 10)
+    # sequential sums of squares with dummy variables, unbalanced
+    terms, df, ss, fn, pn = anova_nway(factors, x[:,0])
+    assert_equal(terms, [(0,), (1,), (0, 1)])
+    assert_equal(df, [2, 3, 6, nobs - 12])
+    dummies = [np.ones((nobs, 1))]
+    ssr_prev = ((x[:,0] - x[:,0].mean())**2).sum()
+    for t, sst in zip(terms, ss):
+        cells = factors[:,list(t)].dot([10, 1][:len(t)])
+        dummies.append((cells[:,np.newaxis] == np.unique1d(cells)).astype(float))
+        exog = np.column_stack(dummies)
+        resid = x[:,0] - np.dot(exog, np.dot(np.linalg.pinv(exog), x[:,0]))
+        ssr = (resid**2).sum()
+        assert_array_almost_equal(sst, ssr_prev - ssr, 10)
+        ssr_prev = ssr
+    assert_array_almost_equal(ss[-1], ssr_prev, 10)
+    assert_array_almost_equal(ss.sum(), ((x[:,0] - x[:,0].mean())**2).sum(), 10)
+
+
+if __name__ == '__main__':
+    check_anova()
+
+    # NIST StRD anova test data, log relative error for the certified values
+    filenameli = ['SiRstv.dat', 'SmLs01.dat', 'SmLs02.dat', 'SmLs03.dat',
+                  'AtmWtAg.dat', 'SmLs04.dat', 'SmLs05.dat', 'SmLs06.dat',
+                  'SmLs07.dat', 'SmLs08.dat', 'SmLs09.dat']
+    print 'file          ssbn   sswn   f      R2     resstd'
+    for fn in filenameli:
+        content = open(fn, 'r').read().split('\n')
+        certified = [line.split() for line in content[40:48] if line]
+        cert = np.array([float(certified[0][-3]), float(certified[1][-2]),
+                         float(certified[0][-1]), float(certified[2][-1]),
+                         float(certified[4][-1])])
+        dataf = np.loadtxt(fn, skiprows=60)
+        f, prob, R2, resstd, ssbn, sswn, dfbn, dfwn = \
+           anova_oneway(dataf[:,0].astype(int), dataf[:,1])
+        res = np.array([ssbn, sswn, f, R2, resstd])
+        lre = -np.log10(np.abs(res - cert) / np.abs(cert) + 1e-16)
+        print '%-12s' % fn, ' '.join(['%6.1f' % v for v in lre])
@@ -1,9 +1,44 @@
 ''' toy implementation of GARCH
 
+The GARCH(1,1) variance recursion
+
+    v[i] = omega + alpha*u[i-1]**2 + beta*v[i-1]
+
+is a first order linear filter of the squared lagged residuals and is
+computed with signal.lfilter instead of a loop over observations. The
+EGARCH variant below is linear in log(v), so the same filter applies to
+the log variance. The derivatives of the variance with respect to the
+parameters follow the same recursion and are filtered in one call, which
+gives the analytic gradient of the negative loglikelihood for fmin_bfgs.
+
 '''
 
+import time
 import numpy as np
-from scipy import optimize
+from scipy import optimize, signal
+
+def _lagged(u, first):
+    '''shift u by one period and set the first element'''
+    x = np.empty(len(u))
+    x[0] = first
+    x[1:] = u[:-1]
+    return x
+
+def _garch_filter(omega, alpha, beta, u, v0=1.0):
+    '''v[i] = omega + alpha*u[i-1]**2 + beta*v[i-1] with v[0] = v0'''
+    x = omega + alpha*_lagged(u**2, 0)
+    x[0] = v0
+    return signal.lfilter([1.], [1., -beta], x)
+
+def _garch_filter_deriv(beta, u, v):
+    '''derivative of the garch recursion with respect to omega, alpha, beta
+
+    returns array (n, 3), the first row is zero since v[0] is fixed
+    '''
+    dx = np.column_stack((_lagged(np.ones(len(u)), 0),
+                          _lagged(u**2, 0),
+                          _lagged(v, 0)))
+    return signal.lfilter([1.], [1., -beta], dx, axis=0)
 
 def garch_nlogl(param, u):
     '''loglikelihood for garch(1,1)
@@ -11,47 +46,303 @@ def garch_nlogl(param, u):
     '''
     omega, alpha, beta = param**2
     n = len(u)
-    v = np.ones(n)
-    for i in range(1,n):
-        #v[i] = omega + alpha*u[i-1] + beta*np.abs(v[i-1])
-        v[i] = omega + alpha*u[i-1]**2 + beta*v[i-1]
+    v = _garch_filter(omega, alpha, beta, u)
     nloglike = 0.5*((np.log(v) +  u**2 / (v)).sum() + n/np.log(2*np.pi))
     return nloglike
 
+def garch_nlogl_grad(param, u):
+    '''analytic gradient of garch_nlogl with respect to param'''
+    param = np.asarray(param)
+    omega, alpha, beta = param**2
+    v = _garch_filter(omega, alpha, beta, u)
+    dv = _garch_filter_deriv(beta, u, v)
+    dnlogl_dv = 0.5*(1. - u**2 / v) / v
+    return np.dot(dnlogl_dv, dv) * 2*param
+
 def egarch_nlogl(param, u):
+    '''negative loglikelihood for the egarch variant
+
+    log(v[i]) = omega + alpha*u[i-1]**2 + beta*log(v[i-1]), v[0] = 1
+    '''
     omega, alpha, beta = param
-    v = np.ones(len(u))
-    for i in range(1,len(u)):
-        #v[i] = omega + alpha*u[i-1] + beta*np.abs(v[i-1])
-        v[i] = np.exp(omega + alpha*u[i-1]**2 + beta*np.log(v[i-1]))
+    logv = _garch_filter(omega, alpha, beta, u, v0=0.0)
+    v = np.exp(logv)
     #nloglike = -(-np.log(v) -  u**2 / (1e-10 +np.abs(v))).sum()
-    nloglike = -(-np.log(np.sqrt(v)) -  u**2 / 2.0 / (1e-6+v)).sum()
+    nloglike = (0.5*logv + u**2 / 2.0 / (1e-6+v)).sum()
     return nloglike
 
+def egarch_nlogl_grad(param, u):
+    '''analytic gradient of egarch_nlogl with respect to param'''
+    omega, alpha, beta = param
+    logv = _garch_filter(omega, alpha, beta, u, v0=0.0)
+    v = np.exp(logv)
+    dlogv = _garch_filter_deriv(beta, u, logv)
+    dnlogl_dlogv = 0.5 - u**2 / 2.0 * v / (1e-6+v)**2
+    return np.dot(dnlogl_dlogv, dlogv)
+
 def mygarch_nlogl(param, u):
     '''loglikelihood for garch(1,1)
     reparameterized to force positive variance
     '''
     omega, alpha, beta = param
     n=len(u)
+    if omega >= 0 and alpha >= 0 and beta >= 0:
+        # the argument of abs is always positive, recursion is linear in v**2
+        v = np.sqrt(_garch_filter(omega, alpha, beta, u))
+    else:
+        v = np.ones(len(u))
+        for i in range(1,len(u)):
+            v[i] = np.sqrt(np.abs(omega + alpha*u[i-1]**2 + beta*v[i-1]**2))
+    nloglike = -0.5*(-np.log(np.sqrt(2*np.pi)*v) -  u**2 / 2.0 / (v**2)).sum()
+    return nloglike
+
+def _garch_nlogl_loop(param, u):
+    '''garch_nlogl with a loop over observations, for checking'''
+    omega, alpha, beta = param**2
+    n = len(u)
+    v = np.ones(n)
+    for i in range(1,n):
+        v[i] = omega + alpha*u[i-1]**2 + beta*v[i-1]
+    nloglike = 0.5*((np.log(v) +  u**2 / (v)).sum() + n/np.log(2*np.pi))
+    return nloglike
+
+def _egarch_nlogl_loop(param, u):
+    '''egarch_nlogl with a loop over observations, for checking'''
+    omega, alpha, beta = param
+    v = np.ones(len(u))
+    for i in range(1,len(u)):
+        v[i] = np.exp(omega + alpha*u[i-1]**2 + beta*np.log(v[i-1]))
+    nloglike = -(-np.log(np.sqrt(v)) -  u**2 / 2.0 / (1e-6+v)).sum()
+    return nloglike
+
+def _mygarch_nlogl_loop(param, u):
+    '''mygarch_nlogl with a loop over observations, for checking'''
+    omega, alpha, beta = param
     v = np.ones(len(u))
     for i in range(1,len(u)):
-        #v[i] = omega + alpha*u[i-1] + beta*np.abs(v[i-1])
         v[i] = np.sqrt(np.abs(omega + alpha*u[i-1]**2 + beta*v[i-1]**2))
     nloglike = -0.5*(-np.log(np.sqrt(2*np.pi)*v) -  u**2 / 2.0 / (v**2)).sum()
     return nloglike
 
-u = np.random.randn(500)
-u[1:] = u[1:]*np.abs(u[:-1])
+def check_garch():
+    '''compare filtered loglikelihoods with the loops and the gradients
+    with numerical derivatives'''
+    u = np.random.randn(300)
+    u[1:] = u[1:]*np.abs(u[:-1])
+    for param in [np.array([0.5, 0.3, 0.8]), np.array([1.0, -0.4, 0.2])]:
+        assert np.allclose(garch_nlogl(param, u), _garch_nlogl_loop(param, u),
+                           rtol=1e-12)
+        assert np.allclose(garch_nlogl_grad(param, u),
+                           optimize.approx_fprime(param, garch_nlogl, 1e-7, u),
+                           rtol=1e-4, atol=1e-3)
+    for param in [np.array([0.1, 0.05, 0.8]), np.array([-0.2, 0.1, -0.5])]:
+        assert np.allclose(egarch_nlogl(param, u), _egarch_nlogl_loop(param, u),
+                           rtol=1e-12)
+        assert np.allclose(egarch_nlogl_grad(param, u),
+                           optimize.approx_fprime(param, egarch_nlogl, 1e-7, u),
+                           rtol=1e-4, atol=1e-3)
+    for param in [np.array([0.5, 0.3, 0.6]), np.array([0.5, -0.3, 0.6])]:
+        assert np.allclose(mygarch_nlogl(param, u), _mygarch_nlogl_loop(param, u),
+                           rtol=1e-12)
+
+def _garch_start(u, model):
+    '''default starting values (omega, alpha, beta) for each column of u'''
+    var = u.var(0)
+    start = np.empty((u.shape[1], 3))
+    if model == 'garch':
+        start[:,0] = 0.1*var
+        start[:,1] = 0.1
+    else:
+        start[:,0] = 0.2*np.log(var)
+        start[:,1] = 0.
+    start[:,2] = 0.8
+    return start
+
+_EGARCH_BOUNDS = [(None, None), (None, None), (-0.9999, 0.9999)]
+
+def _garch_columns(args):
+    '''fit garch or egarch to each column of u, used by garch_fit_batch'''
+    u, model, start, maxiter = args
+    nseries = u.shape[1]
+    params = np.empty((nseries, 3))
+    nlogl = np.empty(nseries)
+    forecast = np.empty(nseries)
+    warnflag = np.empty(nseries, int)
+    for i in range(nseries):
+        ui = u[:,i]
+        if model == 'garch':
+            # garch_nlogl is parameterized in square roots and the gradient
+            # is zero at zero, so start away from it
+            p0 = np.sqrt(np.maximum(start[i], 1e-4))
+            res = optimize.fmin_bfgs(garch_nlogl, p0, fprime=garch_nlogl_grad,
+                                     args=(ui,), maxiter=maxiter,
+                                     full_output=1, disp=0)
+            params[i] = omega, alpha, beta = res[0]**2
+            forecast[i] = _garch_filter(omega, alpha, beta, np.r_[ui, 0])[-1]
+        else:
+            # egarch_nlogl is unbounded below for abs(beta) > 1, the
+            # variance can go to zero
+            res = optimize.fmin_l_bfgs_b(egarch_nlogl, start[i],
+                                         fprime=egarch_nlogl_grad, args=(ui,),
+                                         bounds=_EGARCH_BOUNDS,
+                                         maxiter=maxiter or 15000)
+            res = res[:2] + (res[2]['warnflag'],)
+            params[i] = omega, alpha, beta = res[0]
+            forecast[i] = np.exp(_garch_filter(omega, alpha, beta,
+                                               np.r_[ui, 0], v0=0.0)[-1])
+        nlogl[i] = res[1]
+        warnflag[i] = res[-1]
+    return params, nlogl, forecast, warnflag
+
+def garch_fit_batch(u, model='garch', start_params=None, nprocs=None,
+                    maxiter=None):
+    '''fit garch(1,1) or egarch to each column of a returns matrix
+
+    Parameters
+    ----------
+    u : array_like, 2d (T, N)
+        returns or residuals, one series in each column
+    model : 'garch' or 'egarch'
+        'garch' minimizes garch_nlogl, 'egarch' minimizes egarch_nlogl
+    start_params : None or array_like (N, 3)
+        starting values (omega, alpha, beta) for each series, for example
+        the estimates of the previous day. If None, the starting values
+        are based on the sample variance of each series.
+    nprocs : None or int
+        If larger than one, the series are split into chunks that are
+        estimated by a multiprocessing.Pool with nprocs processes.
+    maxiter : None or int
+        maximum number of iterations of the optimizer for each series
 
+    Returns
+    -------
+    params : ndarray (N, 3)
+        estimates of omega, alpha, beta. For 'garch' these are the
+        variance parameters, i.e. the squares of the garch_nlogl parameters
+    nlogl : ndarray (N,)
+        negative loglikelihood at the estimates
+    forecast : ndarray (N,)
+        one-step-ahead forecast of the conditional variance for period T
+    warnflag : ndarray (N,)
+        warnflag of the optimizer, 0 if the optimization converged
+
+    Notes
+    -----
+    Each series is estimated with the analytic gradient and the variance
+    recursion computed by lfilter, see garch_nlogl. garch uses fmin_bfgs,
+    egarch uses fmin_l_bfgs_b with abs(beta) < 1.
+    '''
+    if model not in ('garch', 'egarch'):
+        raise ValueError, "model should be 'garch' or 'egarch'"
+    u = np.asarray(u, float)
+    if u.ndim == 1:
+        u = u[:,np.newaxis]
+    nseries = u.shape[1]
+    if start_params is None:
+        start = _garch_start(u, model)
+    else:
+        start = np.asarray(start_params, float).reshape(nseries, 3)
+    if nprocs is None or nprocs < 2 or nseries < 2:
+        return _garch_columns((u, model, start, maxiter))
+    import multiprocessing
+    chunks = [idx for idx in np.array_split(np.arange(nseries), 4*nprocs)
+              if idx.size > 0]
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        res = pool.map(_garch_columns,
+                       [(u[:,idx], model, start[idx], maxiter) for idx in chunks])
+    finally:
+        pool.close()
+        pool.join()
+    return tuple([np.concatenate(r) for r in zip(*res)])
+
+class GarchBatch(object):
+    '''repeated garch fits of many series with warm starts
+
+    Each call to fit uses the estimates of the previous call as starting
+    values, so that a daily refit with one more observation needs only a
+    few iterations.
+
+    Parameters
+    ----------
+    model : 'garch' or 'egarch'
+    nprocs : None or int
+        number of processes, see garch_fit_batch
+
+    Attributes
+    ----------
+    params, nlogl, forecast, warnflag :
+        results of the last fit, see garch_fit_batch
+    '''
+    def __init__(self, model='garch', nprocs=None):
+        self.model = model
+        self.nprocs = nprocs
+        self.params = None
+
+    def fit(self, u, maxiter=None):
+        '''fit each column of u, returns params, nlogl and forecast'''
+        u = np.asarray(u, float)
+        start = self.params
+        if start is not None and start.shape[0] != np.size(u) // len(u):
+            # different set of series, start from scratch
+            start = None
+        self.params, self.nlogl, self.forecast, self.warnflag = \
+            garch_fit_batch(u, self.model, start_params=start,
+                            nprocs=self.nprocs, maxiter=maxiter)
+        return self.params, self.nlogl, self.forecast
+
+
+if __name__ == '__main__':
+    u = np.random.randn(500)
+    u[1:] = u[1:]*np.abs(u[:-1])
+
+
+    result = optimize.fmin(garch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
+    #result2 = optimize.fmin_bfgs(garch_nlogl, [1.0, 0.0, 0.0], args=(u,), maxiter=2)
+    #result2 = optimize.fmin_powell(garch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
+    result2 = optimize.fmin_powell(garch_nlogl, result[0], args=(u,), full_output=1)
+    result2a = optimize.fmin_powell(mygarch_nlogl, result[0], args=(u,), full_output=1)
+    #result3 = optimize.fmin_powell(egarch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
+    print result
+    print result2
+    print result2a
+    #print result3
+
+    check_garch()
+
+    # large sample with analytic gradient
+    # garch(1,1) with omega=0.1, alpha=0.1, beta=0.8
+    n = 100000
+    eta = np.random.randn(n)
+    ul = np.zeros(n)
+    vl = np.ones(n)
+    for i in range(1,n):
+        vl[i] = 0.1 + 0.1*ul[i-1]**2 + 0.8*vl[i-1]
+        ul[i] = np.sqrt(vl[i])*eta[i]
+    t0 = time.time()
+    result4 = optimize.fmin_bfgs(garch_nlogl, np.sqrt([0.2, 0.05, 0.5]),
+                                 fprime=garch_nlogl_grad, args=(ul,),
+                                 full_output=1, disp=0)
+    print 'garch n=%d' % n, result4[0]**2, 'seconds', time.time() - t0
+    t0 = time.time()
+    result5 = optimize.fmin_bfgs(egarch_nlogl, np.array([0.0, 0.0, 0.5]),
+                                 fprime=egarch_nlogl_grad, args=(ul,),
+                                 full_output=1, disp=0)
+    print 'egarch n=%d' % n, result5[0], 'seconds', time.time() - t0
 
-result = optimize.fmin(garch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
-#result2 = optimize.fmin_bfgs(garch_nlogl, [1.0, 0.0, 0.0], args=(u,), maxiter=2)
-#result2 = optimize.fmin_powell(garch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
-result2 = optimize.fmin_powell(garch_nlogl, result[0], args=(u,), full_output=1)
-result2a = optimize.fmin_powell(mygarch_nlogl, result[0], args=(u,), full_output=1)
-#result3 = optimize.fmin_powell(egarch_nlogl, np.array([1.0, 0.0, 0.0]), args=(u,), full_output=1)
-print result
-print result2
-print result2a
-#print result3
+    # many series, refit on the next day with warm starts
+    nobs, nseries = 2001, 50
+    eta = np.random.randn(nobs, nseries)
+    ub = np.zeros((nobs, nseries))
+    vb = np.ones(nseries)
+    for i in range(1,nobs):
+        vb = 0.1 + 0.1*ub[i-1]**2 + 0.8*vb
+        ub[i] = np.sqrt(vb)*eta[i]
+    gb = GarchBatch()
+    t0 = time.time()
+    gb.fit(ub[:-1])
+    print 'garch batch', gb.params.mean(0), 'seconds', time.time() - t0
+    t0 = time.time()
+    gb.fit(ub)
+    print 'warm start', gb.params.mean(0), 'seconds', time.time() - t0
+    print 'forecast', gb.forecast[:5]
@@ -0,0 +1,849 @@
+'''group statistics for many value columns with one factorization
+
+The group labels are converted once to integer codes 0,...,ngroups-1.
+All statistics are then computed from the codes without sorting the
+keys again, for 2d values in one call for all columns.
+
+* integer keys, also as floats, with a range that is not much larger than
+  the number of observations are factorized by direct addressing, without
+  sorting
+* other keys, floats, strings, large integers, use np.unique1d
+* sums use a sparse (ngroups, nobs) indicator matrix, one product for all
+  columns, so no dense dummy matrix is needed
+* min, max and quantiles use the stable sort order of the codes, which is
+  computed once and cached
+* sum, mean and var with precise=True shift the values in each group by
+  the first value and use compensated pairwise summation, for data with a
+  large mean relative to the variation
+
+GroupAccumulator holds mergeable statistics for data that does not fit in
+memory, see groupstats_chunked and groupstats_npy.
+
+Example
+-------
+>>> g = GroupBy(np.array([3, 1, 3, 2, 1]))
+>>> g.uniques
+array([1, 2, 3])
+>>> g.mean(np.arange(10.).reshape(5,2))
+array([[ 5.,  6.],
+       [ 6.,  7.],
+       [ 2.,  3.]])
+
+'''
+
+import numpy as np
+from scipy import sparse
+
+
+def factorize(keys):
+    '''convert labels to integer codes
+
+    Parameters
+    ----------
+    keys : array_like, 1d
+        group labels, integers, floats or strings
+
+    Returns
+    -------
+    uniques : ndarray
+        sorted unique labels
+    codes : ndarray, int
+        index into uniques for each observation, uniques[codes] == keys
+
+    Notes
+    -----
+    Integer keys, or floats with integer values, with a range of at most
+    max(2*nobs, 1024) are mapped by direct addressing in linear time.
+    Other keys are sorted once by np.unique1d.
+    '''
+    keys = np.asarray(keys)
+    if keys.ndim != 1:
+        raise ValueError, 'keys need to be 1d'
+    if keys.dtype.kind == 'b':
+        keys = keys.astype(int)
+    if keys.dtype.kind in 'iuf' and keys.size > 0:
+        kmin, kmax = keys.min(), keys.max()
+        if keys.dtype.kind == 'f':
+            # floats with integer values, e.g. categories in a float array
+            integral = (np.isfinite(kmin) and np.isfinite(kmax) and
+                        kmax - kmin < 2**52 and np.all(keys == np.floor(keys)))
+        else:
+            integral = True
+        if integral and int(kmax) - int(kmin) < max(2 * keys.size, 1024):
+            offset = (keys - kmin).astype(np.intp)
+            present = np.zeros(int(kmax) - int(kmin) + 1, bool)
+            present[offset] = True
+            lookup = np.cumsum(present) - 1
+            uniques = (np.nonzero(present)[0] + kmin).astype(keys.dtype)
+            return uniques, lookup[offset]
+    uniques, codes = np.unique1d(keys, return_inverse=True)
+    return uniques, codes
+
+
+def factorize_rows(keys):
+    '''convert rows of labels, several key columns, to integer codes
+
+    Parameters
+    ----------
+    keys : array_like, 2d (nobs, K) or sequence of K 1d arrays
+        labels, each column is factorized separately
+
+    Returns
+    -------
+    levels : list of K ndarrays
+        sorted unique labels of each column
+    codes : ndarray, int
+        group index of each observation, the groups are the observed
+        combinations of labels in lexicographic order
+    groupcodes : ndarray (ngroups, K)
+        index into levels for each group and column
+
+    Notes
+    -----
+    The column codes are combined into one int64 key in mixed radix, the
+    first column most significant, so that the order of the keys is the
+    lexicographic order of the label combinations. If the product of the
+    number of levels would overflow, the partially combined key is
+    factorized again, which reduces its radix to the number of observed
+    combinations.
+    '''
+    if isinstance(keys, np.ndarray) and keys.ndim == 2:
+        columns = keys.T
+    elif isinstance(keys, np.ndarray) and keys.ndim == 1:
+        columns = [keys]
+    else:
+        columns = keys
+    levels = []
+    colcodes = []
+    for col in columns:
+        un, co = factorize(col)
+        levels.append(un)
+        colcodes.append(co)
+    combined = np.zeros(len(colcodes[0]), np.int64)
+    radix = 1
+    for un, co in zip(levels, colcodes):
+        if radix * len(un) >= 2**62:
+            ncomb, combined = factorize(combined)
+            radix = len(ncomb)
+        combined = combined * len(un) + co
+        radix *= len(un)
+    uniques, codes = factorize(combined)
+    # one observation for each group to look up the column codes
+    rep = np.empty(len(uniques), np.intp)
+    rep[codes] = np.arange(len(codes))
+    groupcodes = np.column_stack([co[rep] for co in colcodes])
+    return levels, codes, groupcodes
+
+
+def _as2d(x):
+    '''return 2d float array with observations in rows and a flag for 1d'''
+    x = np.asarray(x, float)
+    if x.ndim == 1:
+        return x[:,np.newaxis], True
+    return x, False
+
+
+def _squeeze(res, is1d):
+    if is1d:
+        return res[:,0]
+    return res
+
+
+def _pairwise_sum(xg, counts):
+    '''compensated pairwise sums of consecutive segments of rows
+
+    Parameters
+    ----------
+    xg : ndarray (nobs, nvars)
+        values ordered by group
+    counts : ndarray (ngroups,)
+        positive number of rows in each segment
+
+    Returns
+    -------
+    sums : ndarray (ngroups, nvars)
+
+    Notes
+    -----
+    In each step neighboring rows of the same segment are added, for all
+    segments at once, until one row per segment is left, which takes
+    log2(max(counts)) steps. Segments with an odd number of rows get an
+    additional zero row, so that the pairs are the even and odd rows. The
+    rounding error of each addition is recovered with the error free
+    transformation TwoSum of Knuth and accumulated separately, as in the
+    Kahan and Neumaier algorithms.
+    '''
+    sums = xg
+    comp = None
+    counts = np.asarray(counts)
+    while counts.max() > 1:
+        odd = np.nonzero(counts % 2)[0]
+        if len(odd) > 0:
+            ends = np.cumsum(counts)[odd]
+            sums = np.insert(sums, ends, 0, axis=0)
+            if comp is not None:
+                comp = np.insert(comp, ends, 0, axis=0)
+            counts = counts + counts % 2
+        a = sums[0::2]
+        b = sums[1::2]
+        s = a + b
+        bv = s - a
+        err = (a - (s - bv)) + (b - bv)
+        if comp is None:
+            comp = err
+        else:
+            comp = comp[0::2] + comp[1::2] + err
+        sums = s
+        counts = counts // 2
+    if comp is None:
+        return sums
+    return sums + comp
+
+
+class GroupBy(object):
+    '''statistics of values by groups with a cached factorization
+
+    Parameters
+    ----------
+    keys : array_like, 1d or 2d
+        group labels, see factorize. If keys is 2d, then the groups are
+        the combinations of the labels in each row, see factorize_rows
+
+    Attributes
+    ----------
+    uniques : ndarray
+        sorted unique labels, the groups in all results are in this order.
+        For 2d keys, array of unique rows in lexicographic order
+    codes : ndarray
+        group index of each observation
+    levels : list of ndarrays
+        unique labels of each key column, for 2d keys only
+    groupcodes : ndarray (ngroups, K)
+        index into levels for each group, for 2d keys only
+    ngroups, nobs : int
+    counts : ndarray (ngroups,)
+        number of observations in each group
+
+    Notes
+    -----
+    The values arguments of the methods are arrays with nobs rows, either
+    1d or 2d with variables in columns. The results have shape (ngroups,)
+    or (ngroups, nvars). All groups are non-empty.
+
+    The factorization, the sparse indicator matrix and the sort order of
+    the codes are computed only once, so the same instance should be used
+    for all value columns with the same groups.
+    '''
+    # maximum number of groups that are sorted one at a time in quantile
+    _maxloopgroups = 10000
+
+    def __init__(self, keys):
+        keys = np.asarray(keys)
+        if keys.ndim == 2:
+            self.levels, self.codes, self.groupcodes = factorize_rows(keys)
+            self.uniques = np.column_stack([lev[gc] for lev, gc in
+                                     zip(self.levels, self.groupcodes.T)])
+        else:
+            self.uniques, self.codes = factorize(keys)
+        self.ngroups = len(self.uniques)
+        self.nobs = len(self.codes)
+        self.counts = np.bincount(self.codes, minlength=self.ngroups)
+        self._indicator = None
+        self._order = None
+        self._starts = None
+
+    def _getindicator(self):
+        if self._indicator is None:
+            self._indicator = sparse.csr_matrix(
+                (np.ones(self.nobs), (self.codes, np.arange(self.nobs))),
+                shape=(self.ngroups, self.nobs))
+        return self._indicator
+
+    def _getorder(self):
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind='mergesort')
+            self._starts = np.r_[0, np.cumsum(self.counts)[:-1]]
+        return self._order, self._starts
+
+    def _grouped(self, x):
+        '''values sorted by group, transposed to (nvars, nobs)'''
+        order, starts = self._getorder()
+        return np.ascontiguousarray(x[order].T), starts
+
+    def expand(self, stat):
+        '''group statistic for each observation, stat[codes]'''
+        return np.asarray(stat)[self.codes]
+
+    def count(self):
+        '''number of observations in each group'''
+        return self.counts
+
+    def _shifted(self, x):
+        '''values ordered by group and shifted by the first value in each
+        group, and the shifts'''
+        order, starts = self._getorder()
+        xg = x[order]
+        shift = xg[starts]
+        xg -= np.repeat(shift, self.counts, axis=0)
+        return xg, shift
+
+    def sum(self, x, precise=False):
+        '''sum of values in each group
+
+        If precise is true, then the values are shifted by the first value
+        of each group and summed by compensated pairwise summation, see
+        _pairwise_sum. Otherwise the sums are a sparse matrix product.
+        '''
+        x, is1d = _as2d(x)
+        if precise:
+            xg, shift = self._shifted(x)
+            res = _pairwise_sum(xg, self.counts) + \
+                  shift * self.counts[:,np.newaxis]
+        else:
+            res = self._getindicator().dot(x)
+        return _squeeze(res, is1d)
+
+    def mean(self, x, precise=False):
+        '''mean of values in each group, see sum for precise'''
+        x, is1d = _as2d(x)
+        if precise:
+            xg, shift = self._shifted(x)
+            res = shift + _pairwise_sum(xg, self.counts) / \
+                          self.counts[:,np.newaxis]
+        else:
+            res = self._getindicator().dot(x) / self.counts[:,np.newaxis]
+        return _squeeze(res, is1d)
+
+    def var(self, x, ddof=0, precise=False):
+        '''variance of values in each group
+
+        The squared deviations are taken from the group means, this is
+        the two pass algorithm. If precise is true, then the sums use the
+        shifted values and compensated pairwise summation, and the sum of
+        squares is corrected by the sum of the deviations, the corrected
+        two pass algorithm.
+        '''
+        x, is1d = _as2d(x)
+        counts = self.counts[:,np.newaxis]
+        if precise:
+            xg, shift = self._shifted(x)
+            meang = _pairwise_sum(xg, self.counts) / counts
+            xg -= np.repeat(meang, self.counts, axis=0)
+            ssdev = _pairwise_sum(xg * xg, self.counts)
+            sdev = _pairwise_sum(xg, self.counts)
+            res = (ssdev - sdev * sdev / counts) / (counts - ddof)
+        else:
+            dev = x - self.mean(x)[self.codes]
+            res = self._getindicator().dot(dev * dev)
+            res /= (counts - ddof)
+        return _squeeze(res, is1d)
+
+    def std(self, x, ddof=0, precise=False):
+        '''standard deviation of values in each group'''
+        return np.sqrt(self.var(x, ddof=ddof, precise=precise))
+
+    def min(self, x):
+        '''minimum of values in each group'''
+        x, is1d = _as2d(x)
+        xg, starts = self._grouped(x)
+        res = np.minimum.reduceat(xg, starts, axis=1).T
+        return _squeeze(res, is1d)
+
+    def max(self, x):
+        '''maximum of values in each group'''
+        x, is1d = _as2d(x)
+        xg, starts = self._grouped(x)
+        res = np.maximum.reduceat(xg, starts, axis=1).T
+        return _squeeze(res, is1d)
+
+    def quantile(self, x, q):
+        '''quantiles of values in each group
+
+        Parameters
+        ----------
+        x : array_like, 1d or 2d
+            values, no nans
+        q : float or array_like
+            probabilities in [0, 1], linear interpolation between the
+            order statistics as in stats.scoreatpercentile
+
+        Returns
+        -------
+        res : ndarray
+            shape (ngroups,) or (ngroups, nvars) for scalar q, otherwise
+            with an additional first axis for q
+        '''
+        x, is1d = _as2d(x)
+        qarr = np.atleast_1d(np.asarray(q, float))
+        if np.any((qarr < 0) | (qarr > 1)):
+            raise ValueError, 'q needs to be in [0, 1]'
+        xg, starts = self._grouped(x)
+        if self.ngroups <= self._maxloopgroups:
+            ends = starts + self.counts
+            for start, end in zip(starts, ends):
+                xg[:,start:end].sort(axis=1)
+        else:
+            # one sort for all groups, complex numbers sort by the real
+            # part, the group code, and then by the imaginary part
+            codes = self.codes[self._order]
+            xg = np.sort(codes + 1j * xg, axis=1).imag
+        pos = starts + qarr[:,np.newaxis] * (self.counts - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, starts + self.counts - 1)
+        frac = pos - lo
+        res = xg[:,lo] + frac * (xg[:,hi] - xg[:,lo])
+        # (nvars, nq, ngroups) -> (nq, ngroups, nvars)
+        res = np.rollaxis(res, 0, 3)
+        if is1d:
+            res = res[...,0]
+        if np.ndim(q) == 0:
+            res = res[0]
+        return res
+
+    def median(self, x):
+        '''median of values in each group'''
+        return self.quantile(x, 0.5)
+
+
+class GroupAccumulator(object):
+    '''mergeable group statistics for data that is processed in chunks
+
+    The accumulator stores for each group the count, mean, sum of squared
+    deviations from the mean (M2), min and max, and optionally a quantile
+    sketch. Chunks of data are added with update, and accumulators of
+    different chunks, e.g. from different processes, are combined with
+    merge. The labels need not be the same in all chunks.
+
+    Parameters
+    ----------
+    sketchsize : int
+        If larger than one, a quantile sketch with the quantiles at
+        sketchsize equally spaced probabilities is kept for each group and
+        variable. Merging sketches is approximate, see quantile.
+
+    Attributes
+    ----------
+    uniques : ndarray
+        sorted unique labels, or unique rows for 2d keys, None before the
+        first update
+    counts : ndarray (ngroups,)
+    mean, m2, min, max : ndarray (ngroups, nvars)
+
+    Notes
+    -----
+    Partial results are combined with the pairwise update formulas of
+    Chan, Golub and LeVeque for any number of parts at once
+
+        mean = sum(n_i * mean_i) / n
+        M2 = sum(M2_i) + sum(n_i * (mean_i - mean)**2)
+
+    which only adds the squared difference of the partial means, so the
+    precision is the same as for the two pass variance in each chunk.
+    The combined labels are factorized with GroupBy and the sums over parts
+    are group sums.
+
+    Example
+    -------
+    >>> acc = GroupAccumulator()
+    >>> for start in range(0, nobs, chunksize):
+    ...     acc.update(keys[start:start+chunksize], x[start:start+chunksize])
+    >>> acc.mean, acc.var(ddof=1)
+    '''
+    def __init__(self, sketchsize=0):
+        self.sketchsize = sketchsize
+        self.uniques = None
+        self.counts = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.sketch = None
+
+    def _fromdata(self, keys, values):
+        '''set the statistics of one chunk'''
+        values = np.asarray(values, float)
+        if values.ndim == 1:
+            values = values[:,np.newaxis]
+        g = GroupBy(keys)
+        self.uniques = g.uniques
+        self.counts = g.count()
+        self.mean = g.mean(values)
+        self.m2 = g.var(values) * self.counts[:,np.newaxis]
+        self.min = g.min(values)
+        self.max = g.max(values)
+        if self.sketchsize > 1:
+            prob = np.linspace(0, 1, self.sketchsize)
+            # (nq, ngroups, nvars) -> (ngroups, nvars, nq)
+            self.sketch = np.rollaxis(g.quantile(values, prob), 0, 3)
+        return self
+
+    def update(self, keys, values):
+        '''add a chunk of observations
+
+        Parameters
+        ----------
+        keys : array_like, 1d or 2d
+            group labels of the chunk, see GroupBy
+        values : array_like, 1d or 2d
+            values of the chunk, the number of variables has to be the
+            same in all chunks
+        '''
+        part = GroupAccumulator(self.sketchsize)._fromdata(keys, values)
+        return self.merge(part)
+
+    def merge(self, *others):
+        '''combine other accumulators into this one, returns self'''
+        parts = [acc for acc in (self,) + others if acc.uniques is not None]
+        if len(parts) == 0:
+            return self
+        if len(parts) == 1:
+            part = parts[0]
+        else:
+            part = _combine(parts, self.sketchsize)
+        for name in ['uniques', 'counts', 'mean', 'm2', 'min', 'max', 'sketch']:
+            setattr(self, name, getattr(part, name))
+        return self
+
+    def var(self, ddof=0):
+        '''variance in each group'''
+        return self.m2 / (self.counts - ddof)[:,np.newaxis]
+
+    def std(self, ddof=0):
+        '''standard deviation in each group'''
+        return np.sqrt(self.var(ddof=ddof))
+
+    def quantile(self, q):
+        '''approximate quantiles from the sketch
+
+        Within a chunk the sketch holds the exact quantiles at the
+        probabilities linspace(0, 1, sketchsize), other quantiles are
+        interpolated linearly. Merged sketches are the quantiles of the
+        count weighted mixture of the piecewise linear distribution
+        functions of the parts. min and max are exact.
+
+        Returns
+        -------
+        res : ndarray (ngroups, nvars) for scalar q, otherwise with an
+            additional first axis for q
+        '''
+        if self.sketch is None:
+            raise ValueError, 'quantiles require sketchsize > 1'
+        qarr = np.atleast_1d(np.asarray(q, float))
+        # piecewise linear interpolation at all q for all groups and variables
+        pos = qarr * (self.sketchsize - 1)
+        lo = np.minimum(np.floor(pos).astype(int), self.sketchsize - 2)
+        frac = pos - lo
+        sk = self.sketch
+        res = sk[...,lo] + frac * (sk[...,lo+1] - sk[...,lo])
+        res = np.rollaxis(res, 2)
+        if np.ndim(q) == 0:
+            res = res[0]
+        return res
+
+
+def _combine(parts, sketchsize):
+    '''combine the statistics of several GroupAccumulators'''
+    if parts[0].uniques.ndim == 2:
+        keys = np.vstack([acc.uniques for acc in parts])
+    else:
+        keys = np.concatenate([acc.uniques for acc in parts])
+    g = GroupBy(keys)
+    counts = np.concatenate([acc.counts for acc in parts]).astype(float)
+    means = np.vstack([acc.mean for acc in parts])
+    res = GroupAccumulator(sketchsize)
+    res.uniques = g.uniques
+    res.counts = g.sum(counts).round().astype(int)
+    res.mean = g.sum(counts[:,np.newaxis] * means) / res.counts[:,np.newaxis]
+    dev = means - res.mean[g.codes]
+    res.m2 = (g.sum(np.vstack([acc.m2 for acc in parts])) +
+              g.sum(counts[:,np.newaxis] * dev * dev))
+    res.min = g.min(np.vstack([acc.min for acc in parts]))
+    res.max = g.max(np.vstack([acc.max for acc in parts]))
+    if sketchsize > 1:
+        res.sketch = _combine_sketch(g, counts,
+                                     np.vstack([acc.sketch for acc in parts]),
+                                     sketchsize)
+    return res
+
+
+def _combine_sketch(g, counts, sketch, sketchsize):
+    '''quantiles of the mixture of the parts in each group
+
+    loops over groups and variables
+    '''
+    prob = np.linspace(0, 1, sketchsize)
+    order, starts = g._getorder()
+    ngroups, nvars = g.ngroups, sketch.shape[1]
+    res = np.empty((ngroups, nvars, sketchsize))
+    for gi in range(ngroups):
+        idx = order[starts[gi]:starts[gi] + g.counts[gi]]
+        if len(idx) == 1:
+            res[gi] = sketch[idx[0]]
+            continue
+        weights = counts[idx] / counts[idx].sum()
+        for vi in range(nvars):
+            qs = sketch[idx,vi]
+            points = np.unique1d(qs)
+            cdf = np.zeros(len(points))
+            for w, qi in zip(weights, qs):
+                cdf += w * np.interp(points, qi, prob)
+            res[gi,vi] = np.interp(prob, cdf, points)
+        res[gi,:,0] = sketch[idx,:,0].min(0)
+        res[gi,:,-1] = sketch[idx,:,-1].max(0)
+    return res
+
+
+def _chunk_stats(args):
+    '''statistics of one chunk, used by groupstats_chunked'''
+    keys, values, sketchsize = args
+    return GroupAccumulator(sketchsize)._fromdata(keys, values)
+
+
+def _npy_chunk_stats(args):
+    '''statistics of rows start:stop of a .npy file, used by groupstats_npy'''
+    fname, start, stop, keycols, valuecols, sketchsize = args
+    data = np.load(fname, mmap_mode='r')[start:stop]
+    return GroupAccumulator(sketchsize)._fromdata(np.asarray(data[:,keycols]),
+                                                  np.asarray(data[:,valuecols]))
+
+
+def _merge_all(results, sketchsize):
+    acc = GroupAccumulator(sketchsize)
+    return acc.merge(*results)
+
+
+def groupstats_chunked(chunks, keycols, valuecols, sketchsize=0, nprocs=None):
+    '''group statistics of data arriving in chunks
+
+    Parameters
+    ----------
+    chunks : iterable of 2d arrays
+        chunks of rows of the data, for example from iter_csv_chunks
+    keycols : int or list of int
+        column index or indices of the group labels
+    valuecols : int or list of int
+        column indices of the values
+    sketchsize : int
+        size of the quantile sketch, see GroupAccumulator
+    nprocs : None or int
+        If larger than one, the statistics of the chunks are computed in
+        a multiprocessing.Pool with nprocs processes and merged at the end.
+
+    Returns
+    -------
+    acc : GroupAccumulator
+    '''
+    tasks = ((chunk[:,keycols], chunk[:,valuecols], sketchsize)
+             for chunk in chunks)
+    if nprocs is None or nprocs < 2:
+        acc = GroupAccumulator(sketchsize)
+        for keys, values, sketchsize in tasks:
+            acc.update(keys, values)
+        return acc
+    import multiprocessing
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        results = list(pool.imap(_chunk_stats, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    return _merge_all(results, sketchsize)
+
+
+def groupstats_npy(fname, keycols, valuecols, chunksize=1000000,
+                   sketchsize=0, nprocs=None):
+    '''group statistics of a 2d array in a .npy file, read in chunks
+
+    The file is opened as a memory map, so only one chunk of rows per
+    process is in memory. With nprocs larger than one, each process reads
+    its own chunks from the file.
+
+    see groupstats_chunked for the other parameters
+    '''
+    nobs = np.load(fname, mmap_mode='r').shape[0]
+    tasks = [(fname, start, min(start + chunksize, nobs), keycols, valuecols,
+              sketchsize) for start in range(0, nobs, chunksize)]
+    if nprocs is None or nprocs < 2:
+        results = map(_npy_chunk_stats, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            results = pool.map(_npy_chunk_stats, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return _merge_all(results, sketchsize)
+
+
+def iter_csv_chunks(fname, chunksize=100000, delimiter=',', skiprows=0):
+    '''read a numerical text file in chunks of rows with np.loadtxt'''
+    import itertools
+    fh = open(fname)
+    try:
+        for i in range(skiprows):
+            fh.readline()
+        while True:
+            lines = list(itertools.islice(fh, chunksize))
+            if len(lines) == 0:
+                break
+            yield np.atleast_2d(np.loadtxt(lines, delimiter=delimiter))
+    finally:
+        fh.close()
+
+
+def check_groupby():
+    '''compare with loops over groups'''
+    from numpy.testing import assert_array_almost_equal, assert_array_equal
+    for keys in [np.random.randint(5, 15, size=200),
+                 np.random.randint(10**9, size=200),
+                 np.random.randint(3, size=200).astype(float) / 2,
+                 np.array(['a', 'bb', 'c'])[np.random.randint(3, size=200)]]:
+        x = np.random.randn(200, 3)
+        g = GroupBy(keys)
+        assert_array_equal(g.uniques, np.unique1d(keys))
+        assert_array_equal(g.uniques[g.codes], keys)
+        groups = [x[keys == u] for u in g.uniques]
+        assert_array_equal(g.count(), [len(xx) for xx in groups])
+        assert_array_almost_equal(g.sum(x), [xx.sum(0) for xx in groups], 12)
+        assert_array_almost_equal(g.mean(x), [xx.mean(0) for xx in groups], 12)
+        assert_array_almost_equal(g.var(x, ddof=1),
+                                  [xx.var(0, ddof=1) for xx in groups], 12)
+        assert_array_equal(g.min(x), [xx.min(0) for xx in groups])
+        assert_array_equal(g.max(x), [xx.max(0) for xx in groups])
+        assert_array_almost_equal(g.median(x), [np.median(xx, 0) for xx in groups], 12)
+        assert_array_almost_equal(g.mean(x[:,1]), g.mean(x)[:,1], 14)
+        q = g.quantile(x[:,0], [0, 0.3, 1])
+        assert_array_equal(q[0], g.min(x[:,0]))
+        assert_array_equal(q[2], g.max(x[:,0]))
+        g._maxloopgroups = 0
+        assert_array_almost_equal(g.quantile(x, [0.3, 0.5]),
+                                  [g.quantile(x, 0.3), g.median(x)], 14)
+
+    # precise sums for data with a large mean, NIST SmLs09 like
+    import math
+    from fractions import Fraction
+    keys = np.r_[np.arange(4), np.random.randint(4, size=496)]
+    x = 1000000000000.0 + np.random.randint(10, size=(500, 2)) / 10.
+    g = GroupBy(keys)
+    for k in range(4):
+        for j in range(2):
+            xk = x[keys==k, j]
+            exactsum = math.fsum(xk)
+            fr = [Fraction(v) for v in xk]
+            fmean = sum(fr) / len(fr)
+            exactvar = float(sum([(v - fmean)**2 for v in fr]) / (len(fr) - 1))
+            assert_array_almost_equal(g.sum(x, precise=True)[k,j] / exactsum, 1, 15)
+            assert_array_almost_equal(g.mean(x, precise=True)[k,j], float(fmean), 15)
+            assert_array_almost_equal(g.var(x, ddof=1, precise=True)[k,j] / exactvar,
+                                      1, 14)
+
+    # several key columns
+    keys = np.column_stack((np.random.randint(3, size=200),
+                            np.random.randint(10**9, 10**9+4, size=200)))
+    g = GroupBy(keys)
+    rows = sorted(set(map(tuple, keys)))
+    assert_array_equal(g.uniques, rows)
+    assert_array_equal(g.uniques[g.codes], keys)
+    assert_array_equal(g.count(), [np.all(keys == r, 1).sum() for r in rows])
+    # radix overflow, the combined key is compressed
+    keys = np.random.randint(3, size=(200, 50))
+    g = GroupBy(keys)
+    assert_array_equal(g.uniques[g.codes], keys)
+    assert_array_equal(g.uniques, sorted(set(map(tuple, keys))))
+
+
+def check_accumulator():
+    '''compare chunked and merged statistics with GroupBy'''
+    import os, tempfile
+    from numpy.testing import assert_array_almost_equal, assert_array_equal
+    nobs = 5000
+    keys = np.random.randint(20, size=nobs)
+    x = np.random.randn(nobs, 2)
+    data = np.column_stack((keys, x))
+    g = GroupBy(keys)
+
+    def compare(acc):
+        assert_array_equal(acc.uniques, g.uniques)
+        assert_array_equal(acc.counts, g.count())
+        assert_array_almost_equal(acc.mean, g.mean(x), 13)
+        assert_array_almost_equal(acc.var(ddof=1), g.var(x, ddof=1), 13)
+        assert_array_equal(acc.min, g.min(x))
+        assert_array_equal(acc.max, g.max(x))
+
+    chunks = [data[start:start+700] for start in range(0, nobs, 700)]
+    compare(groupstats_chunked(chunks, 0, [1, 2]))
+    compare(groupstats_chunked(chunks, 0, [1, 2], nprocs=2))
+    # merge in a different order
+    parts = [GroupAccumulator().update(c[:,0], c[:,1:]) for c in chunks]
+    compare(parts[-1].merge(*parts[:-1]))
+
+    fd, fname = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    try:
+        np.save(fname, data)
+        compare(groupstats_npy(fname, 0, [1, 2], chunksize=700, nprocs=2))
+        np.savetxt(fname, data, delimiter=',', fmt='%.17g')
+        compare(groupstats_chunked(iter_csv_chunks(fname, 700), 0, [1, 2]))
+    finally:
+        os.remove(fname)
+
+    # a single chunk has the exact quantiles on the sketch grid
+    acc = GroupAccumulator(sketchsize=5).update(keys, x)
+    assert_array_almost_equal(acc.quantile([0, 0.25, 0.5, 1]),
+                              g.quantile(x, [0, 0.25, 0.5, 1]), 13)
+    acc = groupstats_chunked(chunks, 0, [1, 2], sketchsize=101)
+    assert np.all(np.abs(acc.quantile(0.5) - g.median(x)) < 0.1)
+
+
+if __name__ == '__main__':
+    check_groupby()
+    check_accumulator()
+
+    import time
+    nobs, nvars, ngroups = 1000000, 50, 1000
+    keys = np.random.randint(ngroups, size=nobs)
+    x = np.random.randn(nobs, nvars)
+    t0 = time.time()
+    g = GroupBy(keys)
+    print 'factorize', time.time() - t0
+    for name in ['sum', 'mean', 'var', 'min', 'max', 'median']:
+        t0 = time.time()
+        res = getattr(g, name)(x)
+        print name, res.shape, time.time() - t0
+    t0 = time.time()
+    for i in range(nvars):
+        ix, rind = np.unique1d(keys, return_inverse=1)
+        np.bincount(rind, weights=x[:,i]) / np.bincount(rind)
+    print 'unique1d and bincount for each column', time.time() - t0
+
+    # the same statistics from chunks of 100000 rows
+    data = np.column_stack((keys, x[:,:5]))
+    t0 = time.time()
+    acc = groupstats_chunked((data[i:i+100000] for i in range(0, nobs, 100000)),
+                             0, range(1, 6))
+    print 'chunked mean and var', time.time() - t0,
+    print np.abs(acc.var() - g.var(x[:,:5])).max()
+
+    # overhead of precise=True, and error for data with a large mean
+    nobs, nvars = 1000000, 10
+    x = 1e9 + np.random.randn(nobs, nvars)
+    for ngroups in [10, 1000, 100000]:
+        keys = np.random.randint(ngroups, size=nobs)
+        g = GroupBy(keys)
+        g.mean(x)
+        g._getorder()
+        print 'ngroups', ngroups
+        for name in ['sum', 'mean', 'var']:
+            t0 = time.time()
+            getattr(g, name)(x)
+            t1 = time.time()
+            getattr(g, name)(x, precise=True)
+            t2 = time.time()
+            print '    %-4s fast %6.3f  precise %6.3f  ratio %4.1f' % (name,
+                                  t1 - t0, t2 - t1, (t2 - t1) / (t1 - t0))
+    g = GroupBy(keys[:10000] % 10)
+    exactvar = g.var(x[:10000] - 1e9)
+    for precise in [False, True]:
+        print 'precise=%s max relative error of var' % precise,
+        print np.abs(g.var(x[:10000], precise=precise) / exactvar - 1).max()
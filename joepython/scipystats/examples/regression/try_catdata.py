@@ -22,6 +22,7 @@ somewhere I have certified test results for balanced anova from nist
 '''
 
 from scipy import ndimage
+from groupby import GroupBy
 
 #problem: ndimage does not allow axis argument,
 #   calculates mean or var corresponding to axis=None in np.mean, np.var
@@ -68,15 +69,22 @@ def labelmeanfilter_str(ys, x):
     return arr3
 
 def groupstatsbin(factors, values):
-    '''uses np.bincount, assumes factors/labels are integers
+    '''group count, mean and variance, and mean and variance by observation
+
+    factors are labels, integers or strings. values can be 2d with
+    variables in columns. Uses groupby.GroupBy, which factorizes the labels
+    once for all columns. A GroupBy instance can be passed as factors to
+    reuse the factorization.
     '''
-    n = len(factors)
-    ix,rind = np.unique1d(factors, return_inverse=1)
-    gcount = np.bincount(rind)
-    gmean = np.bincount(rind, weights=values)/ (1.0*gcount)
-    meanarr = gmean[rind]
-    withinvar = np.bincount(rind, weights=(values-meanarr)**2) / (1.0*gcount)
-    withinvararr = withinvar[rind]
+    if isinstance(factors, GroupBy):
+        g = factors
+    else:
+        g = GroupBy(factors)
+    gcount = g.count()
+    gmean = g.mean(values)
+    meanarr = g.expand(gmean)
+    withinvar = g.var(values)
+    withinvararr = g.expand(withinvar)
     return gcount, gmean , meanarr, withinvar, withinvararr
 
 
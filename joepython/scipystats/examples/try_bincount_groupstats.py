@@ -4,6 +4,7 @@ group statistics using np.bincout
 '''
 
 import numpy as np
+from regression.groupby import GroupBy
 
 indices = np.random.randint(3,size=20)
 values = np.arange(20) #np.ones(20)
@@ -16,13 +17,13 @@ s1 = np.bincount(reverse_index, weights=values)
 print np.all(rind==reverse_index)
 
 def groupstatsbin(factors, values):
-    n = len(factors)
-    ix,rind = np.unique1d(factors, return_inverse=1)
-    gcount = np.bincount(rind)
-    gmean = np.bincount(rind, weights=values)/ (1.0*gcount)
-    meanarr = gmean[rind]
-    withinvar = np.bincount(rind, weights=(values-meanarr)**2) / (1.0*gcount)
-    withinvararr = withinvar[rind]
+    # factorize once, values can be 2d, see regression/groupby.py
+    g = GroupBy(factors)
+    gcount = g.count()
+    gmean = g.mean(values)
+    meanarr = g.expand(gmean)
+    withinvar = g.var(values)
+    withinvararr = g.expand(withinvar)
     return gcount, gmean , meanarr, withinvar, withinvararr
 
 
@@ -40,3 +41,10 @@ print np.sum(values[indices==0]**2)
 print withinvar
 print ((values-meanarr)**2)[indices==0].mean()
 print withinvararr[indices==0][:10]
+
+print 'several columns, one factorization'
+values2 = np.column_stack((values, values**2))
+g = GroupBy(indices)
+print g.mean(values2)
+print g.min(values2), g.max(values2)
+print g.median(values2)
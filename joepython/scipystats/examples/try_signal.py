@@ -1,8 +1,8 @@
 '''ARMA estimation: using signal.lfilter and optimize.leastsquares
 
 seems to work
-TODO: get full ML estimate, what's the likelihood function for initial observation, need
-      stationary distribution
+exact ML estimate: ARIMA.fit_mle uses the exact loglikelihood of arma_loglike,
+      Kalman filter initialized with the stationary distribution
 '''
 
 import numpy as np
@@ -164,6 +164,290 @@ resultfmin = optimize.fmin(errssfn, [0.5, 0.5])
 print 'fminLS ARMA(1,1)', resultfmin
 
 
+def _arma_statespace(arparams, maparams):
+    '''transition matrix and shock loading of ARMA(p,q) in Harvey's form
+
+    y_t = sum_i arparams[i-1] y_{t-i} + e_t + sum_j maparams[j-1] e_{t-j}
+
+    state alpha_t of dimension r = max(p, q+1), y_t = alpha_t[0],
+    alpha_{t+1} = T alpha_t + R e_{t+1}
+    '''
+    p, q = len(arparams), len(maparams)
+    r = max(p, q+1)
+    T = np.zeros((r, r))
+    T[:p,0] = arparams
+    T[:-1,1:] = np.eye(r-1)
+    R = np.zeros(r)
+    R[0] = 1
+    R[1:q+1] = maparams
+    return T, R
+
+def _lfiltic2d(b, a, yprev, xprev):
+    '''initial conditions for lfilter along axis 0 for many series
+
+    same as signal.lfiltic for each column, yprev and xprev have the past
+    outputs and inputs in the rows, most recent first. zi is empty if both
+    filters have only the lag zero coefficient.
+    '''
+    M, N = len(b) - 1, len(a) - 1
+    zi = np.zeros((max(M, N),) + xprev.shape[1:])
+    for m in range(M):
+        zi[m] += np.dot(b[m+1:], xprev[:M-m])
+    for m in range(N):
+        zi[m] -= np.dot(a[m+1:], yprev[:N-m])
+    return zi
+
+def arma_kalman_innovations(y, arparams, maparams, tol=1e-10):
+    '''innovations of ARMA(p,q) from the Kalman filter, with unit variance
+
+    Parameters
+    ----------
+    y : array_like, 1d or 2d
+        time series, 2d arrays have one series in each column
+    arparams, maparams : array_like
+        lag coefficients, see _arma_statespace, the AR part needs to be
+        stationary
+    tol : float
+        tolerance for the convergence of the innovation variance to one
+
+    Returns
+    -------
+    v : ndarray
+        one step ahead prediction errors, same shape as y
+    f : ndarray, 1d
+        variance of the prediction errors divided by sigma2
+    nfilter : int
+        number of time periods that used the Kalman filter updating
+
+    Notes
+    -----
+    The state is initialized with the stationary distribution, so that the
+    likelihood is exact. The covariance recursion does not depend on the
+    data and is calculated once for all series, the state means are
+    updated for all series together.
+    Once f_t is within tol of one, the covariance has converged to the
+    steady state R R', and the remaining innovations satisfy the
+    recursion of the conditional sum of squares. They are calculated with
+    signal.lfilter, using the last observations and innovations of the
+    Kalman filter as initial conditions. If the MA part is not invertible,
+    f does not converge to one and the Kalman filter is used for all
+    observations.
+    '''
+    y = np.asarray(y, float)
+    is1d = (y.ndim == 1)
+    if is1d:
+        y = y[:,np.newaxis]
+    arparams = np.atleast_1d(np.asarray(arparams, float))
+    maparams = np.atleast_1d(np.asarray(maparams, float))
+    nobs = y.shape[0]
+    T, R = _arma_statespace(arparams, maparams)
+    r = len(R)
+    RR = np.outer(R, R)
+    # stationary covariance, P = T P T' + R R'
+    P = np.linalg.solve(np.eye(r*r) - np.kron(T, T), RR.ravel()).reshape(r, r)
+    a = np.zeros((r, y.shape[1]))
+    v = np.zeros(y.shape)
+    f = np.ones(nobs)
+    t = 0
+    while t < nobs:
+        ft = P[0,0]
+        f[t] = ft
+        if abs(ft - 1) < tol:
+            break
+        v[t] = y[t] - a[0]
+        K = np.dot(T, P[:,0]) / ft
+        a = np.dot(T, a) + K[:,np.newaxis] * v[t]
+        P = np.dot(np.dot(T, P), T.T) - np.outer(K, K) * ft + RR
+        t += 1
+    nfilter = t
+    if t < nobs:
+        # steady state, v = ma(L)^-1 ar(L) y
+        b = np.r_[1, -arparams]
+        c = np.r_[1, maparams]
+        p, q = len(arparams), len(maparams)
+        xprev = np.zeros((p,) + y.shape[1:])
+        yprev = np.zeros((q,) + y.shape[1:])
+        nx, ny = min(p, t), min(q, t)
+        xprev[:nx] = y[t-1::-1][:nx]
+        yprev[:ny] = v[t-1::-1][:ny]
+        zi = _lfiltic2d(b, c, yprev, xprev)
+        if len(zi) > 0:
+            v[t:] = signal.lfilter(b, c, y[t:], axis=0, zi=zi)[0]
+        else:
+            # white noise, ARMA(0,0), no filter state
+            v[t:] = signal.lfilter(b, c, y[t:], axis=0)
+    if is1d:
+        v = v[:,0]
+    return v, f, nfilter
+
+def arma_loglike(y, arparams, maparams, sigma2=None, tol=1e-10):
+    '''exact Gaussian loglikelihood of ARMA(p,q) for each series
+
+    Parameters
+    ----------
+    y : array_like, 1d or 2d
+        time series with mean zero, 2d arrays have one series in each
+        column
+    arparams, maparams : array_like
+        lag coefficients, see _arma_statespace
+    sigma2 : None, float or array
+        variance of the shocks. If None, then sigma2 is concentrated out
+        and its maximum likelihood estimate is returned.
+    tol : float
+        see arma_kalman_innovations
+
+    Returns
+    -------
+    llf : float or ndarray
+        loglikelihood of each series
+    sigma2 : float or ndarray
+        given or estimated variance of the shocks
+    '''
+    v, f, nfilter = arma_kalman_innovations(y, arparams, maparams, tol=tol)
+    nobs = v.shape[0]
+    fs = f if v.ndim == 1 else f[:,np.newaxis]
+    ssr = (v**2 / fs).sum(0)
+    if sigma2 is None:
+        sigma2 = ssr / nobs
+    llf = -0.5 * (nobs * np.log(2*np.pi*sigma2) + np.log(f).sum() +
+                  ssr / sigma2)
+    return llf, sigma2
+
+def check_arma_loglike():
+    '''compare arma_loglike with the likelihood of the full covariance'''
+    from numpy.testing import assert_array_almost_equal
+    from scipy import linalg
+    nobs = 30
+    for arparams, maparams in [([0.8], [0.5]), ([0.5, -0.3], []),
+                               ([], [0.4]), ([], [])]:
+        y = signal.lfilter(np.r_[1, maparams], np.r_[1, -np.array(arparams)],
+                           np.random.randn(nobs, 2), axis=0)
+        llf, sigma2 = arma_loglike(y, arparams, maparams, sigma2=1.3)
+        # autocovariance from the MA(infinity) representation
+        impulse = np.zeros(500)
+        impulse[0] = 1
+        psi = signal.lfilter(np.r_[1, maparams],
+                             np.r_[1, -np.array(arparams)], impulse)
+        acov = np.array([np.dot(psi[:len(psi)-h], psi[h:])
+                         for h in range(nobs)])
+        chol = linalg.cholesky(1.3 * linalg.toeplitz(acov), lower=True)
+        z = linalg.solve_triangular(chol, y, lower=True)
+        llf_full = -0.5 * (nobs * np.log(2*np.pi) + (z**2).sum(0)) - \
+                   np.log(np.diag(chol)).sum()
+        assert_array_almost_equal(llf, llf_full, 8)
+
+
+def _lagcols(x, nlags):
+    '''lags 1..nlags of 1d x as columns, zero presample values'''
+    lags = np.zeros((len(x), nlags))
+    for i in range(1, nlags+1):
+        lags[i:,i-1] = x[:-i]
+    return lags
+
+def _css_columns(args):
+    '''conditional least squares for each column, used by arma_css_batch
+
+    args is the tuple (y, p, q), a single argument to work with Pool.map
+    '''
+    y, p, q = args
+    nobs, nseries = y.shape
+    k = p + q
+    params = np.zeros((nseries, k))
+    cov = np.zeros((nseries, k, k))
+    ssr = np.zeros(nseries)
+    resid = np.zeros((nobs - p, nseries))
+    for i in range(nseries):
+        ylags = _lagcols(y[:,i], p)[p:]
+        yi = y[p:,i]
+        last = {}
+
+        def resid_fn(prm):
+            u = yi - np.dot(ylags, prm[:p])
+            e = signal.lfilter([1.], np.r_[1., prm[p:]], u)
+            last['prm'], last['e'] = prm.copy(), e
+            return e
+
+        def jac_fn(prm):
+            # derivatives of the residuals are -mafilter of the lags
+            if 'prm' in last and np.all(last['prm'] == prm):
+                e = last['e']
+            else:
+                e = resid_fn(prm)
+            X = np.column_stack([ylags, _lagcols(e, q)])
+            return -signal.lfilter([1.], np.r_[1., prm[p:]], X, axis=0)
+
+        if q == 0:
+            prm = np.linalg.lstsq(ylags, yi)[0]
+        else:
+            prm = optimize.leastsq(resid_fn, np.zeros(k), Dfun=jac_fn)[0]
+        e = resid_fn(prm)
+        jac = jac_fn(prm)
+        params[i] = prm
+        resid[:,i] = e
+        ssr[i] = np.dot(e, e)
+        cov[i] = np.linalg.pinv(np.dot(jac.T, jac))
+    return params, cov, ssr, resid
+
+def arma_css_batch(y, p, q, nprocs=None):
+    '''conditional least squares ARMA(p,q) estimates for many series
+
+    y_t = sum_i arparams[i-1] y_{t-i} + e_t + sum_j maparams[j-1] e_{t-j}
+
+    Parameters
+    ----------
+    y : array_like, 2d (T, N)
+        time series in columns, each series has its own parameters
+    p, q : int
+        number of AR and MA lags
+    nprocs : None or int
+        If larger than one, the series are split into chunks that are
+        estimated by a multiprocessing.Pool with nprocs processes.
+
+    Returns
+    -------
+    params : ndarray (N, p+q)
+        arparams followed by maparams for each series
+    cov : ndarray (N, p+q, p+q)
+        covariance matrix of the parameter estimates
+    sigma2 : ndarray (N,)
+        residual variance, sum of squares divided by T-p-(p+q)
+    resid : ndarray (T-p, N)
+        residuals, conditional on the first p observations and zero
+        presample errors
+
+    Notes
+    -----
+    The least squares problem is block diagonal with one block per series.
+    signal.lfilter applies the same coefficients to all columns, so each
+    block is solved by optimize.leastsq, with the residuals and the
+    analytic Jacobian, the inverse MA filter of the lagged observations
+    and residuals, calculated by lfilter, one call for all columns of the
+    Jacobian. Pure AR models are estimated by OLS.
+    '''
+    y = np.asarray(y, float)
+    if y.ndim == 1:
+        y = y[:,np.newaxis]
+    nobs, nseries = y.shape
+    if nprocs is None or nprocs < 2 or nseries < 2:
+        params, cov, ssr, resid = _css_columns((y, p, q))
+    else:
+        import multiprocessing
+        chunks = [idx for idx in np.array_split(np.arange(nseries), 4*nprocs)
+                  if idx.size > 0]
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            res = pool.map(_css_columns, [(y[:,idx], p, q) for idx in chunks])
+        finally:
+            pool.close()
+            pool.join()
+        params, cov, ssr, resid = zip(*res)
+        params, cov, ssr = [np.concatenate(r) for r in (params, cov, ssr)]
+        resid = np.column_stack(resid)
+    sigma2 = ssr / (nobs - p - (p + q))
+    cov *= sigma2[:,np.newaxis,np.newaxis]
+    return params, cov, sigma2, resid
+
+
 class ARIMA(object):
     '''currently ARMA only, no differencing used - no I'''
     def __init__(self):
@@ -201,6 +485,37 @@ class ARIMA(object):
         #print rho,np.sum(etahatr*etahatr)
         return etahatr
 
+    def fit_mle(self, x, p, q, start_params=None):
+        '''exact maximum likelihood estimate with the Kalman filter
+
+        y_t = sum_i arparams[i-1] y_{t-i} + e_t + sum_j maparams[j-1] e_{t-j}
+
+        x can be 2d with one series in each column, the series have common
+        parameters. sigma2 is concentrated out of the likelihood.
+        Parameter values with a nonstationary AR part are rejected.
+
+        Returns
+        -------
+        params : ndarray
+            arparams and maparams, also stored as attributes together
+            with sigma2 and llf
+        '''
+        x = np.asarray(x, float)
+        if start_params is None:
+            start_params = np.zeros(p+q)
+
+        def nloglike(params):
+            arparams, maparams = params[:p], params[p:]
+            if p > 0 and np.any(np.abs(np.roots(np.r_[1, -arparams])) >= 1):
+                return np.inf
+            return -arma_loglike(x, arparams, maparams)[0].sum()
+
+        params = optimize.fmin(nloglike, start_params, xtol=1e-6,
+                               ftol=1e-10, maxfun=5000, disp=0)
+        self.arparams, self.maparams = params[:p], params[p:]
+        self.llf, self.sigma2 = arma_loglike(x, self.arparams, self.maparams)
+        return params
+
     def generate_sample(self,ar,ma,std,nsample):
         eta = std * np.random.randn(nsample)
         return signal.lfilter(ar, ma, eta)
@@ -233,3 +548,18 @@ print np.var(err3)
 print arest3.rhoy
 print arest3.rhoe
 
+if __name__ == '__main__':
+    check_arma_loglike()
+
+    # exact maximum likelihood with the Kalman filter
+    ar = [1.0, -0.8]
+    ma = [1.0,  0.5]
+    y4 = signal.lfilter(ma, ar, 0.1 * np.random.randn(1000, 5), axis=0)
+    print arma_loglike(y4, [0.8], [0.5])
+    arest4 = ARIMA()
+    print arest4.fit_mle(y4[:,0], 1, 1), arest4.sigma2
+
+    # conditional least squares for many series with separate parameters
+    y5 = signal.lfilter(ma, ar, 0.1 * np.random.randn(1000, 20), axis=0)
+    params5, cov5, sigma25, resid5 = arma_css_batch(y5, 1, 1)
+    print params5.mean(0), np.sqrt(cov5[:,[0,1],[0,1]]).mean(0)